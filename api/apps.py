@@ -6,3 +6,10 @@ from django.apps import AppConfig
 
 class ApiConfig(AppConfig):
     name = 'api'
+
+    def ready(self):
+        from django.core.signals import request_started
+        from django.db.backends.signals import connection_created
+        from api import db
+        connection_created.connect(db.connection_created)
+        request_started.connect(db.check_connections)
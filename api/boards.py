@@ -0,0 +1,399 @@
+# -*- coding: utf-8 -*-
+"""
+Packed board representation used by the Game model.
+
+A board of rows x cols fields is a row major bytearray with one byte per field:
+
+- bits 0-3: number of adjacent mines (0-8)
+- bit 4: the field has a mine
+- bits 5-6: what the player sees (hidden, visible, question mark or flag)
+"""
+from __future__ import unicode_literals
+import json
+import random
+from array import array
+from itertools import islice
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+ADJACENT_MASK = 0x0f
+MINE = 0x10
+MARK_MASK = 0x60
+
+HIDDEN = 0x00
+VISIBLE = 0x20
+QUESTION = 0x40
+FLAG = 0x60
+
+MASK64 = 0xffffffffffffffff
+GOLDEN64 = 0x9e3779b97f4a7c15
+
+# Legacy JSON player_board characters
+PLAYER_CODES = {'h': HIDDEN, 'v': VISIBLE, '?': QUESTION, '!': FLAG}
+PLAYER_CHARS = dict((code, char) for char, code in PLAYER_CODES.items())
+
+
+def _view_char(cell):
+    """Returns what the player sees in a field (see GameViewSet for the board_view format)"""
+    mark = cell & MARK_MASK
+    if mark == VISIBLE:
+        return 'x' if cell & MINE else str(cell & ADJACENT_MASK)
+    if mark == HIDDEN:
+        return ' '
+    return PLAYER_CHARS[mark]
+
+
+# Lookup table to render a whole row with bytes.translate
+VIEW_TABLE = bytes(bytearray(ord(_view_char(cell)) if cell & ADJACENT_MASK <= 8 else ord(' ')
+                             for cell in range(256)))
+
+# Tables to count fields with bytes.translate and bytes.count
+MINE_TABLE = bytes(bytearray(1 if cell & MINE else 0 for cell in range(256)))
+HIDDEN_SAFE_TABLE = bytes(bytearray(1 if not cell & MINE and cell & MARK_MASK != VISIBLE else 0
+                                    for cell in range(256)))
+
+# Keeps only what the player sees of each field (see Board.marks)
+MARKS_TABLE = bytes(bytearray(cell & MARK_MASK for cell in range(256)))
+
+BASE36 = '0123456789abcdefghijklmnopqrstuvwxyz'
+
+
+def new_seed():
+    """Returns a random seed for Board.generate"""
+    return random.getrandbits(63)
+
+
+def _mine_indexes(area, mines, seed, exclude):
+    """
+    Picks the fields with a mine: every field gets a key from the seed (splitmix64 of seed + (index + 1) * golden)
+    and the mines go to the fields with the smallest keys. The keys are unique, so the result only depends on the
+    arguments, with or without numpy.
+    """
+    seed &= MASK64
+    allowed = area - len(exclude)
+    slack = 1
+    while True:
+        # Keys are uniform, so only the fields under a threshold a bit above the expected key of the last mine are
+        # sorted. The threshold is doubled in the (unlikely) case that there are not enough of them.
+        threshold = min(MASK64, (mines + 4 * int(mines ** 0.5) + 16) * slack * (MASK64 // allowed))
+        picked = []
+        for i in range(area):
+            z = (seed + (i + 1) * GOLDEN64) & MASK64
+            z = ((z ^ (z >> 30)) * 0xbf58476d1ce4e5b9) & MASK64
+            z = ((z ^ (z >> 27)) * 0x94d049bb133111eb) & MASK64
+            z ^= z >> 31
+            if z <= threshold and i not in exclude:
+                picked.append((z, i))
+        if len(picked) >= mines:
+            picked.sort()
+            return [i for z, i in picked[:mines]]
+        slack *= 2
+
+
+def _generate_python(rows, cols, mines, seed, exclude):
+    cells = bytearray(rows * cols)
+    for i in _mine_indexes(rows * cols, mines, seed, exclude):
+        cells[i] = 1
+    # Mines in each field and its left and right neighbours, then the rows above and below are added
+    around = []
+    for y in range(rows):
+        row = cells[y * cols:(y + 1) * cols]
+        around.append([left + mine + right for left, mine, right in zip(b'\0' + row[:-1], row, row[1:] + b'\0')])
+    nothing = [0] * cols
+    for y in range(rows):
+        above = around[y - 1] if y > 0 else nothing
+        below = around[y + 1] if y < rows - 1 else nothing
+        row = cells[y * cols:(y + 1) * cols]
+        cells[y * cols:(y + 1) * cols] = bytes(bytearray(
+            MINE if mine else up + side + down
+            for mine, up, side, down in zip(row, above, around[y], below)))
+    return Board(rows, cols, cells)
+
+
+def _numpy_keys(candidates, seed):
+    """Keys of the candidate field indexes (numpy.uint64 array), as in _mine_indexes"""
+    with numpy.errstate(over='ignore'):
+        z = numpy.uint64(seed & MASK64) + (candidates + numpy.uint64(1)) * numpy.uint64(GOLDEN64)
+        z = (z ^ (z >> numpy.uint64(30))) * numpy.uint64(0xbf58476d1ce4e5b9)
+        z = (z ^ (z >> numpy.uint64(27))) * numpy.uint64(0x94d049bb133111eb)
+        z ^= z >> numpy.uint64(31)
+    return z
+
+
+def _generate_numpy(rows, cols, mines, seed, exclude):
+    """Same layout as _generate_python: one selection over all the keys, adjacency as a sum of shifted grids"""
+    area = rows * cols
+    allowed = numpy.ones(area, dtype=bool)
+    allowed[list(exclude)] = False
+    candidates = numpy.flatnonzero(allowed).astype(numpy.uint64)
+    z = _numpy_keys(candidates, seed)
+    if mines < len(candidates):
+        candidates = candidates[numpy.argpartition(z, mines - 1)[:mines]]
+
+    mine = numpy.zeros(area, dtype=numpy.uint8)
+    mine[candidates.astype(numpy.intp)] = 1
+    mine = mine.reshape(rows, cols)
+    padded = numpy.pad(mine, 1, mode='constant')
+    adjacent = numpy.zeros((rows, cols), dtype=numpy.uint8)
+    for dy in range(3):
+        for dx in range(3):
+            if dy != 1 or dx != 1:
+                adjacent += padded[dy:dy + rows, dx:dx + cols]
+    cells = numpy.where(mine, numpy.uint8(MINE), adjacent).astype(numpy.uint8)
+    return Board(rows, cols, cells.tobytes())
+
+
+def spare_indexes(area, mines, seed, count=9):
+    """
+    Returns the count fields (fewer if the board has no room) that follow the mines in the order of the seed,
+    first to last. With them a board generated without exclude can be changed into the one generated with an
+    exclude of up to count fields (see Board.move_mines).
+    """
+    count = min(count, area - mines)
+    if not count:
+        return []
+    if numpy is not None:
+        z = _numpy_keys(numpy.arange(area, dtype=numpy.uint64), seed)
+        first = numpy.argpartition(z, mines + count - 1)[:mines + count]
+        first = first[numpy.argsort(z[first])]
+        return [int(i) for i in first[mines:]]
+    return _mine_indexes(area, mines + count, seed, frozenset())[mines:]
+
+
+def first_exclude(rows, cols, mines, first):
+    """
+    Returns the field indexes kept free of mines when the first field revealed is first: that field and its adjacent
+    fields, or only that field if there is no room for the mines otherwise
+    """
+    y, x = divmod(first, cols)
+    exclude = [row * cols + col for row in range(max(0, y - 1), min(rows, y + 2))
+               for col in range(max(0, x - 1), min(cols, x + 2))]
+    return exclude if mines <= rows * cols - len(exclude) else [first]
+
+
+def _base36(number):
+    digits = []
+    while True:
+        number, digit = divmod(number, 36)
+        digits.append(BASE36[digit])
+        if not number:
+            return ''.join(reversed(digits))
+
+
+def board_id(rows, cols, mines, seed, first=None):
+    """
+    Returns the id of the board placed by the seed: ROWSxCOLUMNSxMINES-SEED, with the seed in base 36, and -FIRST
+    (base 36 too) when the first field revealed is fixed, which fixes the mine layout (see Board.layout)
+    """
+    parts = ['%dx%dx%d' % (rows, cols, mines), _base36(seed)]
+    if first is not None:
+        parts.append(_base36(first))
+    return '-'.join(parts)
+
+
+def parse_board_id(value):
+    """Returns (rows, cols, mines, seed, first) of a board id, first is None if it has none. Raises ValueError"""
+    parts = value.strip().lower().split('-')
+    if len(parts) not in (2, 3):
+        raise ValueError('Expected ROWSxCOLUMNSxMINES-SEED or ROWSxCOLUMNSxMINES-SEED-FIRST')
+    sizes = parts[0].split('x')
+    if len(sizes) != 3:
+        raise ValueError('Expected ROWSxCOLUMNSxMINES-SEED or ROWSxCOLUMNSxMINES-SEED-FIRST')
+    rows, cols, mines = [int(number) for number in sizes]
+    seed = int(parts[1], 36)
+    first = int(parts[2], 36) if len(parts) == 3 else None
+    if seed > 2 ** 63 - 1 or (first is not None and first >= rows * cols):
+        raise ValueError('The seed or the first field is out of range')
+    return rows, cols, mines, seed, first
+
+
+def pack_indexes(indexes):
+    return array(str('I'), indexes).tobytes()
+
+
+def unpack_indexes(data):
+    indexes = array(str('I'))
+    indexes.frombytes(bytes(data))
+    return list(indexes)
+
+
+class Board(object):
+    """Board of rows x cols fields backed by a packed bytearray"""
+
+    def __init__(self, rows, cols, cells=None):
+        self.rows = rows
+        self.cols = cols
+        self.cells = bytearray(cells) if cells is not None else bytearray(rows * cols)
+
+    @classmethod
+    def generate(cls, rows, cols, mines, seed, exclude=()):
+        """
+        Returns a new board with every field hidden and the mines placed by the seed.
+        No mine is placed in the excluded field indexes. Uses numpy when it is installed.
+        """
+        exclude = frozenset(exclude)
+        assert mines < rows * cols  # to make sure that there are fewer mines than fields
+        assert mines <= rows * cols - len(exclude)
+        if mines == 0:
+            return cls(rows, cols)
+        if numpy is not None:
+            return _generate_numpy(rows, cols, mines, seed, exclude)
+        return _generate_python(rows, cols, mines, seed, exclude)
+
+    @classmethod
+    def layout(cls, rows, cols, mines, seed, first):
+        """Returns the board of a game by the seed whose first revealed field was first (see first_exclude)"""
+        return cls.generate(rows, cols, mines, seed, first_exclude(rows, cols, mines, first))
+
+    @classmethod
+    def from_lists(cls, board, player_board):
+        """Packs a board matrix (0-8 or x) and a player_board matrix (v, h, ? or !)"""
+        rows, cols = len(board), len(board[0])
+        cells = bytearray(rows * cols)
+        i = 0
+        for board_row, player_row in zip(board, player_board):
+            for value, mark in zip(board_row, player_row):
+                cells[i] = (MINE if value == 'x' else int(value)) | PLAYER_CODES[mark]
+                i += 1
+        return cls(rows, cols, cells)
+
+    @classmethod
+    def from_json(cls, board, player_board):
+        """Decodes the legacy JSON columns of a game"""
+        return cls.from_lists(json.loads(board), json.loads(player_board))
+
+    def to_json(self):
+        """Encodes the board as the legacy JSON columns. Returns (board, player_board)"""
+        board, player_board = [], []
+        for y in range(self.rows):
+            row = self.cells[y * self.cols:(y + 1) * self.cols]
+            board.append(['x' if cell & MINE else str(cell & ADJACENT_MASK) for cell in row])
+            player_board.append([PLAYER_CHARS[cell & MARK_MASK] for cell in row])
+        return json.dumps(board), json.dumps(player_board)
+
+    def adjacent(self, i):
+        """Returns the indexes of the fields adjacent to the field at index i"""
+        cols = self.cols
+        y, x = divmod(i, cols)
+        points = []
+        if y > 0:
+            points.append(i - cols)
+            if x > 0:
+                points.append(i - cols - 1)
+            if x < cols - 1:
+                points.append(i - cols + 1)
+        if y < self.rows - 1:
+            points.append(i + cols)
+            if x > 0:
+                points.append(i + cols - 1)
+            if x < cols - 1:
+                points.append(i + cols + 1)
+        if x > 0:
+            points.append(i - 1)
+        if x < cols - 1:
+            points.append(i + 1)
+        return points
+
+    def _set_mine(self, i, mine):
+        """Adds or removes the mine of field i, updating the adjacent mine counts"""
+        cells = self.cells
+        adjacent = self.adjacent(i)
+        step = 1 if mine else -1
+        for j in adjacent:
+            if not cells[j] & MINE:
+                cells[j] += step
+        if mine:
+            cells[i] = MINE | (cells[i] & MARK_MASK)
+        else:
+            cells[i] = sum(1 for j in adjacent if cells[j] & MINE) | (cells[i] & MARK_MASK)
+
+    def move_mines(self, exclude, spares):
+        """
+        Moves the mines out of the excluded field indexes to the first spare fields that are not excluded.
+        On a board generated with a seed and the spare_indexes of that seed, the result is the board generated with
+        the seed and exclude.
+        """
+        exclude = frozenset(exclude)
+        moved = [i for i in exclude if self.cells[i] & MINE]
+        for i in moved:
+            self._set_mine(i, False)
+        for i in islice((i for i in spares if i not in exclude), len(moved)):
+            self._set_mine(i, True)
+
+    def is_mine(self, x, y):
+        return bool(self.cells[y * self.cols + x] & MINE)
+
+    def mark(self, x, y, mark):
+        """
+        Sets the mark (HIDDEN, QUESTION or FLAG) of a field. Revealed fields keep showing their value.
+        Returns whether the field changed
+        """
+        i = y * self.cols + x
+        if self.cells[i] & MARK_MASK in (VISIBLE, mark):
+            return False
+        self.cells[i] = (self.cells[i] & ~MARK_MASK) | mark
+        return True
+
+    def reveal(self, x, y):
+        """
+        Reveals the field in point (x,y) and, through fields without adjacent mines, every field reachable from it.
+        Returns the list of newly revealed points (x,y).
+        """
+        cells = self.cells
+        revealed = []
+        stack = [y * self.cols + x]
+        while stack:
+            i = stack.pop()
+            cell = cells[i]
+            if cell & MARK_MASK == VISIBLE:
+                continue
+            cells[i] = (cell & ~MARK_MASK) | VISIBLE
+            revealed.append(i)
+            if not cell & (MINE | ADJACENT_MASK):
+                stack.extend(j for j in self.adjacent(i) if cells[j] & MARK_MASK != VISIBLE)
+        return [(i % self.cols, i // self.cols) for i in revealed]
+
+    def marks(self):
+        """Returns what the player sees of each field (the mark bits only), the state of a seeded game"""
+        return bytes(self.cells).translate(MARKS_TABLE)
+
+    def add_marks(self, marks):
+        """Adds the marks (see marks) to a board without marks, such as a layout"""
+        size = len(self.cells)
+        # One big integer or of the two boards, much faster than a loop over the fields
+        self.cells = bytearray((int.from_bytes(bytes(self.cells), 'big') | int.from_bytes(marks, 'big')).to_bytes(
+            size, 'big'))
+
+    def mine_count(self):
+        return self.cells.translate(MINE_TABLE).count(b'\x01')
+
+    def hidden_safe_count(self):
+        """Returns how many fields without a mine are not revealed yet"""
+        return self.cells.translate(HIDDEN_SAFE_TABLE).count(b'\x01')
+
+    def view_at(self, x, y):
+        """Returns what the player sees in the field at point (x,y)"""
+        return chr(VIEW_TABLE[self.cells[y * self.cols + x]])
+
+    def view(self):
+        """Returns the board as the player sees it, a matrix of one character strings"""
+        view = self.cells.translate(VIEW_TABLE).decode('ascii')
+        cols = self.cols
+        return [list(view[y * cols:(y + 1) * cols]) for y in range(self.rows)]
+
+    def view_rows(self, x, y, width, height):
+        """Returns the part of the view of width x height fields from point (x,y), inside the board, as one string
+        per row"""
+        cols = self.cols
+        if x == 0 and width == cols:
+            view = self.cells[y * cols:(y + height) * cols].translate(VIEW_TABLE).decode('ascii')
+            return [view[row * cols:(row + 1) * cols] for row in range(height)]
+        return [self.cells[row * cols + x:row * cols + x + width].translate(VIEW_TABLE).decode('ascii')
+                for row in range(y, y + height)]
+
+    def view_region(self, x, y, width, height):
+        """Returns the part of the view (see view) of width x height fields from point (x,y), inside the board"""
+        return [list(row) for row in self.view_rows(x, y, width, height)]
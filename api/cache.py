@@ -0,0 +1,138 @@
+# -*- coding: utf-8 -*-
+"""
+Per process cache of decoded boards.
+
+Entries are keyed by game id and tagged with the game version, which is bumped on every save. A game row loaded from
+the database only gets a board from the cache if the versions match, so a board saved by another worker is never
+served stale. Boards are copied in and out, so a request can change its board without touching the cached one.
+
+The mine layouts of seeded games, which are not stored (see Game.STORAGE_SEEDED), are kept in a second cache keyed by
+what places the mines, so the games of a shared board only generate it once per process.
+"""
+from __future__ import unicode_literals
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+
+from api.boards import Board
+
+
+class GameCache(object):
+    """LRU cache of boards limited by number of games, number of fields and age (seconds)"""
+
+    def __init__(self, max_games, max_fields, ttl):
+        self.max_games = max_games
+        self.max_fields = max_fields
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._fields = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, game_id, version):
+        """Returns a copy of the board cached for this game version or None"""
+        with self._lock:
+            entry = self._entries.get(game_id)
+            if entry is not None:
+                cached_version, stored_at, board = entry
+                if cached_version == version and time.time() - stored_at < self.ttl:
+                    self._entries.move_to_end(game_id)
+                    self.hits += 1
+                    return Board(board.rows, board.cols, board.cells)
+                self._remove(game_id)
+            self.misses += 1
+            return None
+
+    def put(self, game_id, version, board):
+        """Caches a copy of the board for this game version"""
+        size = len(board.cells)
+        if size > self.max_fields:
+            return
+        board = Board(board.rows, board.cols, board.cells)
+        with self._lock:
+            self._remove(game_id)
+            self._entries[game_id] = (version, time.time(), board)
+            self._fields += size
+            while len(self._entries) > self.max_games or self._fields > self.max_fields:
+                self._remove(next(iter(self._entries)))
+                self.evictions += 1
+
+    def discard(self, game_id):
+        with self._lock:
+            self._remove(game_id)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._fields = 0
+
+    def stats(self):
+        with self._lock:
+            return {
+                'games': len(self._entries),
+                'fields': self._fields,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+            }
+
+    def _remove(self, game_id):
+        entry = self._entries.pop(game_id, None)
+        if entry is not None:
+            self._fields -= len(entry[2].cells)
+
+
+class LayoutCache(object):
+    """LRU cache of mine layouts (see Board.layout) limited by number of fields"""
+
+    def __init__(self, max_fields):
+        self.max_fields = max_fields
+        self._entries = OrderedDict()
+        self._fields = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, rows, cols, mines, seed, first):
+        """Returns a new board with the layout, generated again unless it is cached"""
+        key = (rows, cols, mines, seed, first)
+        with self._lock:
+            cells = self._entries.get(key)
+            if cells is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return Board(rows, cols, cells)
+            self.misses += 1
+        cells = bytes(Board.layout(rows, cols, mines, seed, first).cells)
+        if len(cells) <= self.max_fields:
+            with self._lock:
+                if key not in self._entries:
+                    self._entries[key] = cells
+                    self._fields += len(cells)
+                while self._fields > self.max_fields:
+                    self._fields -= len(self._entries.popitem(last=False)[1])
+        return Board(rows, cols, cells)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._fields = 0
+
+    def stats(self):
+        with self._lock:
+            return {
+                'layouts': len(self._entries),
+                'fields': self._fields,
+                'hits': self.hits,
+                'misses': self.misses,
+            }
+
+
+game_cache = GameCache(max_games=getattr(settings, 'GAME_CACHE_GAMES', 256),
+                       max_fields=getattr(settings, 'GAME_CACHE_FIELDS', 64 * 1024 * 1024),
+                       ttl=getattr(settings, 'GAME_CACHE_TTL', 300))
+layout_cache = LayoutCache(max_fields=getattr(settings, 'GAME_LAYOUT_CACHE_FIELDS', 16 * 1024 * 1024))
@@ -0,0 +1,264 @@
+# -*- coding: utf-8 -*-
+"""
+Chunked board for very large games.
+
+The board is split in chunks of CHUNK x CHUNK fields (smaller along the bottom and right edges), numbered in row
+major order. Each chunk is a packed Board (see api.boards) which is only stored, in a BoardChunk row, once a move
+touches it. The mines of the chunks that were never stored are derived from the game seed, so a move only loads
+and generates the chunks around the fields it reveals or marks.
+
+- The mines of the game are spread evenly over the chunks (see ChunkedBoard.chunk_mines) and placed inside each
+  chunk by Board.generate, with a seed derived from the game seed and the chunk index.
+- The adjacent mine counts along the edges of a chunk take the mines of the neighbouring chunks into account,
+  from their stored rows or generated from the seed.
+- Until the mines are placed (on the first reveal) the stored chunks only hold the marks of the player.
+"""
+from __future__ import unicode_literals
+
+from api import instrumentation
+from api.boards import (Board, ADJACENT_MASK, MINE, MARK_MASK, VISIBLE, MASK64, GOLDEN64, MINE_TABLE,
+                        VIEW_TABLE)
+
+CHUNK = 64
+FETCH_BATCH = 500  # chunks loaded per query, under the limit of query parameters of sqlite
+
+
+def chunk_seed(seed, index):
+    """Returns the seed that places the mines of a chunk (splitmix64 of the game seed and the chunk index)"""
+    z = (seed + (index + 1) * GOLDEN64 + 0x632be59bd9b4e019) & MASK64
+    z = ((z ^ (z >> 30)) * 0xbf58476d1ce4e5b9) & MASK64
+    z = ((z ^ (z >> 27)) * 0x94d049bb133111eb) & MASK64
+    return z ^ (z >> 31)
+
+
+class ChunkedBoard(object):
+    """
+    Board of rows x cols fields that loads and generates its chunks on demand.
+    load(indexes) returns the (index, cells) pairs of the stored chunks among indexes (all of them if None).
+    """
+
+    def __init__(self, rows, cols, mines, seed, mines_placed, load):
+        self.rows = rows
+        self.cols = cols
+        self.mines = mines
+        self.seed = seed
+        self.mines_placed = mines_placed
+        self.chunks_x = (cols + CHUNK - 1) // CHUNK
+        self.chunks_y = (rows + CHUNK - 1) // CHUNK
+        self.chunks = {}  # index -> Board of the chunks loaded or generated
+        self.stored = set()  # indexes of the chunks that have a row
+        self.dirty = set()  # indexes of the chunks changed since they were loaded or saved
+        self._load = load
+        self._fetched = set()
+        self._fetched_all = False
+        self._mines = {}  # index -> mines of the chunk, 1 byte per field (1 if mined)
+
+    def chunk_bounds(self, index):
+        """Returns (x, y, rows, cols) of a chunk: its top left point and size"""
+        cy, cx = divmod(index, self.chunks_x)
+        x, y = cx * CHUNK, cy * CHUNK
+        return x, y, min(CHUNK, self.rows - y), min(CHUNK, self.cols - x)
+
+    def fields_before(self, index):
+        """Number of fields in the chunks before this one"""
+        cy, cx = divmod(index, self.chunks_x)
+        return min(cy * CHUNK, self.rows) * self.cols + max(0, min(CHUNK, self.rows - cy * CHUNK)) * min(
+            cx * CHUNK, self.cols)
+
+    def chunk_mines(self, index):
+        """Number of mines in a chunk, the mines of the game spread evenly over the fields"""
+        area = self.rows * self.cols
+        return self.mines * self.fields_before(index + 1) // area - self.mines * self.fields_before(index) // area
+
+    def neighbours(self, index):
+        """Returns the indexes of the chunk and the chunks around it"""
+        cy, cx = divmod(index, self.chunks_x)
+        return [ny * self.chunks_x + nx
+                for ny in range(max(cy - 1, 0), min(cy + 2, self.chunks_y))
+                for nx in range(max(cx - 1, 0), min(cx + 2, self.chunks_x))]
+
+    def _fetch(self, indexes=None):
+        """Loads the stored chunks among indexes (all of them if None) that were not requested yet"""
+        if self._fetched_all:
+            return
+        if indexes is None:
+            self._fetched_all = True
+        else:
+            indexes = [index for index in indexes if index not in self._fetched]
+            if not indexes:
+                return
+            self._fetched.update(indexes)
+        batches = [None] if indexes is None else [indexes[i:i + FETCH_BATCH]
+                                                  for i in range(0, len(indexes), FETCH_BATCH)]
+        for batch in batches:
+            for index, cells in self._load(batch):
+                if index not in self.chunks:
+                    x, y, rows, cols = self.chunk_bounds(index)
+                    self.chunks[index] = Board(rows, cols, cells)
+                    instrumentation.add('board_decoded_bytes', len(cells))
+                self.stored.add(index)
+
+    def _layout(self, index, exclude=()):
+        """Places the mines of a chunk by the seed, none in the excluded (chunk) field indexes"""
+        x, y, rows, cols = self.chunk_bounds(index)
+        count = self.chunk_mines(index)
+        if count >= rows * cols:
+            return b'\x01' * (rows * cols)
+        return bytes(Board.generate(rows, cols, count, chunk_seed(self.seed, index), exclude).cells.translate(
+            MINE_TABLE))
+
+    def _mines_of(self, index):
+        if index not in self._mines:
+            if index in self.chunks:
+                self._mines[index] = bytes(self.chunks[index].cells.translate(MINE_TABLE))
+            else:
+                self._mines[index] = self._layout(index)
+        return self._mines[index]
+
+    def _build(self, index):
+        """Returns a chunk with every field hidden, with its mines and adjacent mine counts"""
+        x0, y0, rows, cols = self.chunk_bounds(index)
+        if not self.mines_placed:
+            return Board(rows, cols)
+        # Mines of the chunk with a border of one field taken from the chunks around it
+        grid = [bytearray(cols + 2) for y in range(rows + 2)]
+        for neighbour in self.neighbours(index):
+            nx0, ny0, nrows, ncols = self.chunk_bounds(neighbour)
+            mines = self._mines_of(neighbour)
+            left, right = max(nx0, x0 - 1), min(nx0 + ncols, x0 + cols + 1)
+            for y in range(max(ny0, y0 - 1), min(ny0 + nrows, y0 + rows + 1)):
+                start = (y - ny0) * ncols - nx0
+                grid[y - y0 + 1][left - x0 + 1:right - x0 + 1] = mines[start + left:start + right]
+        around = [[left + mine + right for left, mine, right in zip(row, row[1:], row[2:])] for row in grid]
+        cells = bytearray(rows * cols)
+        for y in range(rows):
+            cells[y * cols:(y + 1) * cols] = bytes(bytearray(
+                MINE if mine else up + side + down
+                for mine, up, side, down in zip(grid[y + 1][1:cols + 1], around[y], around[y + 1], around[y + 2])))
+        return Board(rows, cols, cells)
+
+    def chunk(self, index):
+        """Returns a chunk, loaded or generated if it was not yet"""
+        board = self.chunks.get(index)
+        if board is None:
+            self._fetch(self.neighbours(index))
+            board = self.chunks.get(index)
+            if board is None:
+                board = self.chunks[index] = self._build(index)
+        return board
+
+    def _locate(self, x, y):
+        """Returns (chunk index, chunk, field index in the chunk) of the point (x,y)"""
+        cx, lx = divmod(x, CHUNK)
+        cy, ly = divmod(y, CHUNK)
+        index = cy * self.chunks_x + cx
+        board = self.chunk(index)
+        return index, board, ly * board.cols + lx
+
+    def place_mines(self, x, y):
+        """
+        Places the mines, none of them in point (x,y) or its adjacent fields (only (x,y) is kept free in the chunks
+        without enough fields for that). Every chunk stored so far is generated again, keeping its marks.
+        """
+        self._fetch()
+        first, board, first_field = self._locate(x, y)
+        exclude = {}
+        for py in range(max(y - 1, 0), min(y + 2, self.rows)):
+            for px in range(max(x - 1, 0), min(x + 2, self.cols)):
+                index, board, i = self._locate(px, py)
+                exclude.setdefault(index, []).append(i)
+        for index, fields in exclude.items():
+            x0, y0, rows, cols = self.chunk_bounds(index)
+            if self.chunk_mines(index) > rows * cols - len(fields):
+                exclude[index] = [first_field] if index == first else []
+        for index in self.chunks:
+            self._mines[index] = self._layout(index, exclude.get(index, ()))
+        self.mines_placed = True
+        for index, marks in list(self.chunks.items()):
+            board = self._build(index)
+            for i, cell in enumerate(marks.cells):
+                if cell & MARK_MASK:
+                    board.cells[i] |= cell & MARK_MASK
+            self.chunks[index] = board
+            self.dirty.add(index)
+
+    def adjacent(self, x, y):
+        """Returns the points adjacent to the point (x,y)"""
+        return [(px, py)
+                for py in range(max(y - 1, 0), min(y + 2, self.rows))
+                for px in range(max(x - 1, 0), min(x + 2, self.cols))
+                if px != x or py != y]
+
+    def is_mine(self, x, y):
+        index, board, i = self._locate(x, y)
+        return bool(board.cells[i] & MINE)
+
+    def mark(self, x, y, mark):
+        """
+        Sets the mark (HIDDEN, QUESTION or FLAG) of a field. Revealed fields keep showing their value.
+        Returns whether the field changed
+        """
+        index, board, i = self._locate(x, y)
+        if board.cells[i] & MARK_MASK in (VISIBLE, mark):
+            return False
+        board.cells[i] = (board.cells[i] & ~MARK_MASK) | mark
+        self.dirty.add(index)
+        return True
+
+    def reveal(self, x, y):
+        """
+        Reveals the field in point (x,y) and, through fields without adjacent mines, every field reachable from it.
+        Only the chunks reached are loaded. Returns the list of newly revealed points (x,y).
+        """
+        revealed = []
+        stack = [(x, y)]
+        while stack:
+            x, y = stack.pop()
+            index, board, i = self._locate(x, y)
+            cell = board.cells[i]
+            if cell & MARK_MASK == VISIBLE:
+                continue
+            board.cells[i] = (cell & ~MARK_MASK) | VISIBLE
+            self.dirty.add(index)
+            revealed.append((x, y))
+            if not cell & (MINE | ADJACENT_MASK):
+                stack.extend(self.adjacent(x, y))
+        return revealed
+
+    def view_at(self, x, y):
+        """Returns what the player sees in the field at point (x,y)"""
+        index, board, i = self._locate(x, y)
+        return chr(VIEW_TABLE[board.cells[i]])
+
+    def view(self):
+        """Returns the board as the player sees it, a matrix of one character strings. Only stored chunks are read"""
+        self._fetch()
+        return self.view_region(0, 0, self.cols, self.rows)
+
+    def view_rows(self, x, y, width, height):
+        """Same as view_region, with one string per row"""
+        if x == 0 and y == 0 and width == self.cols and height == self.rows:
+            self._fetch()
+        return [''.join(row) for row in self.view_region(x, y, width, height)]
+
+    def view_region(self, x, y, width, height):
+        """Returns the part of the view of width x height fields from point (x,y), clipped to the board"""
+        width, height = max(0, min(width, self.cols - x)), max(0, min(height, self.rows - y))
+        view = [[' '] * width for row in range(height)]
+        if not width or not height:
+            return view
+        indexes = [cy * self.chunks_x + cx
+                   for cy in range(y // CHUNK, (y + height - 1) // CHUNK + 1)
+                   for cx in range(x // CHUNK, (x + width - 1) // CHUNK + 1)]
+        self._fetch(indexes)
+        for index in indexes:
+            board = self.chunks.get(index)
+            if board is None:
+                continue  # never touched, every field is hidden
+            x0, y0, rows, cols = self.chunk_bounds(index)
+            left, right = max(x0, x), min(x0 + cols, x + width)
+            for row in range(max(y0, y), min(y0 + rows, y + height)):
+                start = (row - y0) * cols - x0
+                view[row - y][left - x:right - x] = board.cells[start + left:start + right].translate(
+                    VIEW_TABLE).decode('ascii')
+        return view
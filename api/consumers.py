@@ -0,0 +1,79 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+import asyncio
+
+from channels.db import database_sync_to_async
+from channels.generic.websocket import AsyncJsonWebsocketConsumer
+
+from api import push
+from api.models import Game, GameConflict
+
+
+class GameConsumer(AsyncJsonWebsocketConsumer):
+    """
+    Streams the updates of a game to a websocket client (see api.push). The client gets the state of the game when
+    it connects and then every change, as they are saved. While the clock runs, the consumer finishes the game by
+    timeout as soon as its time is over, so that its watchers get the timeout without polling.
+    Connections are refused unless GAME_PUSH is on.
+    """
+    update_attempts = 5
+
+    async def connect(self):
+        self.game_id = int(self.scope['url_route']['kwargs']['pk'])
+        self.timeout_task = None
+        if not push.enabled():
+            await self.close()  # no update would ever come
+            return
+        # Joins the group before reading the state so that no update is missed in between
+        await self.channel_layer.group_add(push.group_name(self.game_id), self.channel_name)
+        await self.accept()
+        message = await database_sync_to_async(self.game_state)()
+        if message is None:
+            await self.close(code=4004)
+        elif message['event'] == push.EVENT_STATE:
+            await self.send_json(message)
+            self.schedule_timeout(message)
+        # else the game just finished by timeout and the message comes through the group
+
+    async def disconnect(self, code):
+        if self.timeout_task is not None:
+            self.timeout_task.cancel()
+        await self.channel_layer.group_discard(push.group_name(self.game_id), self.channel_name)
+
+    async def game_update(self, event):
+        await self.send_json(event['message'])
+        self.schedule_timeout(event['message'])
+
+    def game_state(self):
+        """
+        Returns the state message of the game, or a timeout message if it was finished by timeout now (which is also
+        published to the other clients). Returns None if the game does not exist.
+        """
+        for attempt in range(self.update_attempts):
+            game = Game.objects.defer('cells', 'board', 'player_board').filter(pk=self.game_id).first()
+            if game is None:
+                return None
+            if not game.check_timeout():
+                return push.game_message(game, push.EVENT_STATE)
+            try:
+                game.save()
+            except GameConflict:
+                continue
+            push.publish(game, push.EVENT_TIMEOUT)
+            return push.game_message(game, push.EVENT_TIMEOUT)
+        return None
+
+    def schedule_timeout(self, message):
+        """Checks the game again when its time is over, if its clock runs"""
+        if self.timeout_task is not None:
+            self.timeout_task.cancel()
+            self.timeout_task = None
+        if message['state'] == 'started':
+            self.timeout_task = asyncio.ensure_future(self.timeout_after(message['duration_seconds']))
+
+    async def timeout_after(self, seconds):
+        await asyncio.sleep(seconds)
+        message = await database_sync_to_async(self.game_state)()
+        self.timeout_task = None
+        if message is not None and message['event'] == push.EVENT_STATE:
+            self.schedule_timeout(message)  # the clock was changed meanwhile
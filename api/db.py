@@ -0,0 +1,28 @@
+# -*- coding: utf-8 -*-
+"""
+Health checks of the database connections kept between requests (CONN_MAX_AGE).
+
+Django only checks a kept connection after a query failed on it, so a connection the server closed while it was idle
+(a database restart or the idle timeout of a pooler) fails the next request. Before a request, a connection that was
+not checked for DB_HEALTH_CHECK_SECONDS is pinged and closed if it does not answer, so that Django opens a new one.
+"""
+from __future__ import unicode_literals
+import time
+
+from django.conf import settings
+from django.db import connections
+
+
+def connection_created(sender, connection, **kwargs):
+    connection.health_checked_at = time.time()
+
+
+def check_connections(**kwargs):
+    interval = getattr(settings, 'DB_HEALTH_CHECK_SECONDS', 30)
+    now = time.time()
+    for connection in connections.all():
+        if connection.connection is None or now - getattr(connection, 'health_checked_at', 0) < interval:
+            continue
+        if not connection.is_usable():
+            connection.close()
+        connection.health_checked_at = now
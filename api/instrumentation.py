@@ -0,0 +1,75 @@
+# -*- coding: utf-8 -*-
+"""
+Per request metrics, collected while api.middleware.TimingMiddleware is enabled.
+
+Code on the hot paths reports what it does with add() and timer(). Outside of a timed request both are no-ops.
+"""
+from __future__ import unicode_literals
+import threading
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+
+_local = threading.local()
+
+
+def begin():
+    _local.metrics = defaultdict(float)
+
+
+def end():
+    """Stops collecting for the current request and returns its metrics"""
+    metrics = getattr(_local, 'metrics', None)
+    _local.metrics = None
+    return metrics
+
+
+def add(name, value):
+    metrics = getattr(_local, 'metrics', None)
+    if metrics is not None:
+        metrics[name] += value
+
+
+@contextmanager
+def timer(name):
+    """Adds the seconds spent in the block to the metric name"""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        add(name, time.perf_counter() - start)
+
+
+class EndpointStats(object):
+    """Metrics of the requests served by this process, summed per endpoint"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._endpoints = {}
+
+    def record(self, endpoint, metrics):
+        with self._lock:
+            totals = self._endpoints.setdefault(endpoint, defaultdict(float))
+            totals['requests'] += 1
+            totals['max_seconds'] = max(totals['max_seconds'], metrics['seconds'])
+            for name, value in metrics.items():
+                totals[name] += value
+
+    def snapshot(self):
+        """Returns the totals per endpoint, with the mean of every metric per request"""
+        with self._lock:
+            snapshot = {}
+            for endpoint, totals in self._endpoints.items():
+                requests = totals['requests']
+                snapshot[endpoint] = dict(
+                    [(name, value) for name, value in totals.items()] +
+                    [('mean_%s' % name, value / requests) for name, value in totals.items()
+                     if name not in ('requests', 'max_seconds')])
+            return snapshot
+
+    def reset(self):
+        with self._lock:
+            self._endpoints.clear()
+
+
+endpoint_stats = EndpointStats()
@@ -0,0 +1,43 @@
+import time
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from api.models import Game, GameArchive
+
+
+class Command(BaseCommand):
+    help = ('Moves the boards and move logs of the games finished more than GAME_ARCHIVE_DAYS days ago to the '
+            'compressed archive (see GameArchive), in batches')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--days', type=int, help='Archives the games finished this many days ago '
+                                                     '(GAME_ARCHIVE_DAYS)')
+        parser.add_argument('--batch-size', type=int, default=200, help='Games archived per transaction')
+        parser.add_argument('--interval', type=int, default=0,
+                            help='Keep running and archive every INTERVAL seconds (runs once by default)')
+
+    def archive(self, days, batch_size):
+        """Archives the games finished before the retention period. Returns how many"""
+        before = timezone.now() - timedelta(days=days)
+        finished = Game.objects.filter(state__in=Game.FINISHED_STATES, archived=False, updated__lt=before)
+        count, last = 0, 0
+        while True:
+            # Walks the games by id, the games left for later (changed meanwhile) are not read again
+            batch = list(finished.filter(pk__gt=last).order_by('pk')[:batch_size])
+            if not batch:
+                return count
+            count += GameArchive.archive_games(batch)
+            last = batch[-1].pk
+
+    def handle(self, *args, **options):
+        days = options['days'] if options['days'] is not None else getattr(settings, 'GAME_ARCHIVE_DAYS', 30)
+        while True:
+            start = time.time()
+            count = self.archive(days, options['batch_size'])
+            self.stdout.write('%d games archived in %.2f s' % (count, time.time() - start))
+            if not options['interval']:
+                break
+            time.sleep(options['interval'])
@@ -0,0 +1,432 @@
+import json
+import platform
+import sys
+import time
+import zlib
+
+import django
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.db.models import F, Min
+from django.test.utils import override_settings, setup_test_environment, teardown_test_environment
+from django.utils import timezone
+from rest_framework.renderers import JSONRenderer
+from rest_framework.test import APIClient
+
+from api import boards, solver
+from api.boards import Board, MINE
+from api.cache import game_cache
+from api.management.commands import fill_board_pool
+from api.models import Game, BoardChunk, BoardPool, PlayerStats
+from api.renderers import FastJSONRenderer, orjson, ujson
+from api.serializers import GameSerializer
+
+
+def best_of(repeat, func, setup=None):
+    """
+    Runs func repeat times and returns (best elapsed seconds, last result). With setup, each run is func(setup()),
+    the setup not timed
+    """
+    best, result = None, None
+    for i in range(repeat):
+        args = (setup(),) if setup is not None else ()
+        start = time.perf_counter()
+        result = func(*args)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best, result
+
+
+def checkerboard(size):
+    """Board with a mine in every other field, so no field is free of adjacent mines"""
+    board = Board(size, size)
+    for i in range(size * size):
+        if (i // size + i % size) % 2 == 0:
+            board.cells[i] = MINE
+    for i in range(size * size):
+        if not board.cells[i] & MINE:
+            board.cells[i] = sum(1 for j in board.adjacent(i) if board.cells[j] & MINE)
+    return board
+
+
+class Command(BaseCommand):
+    help = ('Times the game engine and the API endpoints on boards of increasing size. The endpoints run with the '
+            'test client against a throwaway test database. Results can be saved as JSON and compared with a '
+            'saved baseline')
+    cases = ('generate', 'generate_python', 'reveal_zeros', 'reveal_checkerboard', 'is_all_revealed',
+             'board_view', 'render', 'codec', 'archive', 'seeded', 'solve', 'api_new', 'api_bulk_new',
+             'api_first_reveal', 'api_reveal', 'api_reveal_chunked', 'api_flag', 'api_hint', 'api_state',
+             'api_state_rows', 'api_state_region', 'api_list', 'api_leaderboard')
+    seed = 42
+
+    def add_arguments(self, parser):
+        parser.add_argument('cases', nargs='*', help='Cases to run: %s (all by default)' % ', '.join(self.cases))
+        parser.add_argument('--sizes', nargs='+', type=int, default=[100, 250, 500, 1000],
+                            help='Board sides to measure (each board is size x size)')
+        parser.add_argument('--repeat', type=int, default=3, help='Runs per size, the best one is reported')
+        parser.add_argument('--output', help='Writes the results to this JSON file')
+        parser.add_argument('--baseline', help='JSON file from a previous run to compare with')
+        parser.add_argument('--tolerance', type=float, default=1.25,
+                            help='Fails if a case is this many times slower than in the baseline')
+
+    # Engine
+
+    def bench_generate(self, size, repeat):
+        """Game.new_boards with 1/5 of the fields mined (numpy if installed)"""
+        return best_of(repeat, lambda: Game.new_boards(size, size, size * size // 5, self.seed))[0], {
+            'numpy': boards.numpy is not None}
+
+    def bench_generate_python(self, size, repeat):
+        """Pure python generator with 1/5 of the fields mined"""
+        mines = size * size // 5
+        return best_of(repeat, lambda: boards._generate_python(size, size, mines, self.seed, frozenset()))[0], {}
+
+    def bench_reveal_zeros(self, size, repeat):
+        """Reveals a corner of a board without mines, so the flood fill has to visit every field"""
+        cells = bytes(Board(size, size).cells)
+
+        def reveal():
+            game = Game()
+            game.set_board(Board(size, size, cells))
+            return game.reveal_at(0, 0)
+
+        elapsed, revealed = best_of(repeat, reveal)
+        assert len(revealed) == size * size
+        return elapsed, {'us_per_field': round(elapsed * 1e6 / (size * size), 3)}
+
+    def bench_reveal_checkerboard(self, size, repeat):
+        """Reveals a field with adjacent mines in every direction, the flood fill stops right away"""
+        cells = bytes(checkerboard(size).cells)
+
+        def hidden_game():
+            game = Game()
+            game.set_board(Board(size, size, cells))
+            return game
+
+        elapsed, revealed = best_of(repeat, lambda game: game.reveal_at(1, 0), hidden_game)
+        assert len(revealed) == 1
+        return elapsed, {}
+
+    def bench_is_all_revealed(self, size, repeat):
+        game = Game()
+        game.set_board(checkerboard(size))
+        return best_of(repeat, game.is_all_revealed)[0], {}
+
+    def revealed_game(self, size):
+        """Game on a checkerboard with every field revealed"""
+        board = checkerboard(size)
+        for i in range(size * size):
+            board.cells[i] |= boards.VISIBLE
+        game = Game()
+        game.set_board(board)
+        return game
+
+    def bench_board_view(self, size, repeat):
+        """GameSerializer.get_board_view on a checkerboard with every field revealed"""
+        game = self.revealed_game(size)
+        serializer = GameSerializer()
+        return best_of(repeat, lambda: serializer.get_board_view(game))[0], {}
+
+    def bench_render(self, size, repeat):
+        """
+        Serializes and renders a revealed board with the board as rows and FastJSONRenderer, compared with the
+        board as cells with both renderers
+        """
+        game = self.revealed_game(size)
+        fast, stdlib = FastJSONRenderer(), JSONRenderer()
+        rows_time, rows = best_of(repeat, lambda: fast.render(
+            GameSerializer(game, context={'board_format': 'rows'}).data))
+        cells_fast_time, cells = best_of(repeat, lambda: fast.render(GameSerializer(game).data))
+        cells_time, cells = best_of(repeat, lambda: stdlib.render(GameSerializer(game).data))
+        return rows_time, {'bytes': len(rows), 'cells_bytes': len(cells), 'cells_seconds': round(cells_time, 6),
+                           'cells_fast_seconds': round(cells_fast_time, 6),
+                           'encoder': 'orjson' if orjson else 'ujson' if ujson else 'json'}
+
+    def bench_codec(self, size, repeat):
+        """Decodes a board stored in the legacy JSON columns and in packed cells"""
+        board = Game.new_boards(size, size, size * size // 6, self.seed)
+        board.reveal(0, 0)
+        legacy_board, legacy_player_board = board.to_json()
+        cells = bytes(board.cells)
+        json_time = best_of(repeat, lambda: (json.loads(legacy_board), json.loads(legacy_player_board)))[0]
+        packed_time = best_of(repeat, lambda: Board(size, size, cells))[0]
+        return packed_time, {'json_seconds': round(json_time, 6),
+                             'json_bytes': len(legacy_board) + len(legacy_player_board),
+                             'packed_bytes': len(cells)}
+
+    def bench_archive(self, size, repeat):
+        """Compresses and decompresses the packed board of a played game as archive_games does (zlib)"""
+        board = Game.new_boards(size, size, size * size // 6, self.seed)
+        board.reveal(0, 0)
+        board.reveal(size // 2, size // 2)
+        cells = bytes(board.cells)
+        elapsed, compressed = best_of(repeat, lambda: zlib.compress(cells))
+        decompress = best_of(repeat, lambda: zlib.decompress(compressed))[0]
+        return elapsed, {'packed_bytes': len(cells), 'archived_bytes': len(compressed),
+                         'decompress_seconds': round(decompress, 6)}
+
+    def bench_seeded(self, size, repeat):
+        """
+        Decodes the board of a played seeded game whose layout is not cached: the mines placed again by the seed
+        plus the marks
+        """
+        mines = size * size // 6
+        first = size // 2 * size + size // 2
+        board = Board.layout(size, size, mines, self.seed, first)
+        board.reveal(size // 2, size // 2)
+        stored = zlib.compress(board.marks())
+
+        def decode():
+            layout = Board.layout(size, size, mines, self.seed, first)
+            layout.add_marks(zlib.decompress(stored))
+            return layout
+
+        return best_of(repeat, decode)[0], {'packed_bytes': len(board.cells), 'seeded_bytes': len(stored)}
+
+    def bench_solve(self, size, repeat):
+        """
+        Plays boards with 1/7 of the fields mined with the solver (api.solver.play_seed), from a first reveal in the
+        middle until they are won or a guess hits a mine
+        """
+        mines = size * size // 7
+        results = []
+
+        def play():
+            results.append(solver.play_seed(size, size, mines, self.seed + len(results)))
+
+        start = time.perf_counter()
+        elapsed = best_of(repeat, play)[0]
+        return elapsed, {'boards_per_second': round(repeat / (time.perf_counter() - start), 3),
+                         'won': sum(won for won, reveals in results), 'played': repeat}
+
+    # API, through the test client
+
+    def new_game(self, size, mines=None, **extra):
+        response = self.client.post('/games/new/?view=delta', dict(
+            extra, rows=size, columns=size, mines=size * size // 6 if mines is None else mines, seed=self.seed,
+        ), format='json')
+        assert response.status_code == 200, response.content
+        return response.data['id']
+
+    def best_request(self, repeat, prepare):
+        """prepare() returns (method, url, data). Returns (best elapsed seconds, {'bytes': response size})"""
+        best, size = None, 0
+        for i in range(repeat):
+            method, url, data = prepare()
+            start = time.perf_counter()
+            response = getattr(self.client, method)(url, data, format='json')
+            elapsed = time.perf_counter() - start
+            assert response.status_code == 200, response.content
+            best = elapsed if best is None else min(best, elapsed)
+            size = len(response.content)
+        return best, {'bytes': size}
+
+    def bench_api_new(self, size, repeat):
+        return self.best_request(repeat, lambda: (
+            'post', '/games/new/', {'rows': size, 'columns': size, 'mines': size * size // 6, 'seed': self.seed}))
+
+    def bench_api_bulk_new(self, size, repeat):
+        """bulk_new with 100 games, without pooled boards"""
+        elapsed, extra = self.best_request(repeat, lambda: (
+            'post', '/games/bulk_new/', {'rows': size, 'columns': size, 'mines': size * size // 6, 'count': 100}))
+        return elapsed, dict(extra, per_game_seconds=round(elapsed / 100, 6))
+
+    def bench_api_first_reveal(self, size, repeat):
+        """First reveal of a new game with a board from the pool, compared with one that places its mines then"""
+        config = (size, size, size * size // 6)
+
+        def prepare(pooled):
+            BoardPool.objects.all().delete()
+            if pooled:
+                BoardPool.objects.create(**fill_board_pool.generate(config))
+            response = self.client.post('/games/new/?view=delta', dict(zip(('rows', 'columns', 'mines'), config)),
+                                        format='json')
+            game_cache.clear()
+            return 'post', '/games/%d/reveal/?view=delta' % response.data['id'], {'x': 0, 'y': 0}
+
+        unpooled = self.best_request(repeat, lambda: prepare(False))[0]
+        pooled = self.best_request(repeat, lambda: prepare(True))[0]
+        return pooled, {'unpooled_seconds': round(unpooled, 6)}
+
+    def bench_api_reveal(self, size, repeat):
+        """Reveals the corner of a fresh board with one mine in the opposite corner, not cached by the worker"""
+        board = Board(size, size)
+        board.cells[-1] = MINE
+        for i in board.adjacent(size * size - 1):
+            board.cells[i] = 1
+
+        def prepare():
+            game_id = self.new_game(size, mines=1, storage='packed')
+            Game.objects.filter(pk=game_id).update(cells=bytes(board.cells), mines_placed=True,
+                                                   hidden_safe_cells=size * size - 1)
+            game_cache.clear()
+            return 'post', '/games/%d/reveal/?view=delta' % game_id, {'x': 0, 'y': 0}
+
+        return self.best_request(repeat, prepare)
+
+    def bench_api_reveal_chunked(self, size, repeat):
+        """First reveal in the middle of a fresh chunked board with 1/6 of the fields mined"""
+        game_ids = []
+
+        def prepare():
+            game_ids.append(self.new_game(size, storage='chunked'))
+            return 'post', '/games/%d/reveal/?view=delta' % game_ids[-1], {'x': size // 2, 'y': size // 2}
+
+        elapsed, extra = self.best_request(repeat, prepare)
+        return elapsed, dict(extra, chunks=BoardChunk.objects.filter(game_id=game_ids[-1]).count())
+
+    def bench_api_flag(self, size, repeat):
+        """
+        Flags a field of a board with its first field revealed, which only appends the move to the log, compared
+        with packing the board into a snapshot on every move
+        """
+        game_id = self.new_game(size)
+        self.client.post('/games/%d/reveal/?view=delta' % game_id, {'x': size // 2, 'y': size // 2}, format='json')
+        flag = lambda: ('post', '/games/%d/mark_as_flag/?view=delta' % game_id, {'x': 0, 'y': 0})
+        elapsed, extra = self.best_request(repeat, flag)
+        with override_settings(GAME_SNAPSHOT_MOVES=1):
+            snapshot = self.best_request(repeat, flag)[0]
+        return elapsed, dict(extra, snapshot_seconds=round(snapshot, 6))
+
+    def bench_api_hint(self, size, repeat):
+        """
+        Hint after a reveal on a board with its first field revealed, with the solver of the previous hint kept,
+        compared with solving the board from scratch
+        """
+        game_id = self.new_game(size)
+        self.client.post('/games/%d/reveal/?view=delta' % game_id, {'x': size // 2, 'y': size // 2}, format='json')
+
+        def prepare():
+            hint = self.client.get('/games/%d/hint/' % game_id).data
+            point = (hint['safe'] or [hint['guess']])[0]
+            self.client.post('/games/%d/reveal/?view=delta' % game_id, point, format='json')
+            return 'get', '/games/%d/hint/' % game_id, None
+
+        elapsed, extra = self.best_request(repeat, prepare)
+
+        def prepare_cold():
+            solver.solver_cache.clear()
+            return 'get', '/games/%d/hint/' % game_id, None
+
+        cold = self.best_request(repeat, prepare_cold)[0]
+        return elapsed, dict(extra, cold_seconds=round(cold, 6))
+
+    def bench_api_state(self, size, repeat):
+        game_id = self.new_game(size)
+        return self.best_request(repeat, lambda: ('get', '/games/%d/state/' % game_id, None))
+
+    def bench_api_state_rows(self, size, repeat):
+        game_id = self.new_game(size)
+        return self.best_request(repeat, lambda: ('get', '/games/%d/state/?board_format=rows' % game_id, None))
+
+    def bench_api_state_region(self, size, repeat):
+        """State of a window of 100x100 fields in the middle of a board with its first field revealed there"""
+        game_id = self.new_game(size)
+        self.client.post('/games/%d/reveal/?view=delta' % game_id, {'x': size // 2, 'y': size // 2}, format='json')
+        region = '%d,%d,100,100' % (max(0, size // 2 - 50), max(0, size // 2 - 50))
+        return self.best_request(repeat, lambda: ('get', '/games/%d/state/?region=%s' % (game_id, region), None))
+
+    def bench_api_list(self, size, repeat):
+        """First page of the game list, with 20 more games of this size in the database"""
+        for i in range(20):
+            self.new_game(size)
+        return self.best_request(repeat, lambda: ('get', '/games/', None))
+
+    def bench_api_leaderboard(self, size, repeat):
+        """
+        Leaderboard of 9x9 boards after size more games finished by 50 players, compared with finding the fastest
+        wins by grouping the games
+        """
+        players = [User.objects.get_or_create(username='player%d' % i)[0] for i in range(50)]
+        games = [Game(player=players[i % 50], rows=9, columns=9, mines=10, duration_seconds=i % 90,
+                      state=Game.STATE_LOST if i % 3 else Game.STATE_WON) for i in range(size)]
+        Game.objects.bulk_create(games, batch_size=500)
+        PlayerStats.record(games)
+        elapsed, extra = self.best_request(repeat, lambda: (
+            'get', '/users/leaderboard/?rows=9&columns=9&mines=10', None))
+        group_by = best_of(repeat, lambda: list(Game.objects.filter(
+            rows=9, columns=9, mines=10, state=Game.STATE_WON).order_by().values('player').annotate(
+            best_seconds=Min(Game.DURATION_SECONDS - F('duration_seconds'))).order_by('best_seconds')[:50]))[0]
+        return elapsed, dict(extra, games=Game.objects.filter(rows=9, columns=9, mines=10).count(),
+                             group_by_seconds=round(group_by, 6))
+
+    # Running
+
+    def run_cases(self, cases, sizes, repeat):
+        results = []
+        for case in cases:
+            for size in sizes:
+                elapsed, extra = getattr(self, 'bench_%s' % case)(size, repeat)
+                results.append(dict(extra, case=case, size=size, seconds=elapsed))
+                self.stdout.write('%-20s %10s %12.6f s  %s' % (
+                    case, '%dx%d' % (size, size), elapsed,
+                    ' '.join('%s=%s' % (key, extra[key]) for key in sorted(extra))))
+        return results
+
+    def run_api_cases(self, cases, sizes, repeat):
+        """Runs the API cases in a test database, which is destroyed afterwards"""
+        setup_test_environment()
+        old_name = connection.settings_dict['NAME']
+        connection.creation.create_test_db(verbosity=0)
+        try:
+            self.client = APIClient()
+            self.client.force_authenticate(User.objects.create(username='benchmark'))
+            self.client.get('/games/')  # warms up url resolving and the middleware before timing
+            return self.run_cases(cases, sizes, repeat)
+        finally:
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+            teardown_test_environment()
+
+    def compare(self, results, baseline_path, tolerance):
+        """Prints the results next to the baseline ones. Returns the results slower than tolerance times them"""
+        with open(baseline_path) as baseline_file:
+            baseline = dict(((result['case'], result['size']), result['seconds'])
+                            for result in json.load(baseline_file)['results'])
+        regressions = []
+        self.stdout.write('\n%-20s %10s %12s %12s %8s' % ('case', 'board', 'baseline', 'now', 'ratio'))
+        for result in results:
+            before = baseline.get((result['case'], result['size']))
+            if not before:
+                continue
+            ratio = result['seconds'] / before
+            regression = ratio > tolerance
+            self.stdout.write('%-20s %10s %12.6f %12.6f %8.2f%s' % (
+                result['case'], '%dx%d' % (result['size'], result['size']), before, result['seconds'], ratio,
+                ' REGRESSION' if regression else ''))
+            if regression:
+                regressions.append(result)
+        return regressions
+
+    def handle(self, *args, **options):
+        cases = options['cases'] or self.cases
+        unknown = set(cases) - set(self.cases)
+        if unknown:
+            raise CommandError('Unknown cases: %s' % ', '.join(sorted(unknown)))
+        sizes, repeat = options['sizes'], options['repeat']
+
+        results = self.run_cases([case for case in cases if not case.startswith('api_')], sizes, repeat)
+        api_cases = [case for case in cases if case.startswith('api_')]
+        if api_cases:
+            results += self.run_api_cases(api_cases, sizes, repeat)
+
+        if options['output']:
+            with open(options['output'], 'w') as output:
+                json.dump({
+                    'meta': {
+                        'date': timezone.now().isoformat(),
+                        'python': platform.python_version(),
+                        'django': django.get_version(),
+                        'numpy': boards.numpy.__version__ if boards.numpy is not None else None,
+                        'orjson': orjson.__version__ if orjson is not None else None,
+                        'ujson': ujson.__version__ if ujson is not None else None,
+                        'platform': platform.platform(),
+                        'argv': sys.argv[1:],
+                    },
+                    'results': results,
+                }, output, indent=2, sort_keys=True)
+        if options['baseline']:
+            regressions = self.compare(results, options['baseline'], options['tolerance'])
+            if regressions:
+                raise CommandError('%d cases are slower than %.2f times the baseline' % (
+                    len(regressions), options['tolerance']))
@@ -0,0 +1,43 @@
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.utils import timezone
+
+from api import push
+from api.models import Game, GameConflict
+
+
+class Command(BaseCommand):
+    help = 'Finishes by timeout the started games whose time is over'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--interval', type=int, default=0,
+                            help='Keep running and sweep every INTERVAL seconds (runs once by default)')
+
+    def sweep(self):
+        now = timezone.now()
+        count = 0
+        expired = Game.objects.filter(state=Game.STATE_STARTED, deadline__lte=now).defer('cells', 'board',
+                                                                                         'player_board')
+        for game in expired.iterator():
+            # Saved like any move, so that the result is counted once (see PlayerStats) even if a request finishes
+            # the game meanwhile, and the version bump keeps workers from serving their cached copy
+            if not game.check_timeout(now):
+                continue
+            try:
+                with transaction.atomic():
+                    game.save()
+                    push.publish(game, push.EVENT_TIMEOUT)
+            except GameConflict:
+                continue
+            count += 1
+        return count
+
+    def handle(self, *args, **options):
+        while True:
+            count = self.sweep()
+            self.stdout.write('%d games finished by timeout' % count)
+            if not options['interval']:
+                break
+            time.sleep(options['interval'])
@@ -0,0 +1,70 @@
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db.models import Count
+
+from api.boards import Board, new_seed, spare_indexes, pack_indexes
+from api.models import BoardPool
+
+
+def generate(config):
+    """Generates a board for the pool, in a worker process. Returns the BoardPool fields"""
+    rows, columns, mines = config
+    seed = new_seed()
+    board = Board.generate(rows, columns, mines, seed)
+    return {'rows': rows, 'columns': columns, 'mines': mines, 'seed': seed, 'cells': bytes(board.cells),
+            'spares': pack_indexes(spare_indexes(rows * columns, mines, seed))}
+
+
+class Command(BaseCommand):
+    help = ('Generates boards for the pool taken by new games, up to GAME_POOL_SIZE boards of each of the '
+            'GAME_POOL_CONFIGS configurations, in a pool of worker processes')
+    batch_size = 500
+
+    def add_arguments(self, parser):
+        parser.add_argument('--config', action='append', metavar='ROWSxCOLUMNSxMINES',
+                            help='Configuration to fill instead of GAME_POOL_CONFIGS (can be repeated)')
+        parser.add_argument('--size', type=int, help='Boards to keep of each configuration (GAME_POOL_SIZE)')
+        parser.add_argument('--workers', type=int, help='Worker processes (one per CPU by default)')
+        parser.add_argument('--interval', type=int, default=0,
+                            help='Keep running and fill the pool every INTERVAL seconds (runs once by default)')
+
+    def parse_configs(self, configs):
+        try:
+            return [tuple(int(number) for number in config.lower().split('x')) for config in configs]
+        except ValueError:
+            raise CommandError('Expected configurations as ROWSxCOLUMNSxMINES')
+
+    def fill(self, executor, configs, size):
+        """Generates the boards missing in the pool. Returns how many"""
+        pooled = dict(((row['rows'], row['columns'], row['mines']), row['count']) for row in BoardPool.objects.values(
+            'rows', 'columns', 'mines').annotate(count=Count('id')))
+        missing = []
+        for config in configs:
+            missing.extend([config] * max(0, size - pooled.get(config, 0)))
+        batch = []
+        for fields in executor.map(generate, missing, chunksize=16):
+            batch.append(BoardPool(**fields))
+            if len(batch) == self.batch_size:
+                BoardPool.objects.bulk_create(batch)
+                batch = []
+        BoardPool.objects.bulk_create(batch)
+        return len(missing)
+
+    def handle(self, *args, **options):
+        configs = self.parse_configs(options['config']) if options['config'] else [
+            tuple(config) for config in getattr(settings, 'GAME_POOL_CONFIGS', [])]
+        for rows, columns, mines in configs:
+            if mines >= rows * columns:
+                raise CommandError('There should be fewer mines than cells in %dx%dx%d' % (rows, columns, mines))
+        size = options['size'] if options['size'] is not None else getattr(settings, 'GAME_POOL_SIZE', 1000)
+        with ProcessPoolExecutor(options['workers']) as executor:
+            while True:
+                start = time.time()
+                count = self.fill(executor, configs, size)
+                self.stdout.write('%d boards generated in %.2f s' % (count, time.time() - start))
+                if not options['interval']:
+                    break
+                time.sleep(options['interval'])
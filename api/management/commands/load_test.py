@@ -0,0 +1,151 @@
+import json
+import os
+import random
+import shlex
+import subprocess
+import sys
+import threading
+import time
+import uuid
+
+import requests
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+
+
+def percentile(values, share):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * share))] if values else 0.0
+
+
+class Command(BaseCommand):
+    help = ('Measures the requests per second and latency of reveal with many clients, against servers started in '
+            'each serving profile (or a running server with --url). The servers use the database configured here, '
+            'where a throwaway user is created')
+    # name -> (command, environment)
+    profiles = {
+        'sync': ('gunicorn minesweeper.wsgi -c gunicorn.conf.py',
+                 {'GUNICORN_THREADS': '1', 'DB_CONN_MAX_AGE': '0'}),
+        'sync-persistent': ('gunicorn minesweeper.wsgi -c gunicorn.conf.py',
+                            {'GUNICORN_THREADS': '1', 'DB_CONN_MAX_AGE': '600'}),
+        'gthread': ('gunicorn minesweeper.wsgi -c gunicorn.conf.py',
+                    {'GUNICORN_THREADS': '4', 'DB_CONN_MAX_AGE': '600'}),
+        'asgi': ('daphne -b 127.0.0.1 -p {port} minesweeper.asgi:application', {'DB_CONN_MAX_AGE': '600'}),
+    }
+
+    def add_arguments(self, parser):
+        parser.add_argument('--profile', action='append', choices=sorted(self.profiles),
+                            help='Serving profile to start and measure (can be repeated, all of them by default)')
+        parser.add_argument('--url', help='Measures the server running at this URL instead of starting servers')
+        parser.add_argument('--port', type=int, default=8765, help='Port of the servers started')
+        parser.add_argument('--workers', type=int, help='WEB_CONCURRENCY of the gunicorn profiles')
+        parser.add_argument('--clients', type=int, default=16, help='Concurrent clients')
+        parser.add_argument('--requests', type=int, default=100, help='Reveals sent by each client')
+        parser.add_argument('--size', type=int, default=30, help='Board side of the games played')
+        parser.add_argument('--output', help='Writes the results to this JSON file')
+
+    def start(self, name, port, workers):
+        command, environment = self.profiles[name]
+        env = dict(os.environ, PORT=str(port), **environment)
+        if workers:
+            env['WEB_CONCURRENCY'] = str(workers)
+        bin_dir = os.path.dirname(sys.executable)
+        args = shlex.split(command.format(port=port))
+        if os.path.exists(os.path.join(bin_dir, args[0])):
+            args[0] = os.path.join(bin_dir, args[0])
+        return subprocess.Popen(args, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+    def wait_ready(self, url, server=None, seconds=30):
+        deadline = time.time() + seconds
+        while time.time() < deadline:
+            if server is not None and server.poll() is not None:
+                raise CommandError('The server exited with code %d' % server.returncode)
+            try:
+                if requests.get(url + '/games/', timeout=1).status_code == 200:
+                    return
+            except requests.RequestException:
+                pass
+            time.sleep(0.2)
+        raise CommandError('The server at %s did not answer in %d seconds' % (url, seconds))
+
+    def login(self, url, auth):
+        """
+        Returns a requests session logged in through the login page. Basic authentication would hash the password in
+        every request, which takes longer than the reveal itself
+        """
+        session = requests.Session()
+        session.get(url + '/api-auth/login/')
+        session.post(url + '/api-auth/login/', data={
+            'username': auth[0], 'password': auth[1], 'csrfmiddlewaretoken': session.cookies['csrftoken']})
+        if 'sessionid' not in session.cookies:
+            raise CommandError('Could not log in at %s' % url)
+        session.headers['X-CSRFToken'] = session.cookies['csrftoken']
+        return session
+
+    def measure(self, url, auth, clients, count, size):
+        """Each client plays games of size x size revealing random fields. Returns the results of the reveals"""
+        latencies, errors = [], []
+
+        def play(session):
+            game_id, done = None, 0
+            while done < count:
+                if game_id is None:
+                    response = session.post(url + '/games/new/?view=delta', json={
+                        'rows': size, 'columns': size, 'mines': size * size // 6})
+                    game_id = response.json()['id']
+                start = time.perf_counter()
+                response = session.post(url + '/games/%d/reveal/?view=delta' % game_id, json={
+                    'x': random.randrange(size), 'y': random.randrange(size)})
+                latencies.append(time.perf_counter() - start)
+                done += 1
+                if response.status_code != 200:
+                    errors.append(response.status_code)
+                elif response.json()['state'] in ('won', 'lost', 'timeout'):
+                    game_id = None
+
+        threads = [threading.Thread(target=play, args=(self.login(url, auth),)) for i in range(clients)]
+        start = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        elapsed = time.perf_counter() - start
+        return {
+            'requests': len(latencies),
+            'errors': len(errors),
+            'requests_per_second': round(len(latencies) / elapsed, 1),
+            'p50_ms': round(percentile(latencies, 0.5) * 1000, 2),
+            'p99_ms': round(percentile(latencies, 0.99) * 1000, 2),
+            'max_ms': round(max(latencies) * 1000, 2) if latencies else 0.0,
+        }
+
+    def handle(self, *args, **options):
+        password = uuid.uuid4().hex
+        player = User.objects.create_user('load-%s' % uuid.uuid4().hex[:12], password=password)
+        auth = (player.username, password)
+        targets = [('url', options['url'].rstrip('/'))] if options['url'] else [
+            (name, 'http://127.0.0.1:%d' % options['port']) for name in options['profile'] or sorted(self.profiles)]
+        results = []
+        try:
+            self.stdout.write('%-16s %9s %7s %9s %9s %9s' % ('profile', 'requests', 'errors', 'req/s', 'p50 ms',
+                                                           'p99 ms'))
+            for name, url in targets:
+                server = None if name == 'url' else self.start(name, options['port'], options['workers'])
+                try:
+                    self.wait_ready(url, server)
+                    result = dict(self.measure(url, auth, options['clients'], options['requests'], options['size']),
+                                  profile=name)
+                finally:
+                    if server is not None:
+                        server.terminate()
+                        server.wait()
+                results.append(result)
+                self.stdout.write('%-16s %9d %7d %9.1f %9.2f %9.2f' % (
+                    name, result['requests'], result['errors'], result['requests_per_second'], result['p50_ms'],
+                    result['p99_ms']))
+        finally:
+            player.delete()
+        if options['output']:
+            with open(options['output'], 'w') as output:
+                json.dump({'options': dict((key, options[key]) for key in (
+                    'clients', 'requests', 'size', 'workers')), 'results': results}, output, indent=2, sort_keys=True)
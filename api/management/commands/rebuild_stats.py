@@ -0,0 +1,41 @@
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Case, Count, F, IntegerField, Min, Value, When
+
+from api.models import Game, PlayerStats
+
+
+class Command(BaseCommand):
+    help = ('Computes the player stats (see PlayerStats) again from the finished games. Games finishing while it '
+            'runs may not be counted, so run it when the API is not serving moves')
+    batch_size = 500
+
+    def handle(self, *args, **options):
+        start = time.time()
+
+        def count(state):
+            return Count(Case(When(state=state, then=1), output_field=IntegerField()))
+
+        # order_by() drops the default ordering, which would be grouped by too
+        aggregates = Game.objects.filter(state__in=Game.FINISHED_STATES).order_by().values(
+            'player', 'rows', 'columns', 'mines').annotate(
+            played=Count('id'), won=count(Game.STATE_WON), lost=count(Game.STATE_LOST),
+            timeout=count(Game.STATE_TIMEOUT),
+            best_seconds=Min(Case(When(state=Game.STATE_WON, then=Value(Game.DURATION_SECONDS) - F('duration_seconds')),
+                                  output_field=IntegerField())))
+        with transaction.atomic():
+            PlayerStats.objects.all().delete()
+            batch, games, total = [], 0, 0
+            for row in aggregates.iterator():
+                row['player_id'] = row.pop('player')
+                batch.append(PlayerStats(**row))
+                games += row['played']
+                if len(batch) == self.batch_size:
+                    PlayerStats.objects.bulk_create(batch)
+                    total += len(batch)
+                    batch = []
+            PlayerStats.objects.bulk_create(batch)
+            total += len(batch)
+        self.stdout.write('%d player stats computed from %d games in %.2f s' % (total, games, time.time() - start))
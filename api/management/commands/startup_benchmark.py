@@ -0,0 +1,129 @@
+import json
+import os
+import re
+import subprocess
+import sys
+from collections import defaultdict
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+# Run in a fresh interpreter: boots the app as a gunicorn worker does and resolves an API URL as its first request
+# does. Prints the timings as JSON
+BOOT = '''
+import json, os, sys, time
+start = time.perf_counter()
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'minesweeper.settings')
+import minesweeper.wsgi
+booted = time.perf_counter()
+from django.urls import resolve
+resolve('/games/')
+resolved = time.perf_counter()
+print(json.dumps({'boot_ms': (booted - start) * 1000, 'resolve_ms': (resolved - booted) * 1000,
+                  'modules': len(sys.modules)}))
+'''
+
+# Python 3.6 has no -X importtime: the time of each import is measured by wrapping the loaders instead. Prints
+# {module: [self, cumulative]} microseconds as JSON
+IMPORT_HOOK = '''
+import json, sys, time
+from importlib.machinery import PathFinder
+times = {}
+nested = [0]  # time of the imports done by each import in progress
+
+class TimingFinder(object):
+    @classmethod
+    def find_spec(cls, name, path=None, target=None):
+        spec = PathFinder.find_spec(name, path, target)
+        if spec is not None and hasattr(spec.loader, 'exec_module'):
+            exec_module = spec.loader.exec_module
+
+            def timed(module):
+                start = time.perf_counter()
+                nested.append(0)
+                try:
+                    exec_module(module)
+                finally:
+                    elapsed = int((time.perf_counter() - start) * 1000000)
+                    times[name] = [elapsed - nested.pop(), elapsed]
+                    nested[-1] += elapsed
+            spec.loader.exec_module = timed
+        return spec
+
+sys.meta_path.insert(sys.meta_path.index(PathFinder), TimingFinder)
+''' + BOOT + '''
+sys.stderr.write(json.dumps(times))
+'''
+
+IMPORTTIME_LINE = re.compile(r'^import time:\s+(\d+) \|\s+(\d+) \|(\s*)(\S+)$')
+
+
+def median(values):
+    values = sorted(values)
+    return values[len(values) // 2]
+
+
+class Command(BaseCommand):
+    help = ('Measures how long a worker takes to start (import and set up the app, then resolve the first request) '
+            'in fresh interpreters, with the default and the slim profile (see API_SLIM), and reports the imports '
+            'that take longest (python -X importtime, or an import hook before Python 3.7)')
+    profiles = {
+        'default': {'API_SLIM': '0'},
+        'slim': {'API_SLIM': '1'},
+    }
+
+    def add_arguments(self, parser):
+        parser.add_argument('--profile', action='append', choices=sorted(self.profiles),
+                            help='Profile to measure (can be repeated, all of them by default)')
+        parser.add_argument('--repeat', type=int, default=5, help='Interpreters started per profile')
+        parser.add_argument('--top', type=int, default=20, help='Slowest imports reported per profile (0 for none)')
+        parser.add_argument('--output', help='Writes the results to this JSON file')
+
+    def run(self, args, profile):
+        env = dict(os.environ, DJANGO_SETTINGS_MODULE='minesweeper.settings', PYTHONDONTWRITEBYTECODE='',
+                   **self.profiles[profile])
+        process = subprocess.run([sys.executable] + args, env=env, cwd=settings.BASE_DIR, stdout=subprocess.PIPE,
+                                 stderr=subprocess.PIPE, universal_newlines=True)
+        if process.returncode:
+            raise CommandError('The %s profile failed to start:\n%s' % (profile, process.stderr))
+        return json.loads(process.stdout.strip().splitlines()[-1]), process.stderr
+
+    def import_times(self, profile):
+        """Returns {module: (self, cumulative)} import microseconds of a worker start"""
+        if sys.version_info >= (3, 7):
+            stderr = self.run(['-X', 'importtime', '-c', BOOT], profile)[1]
+            times = {}
+            for line in stderr.splitlines():
+                match = IMPORTTIME_LINE.match(line)
+                if match:
+                    times[match.group(4)] = (int(match.group(1)), int(match.group(2)))
+            return times
+        return json.loads(self.run(['-c', IMPORT_HOOK], profile)[1].strip().splitlines()[-1])
+
+    def handle(self, *args, **options):
+        results = {}
+        for profile in options['profile'] or sorted(self.profiles):
+            runs = [self.run(['-c', BOOT], profile)[0] for i in range(options['repeat'])]
+            result = {
+                'boot_ms': round(median([run['boot_ms'] for run in runs]), 1),
+                'resolve_ms': round(median([run['resolve_ms'] for run in runs]), 1),
+                'modules': runs[0]['modules'],
+            }
+            self.stdout.write('%-8s boot %8.1f ms  first resolve %6.1f ms  %5d modules (median of %d)' % (
+                profile, result['boot_ms'], result['resolve_ms'], result['modules'], options['repeat']))
+            if options['top']:
+                times = self.import_times(profile)
+                # Time spent in the modules of each top level package, and the slowest imports with what they import
+                packages = defaultdict(int)
+                for name, (own, cumulative) in times.items():
+                    packages[name.split('.')[0]] += own
+                result['packages_ms'] = dict((name, round(elapsed / 1000.0, 1)) for name, elapsed in sorted(
+                    packages.items(), key=lambda item: -item[1])[:options['top']])
+                result['imports_ms'] = dict((name, round(cumulative / 1000.0, 1)) for name, (own, cumulative) in sorted(
+                    times.items(), key=lambda item: -item[1][1])[:options['top']])
+                for name, elapsed in sorted(result['packages_ms'].items(), key=lambda item: -item[1]):
+                    self.stdout.write('    %8.1f ms  %s' % (elapsed, name))
+            results[profile] = result
+        if options['output']:
+            with open(options['output'], 'w') as output:
+                json.dump(results, output, indent=2, sort_keys=True)
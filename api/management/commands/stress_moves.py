@@ -0,0 +1,63 @@
+import threading
+import uuid
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from rest_framework.test import APIClient
+
+from api.boards import Board
+from api.models import Game
+
+
+class Command(BaseCommand):
+    help = ('Flags distinct cells of one game from many threads through the API and checks that every '
+            'accepted move was kept (no lost updates). Creates a throwaway user and game in the database')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--threads', type=int, default=8)
+        parser.add_argument('--moves', type=int, default=25, help='Moves sent by each thread')
+        parser.add_argument('--storage', choices=[name for value, name in Game.STORAGE_CHOICES], default='packed')
+
+    def handle(self, *args, **options):
+        threads, moves = options['threads'], options['moves']
+        player = User.objects.create(username='stress-%s' % uuid.uuid4().hex[:12])
+        try:
+            game = Game(player=player, title='Stress test')
+            if options['storage'] == 'chunked':
+                game.setup(threads, moves, 1, storage=Game.STORAGE_CHUNKED)
+            else:
+                game.set_board(Board(threads, moves))
+            game.save()
+            accepted, conflicts, errors = [], [], []
+
+            def send_moves(row):
+                client = APIClient()
+                client.force_authenticate(player)
+                try:
+                    for x in range(moves):
+                        response = client.post('/games/%d/mark_as_flag/?view=delta' % game.pk,
+                                               {'x': x, 'y': row}, format='json')
+                        if response.status_code == 200:
+                            accepted.append((x, row))
+                        elif response.status_code == 409:
+                            conflicts.append((x, row))
+                        else:
+                            errors.append(response.status_code)
+                finally:
+                    connection.close()
+
+            workers = [threading.Thread(target=send_moves, args=(row,)) for row in range(threads)]
+            for worker in workers:
+                worker.start()
+            for worker in workers:
+                worker.join()
+
+            board = Game.objects.get(pk=game.pk).get_board()
+            lost = [point for point in accepted if board.view_at(*point) != '!']
+            self.stdout.write('%d moves accepted, %d conflicts (409), %d errors, %d lost' % (
+                len(accepted), len(conflicts), len(errors), len(lost)))
+            if lost or errors:
+                raise CommandError('Lost moves: %s, errors: %s' % (lost, errors))
+        finally:
+            player.delete()
@@ -0,0 +1,86 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+import cProfile
+import logging
+import os
+import random
+import time
+
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import connection
+
+from api import instrumentation
+
+logger = logging.getLogger(__name__)
+
+
+class TimingMiddleware(object):
+    """
+    Times every request (enabled with the API_TIMING setting): wall time, database queries and their time, board
+    bytes decoded and encoded and serializer time. They are returned in a Server-Timing header and summed per
+    endpoint (see GameViewSet.timing_stats).
+
+    A share of the requests (API_PROFILE_SAMPLE_RATE) and the requests of staff users with an `X-Profile: 1` header
+    are run under cProfile, and the profile is written to API_PROFILE_DIR.
+    Goes after AuthenticationMiddleware, which is needed to check the user.
+    """
+
+    def __init__(self, get_response):
+        if not getattr(settings, 'API_TIMING', False):
+            raise MiddlewareNotUsed()
+        self.get_response = get_response
+        self.sample_rate = getattr(settings, 'API_PROFILE_SAMPLE_RATE', 0)
+        self.profile_dir = getattr(settings, 'API_PROFILE_DIR', None)
+
+    def should_profile(self, request):
+        if not self.profile_dir:
+            return False
+        if request.META.get('HTTP_X_PROFILE') == '1':
+            user = getattr(request, 'user', None)
+            if settings.DEBUG or (user is not None and user.is_staff):
+                return True
+        return self.sample_rate > 0 and random.random() < self.sample_rate
+
+    def __call__(self, request):
+        instrumentation.begin()
+        force_debug_cursor = connection.force_debug_cursor
+        connection.force_debug_cursor = True
+        queries_before = len(connection.queries_log)
+        profiler = cProfile.Profile() if self.should_profile(request) else None
+        start = time.perf_counter()
+        try:
+            if profiler is not None:
+                response = profiler.runcall(self.get_response, request)
+            else:
+                response = self.get_response(request)
+        finally:
+            elapsed = time.perf_counter() - start
+            connection.force_debug_cursor = force_debug_cursor
+            metrics = instrumentation.end()
+        queries = list(connection.queries_log)[queries_before:]
+        metrics['seconds'] = elapsed
+        metrics['db_queries'] = len(queries)
+        metrics['db_seconds'] = sum(float(query['time']) for query in queries)
+
+        match = request.resolver_match
+        endpoint = '%s %s' % (request.method, match.url_name if match is not None else 'unresolved')
+        instrumentation.endpoint_stats.record(endpoint, metrics)
+        response['Server-Timing'] = ', '.join([
+            'total;dur=%.2f' % (elapsed * 1000),
+            'db;dur=%.2f;desc="%d queries"' % (metrics['db_seconds'] * 1000, metrics['db_queries']),
+            'serialize;dur=%.2f' % (metrics['serialize_seconds'] * 1000),
+            'board-decode;desc="%d bytes"' % metrics['board_decoded_bytes'],
+            'board-encode;desc="%d bytes"' % metrics['board_encoded_bytes'],
+        ])
+        if profiler is not None:
+            self.save_profile(profiler, endpoint, elapsed)
+        return response
+
+    def save_profile(self, profiler, endpoint, elapsed):
+        if not os.path.isdir(self.profile_dir):
+            os.makedirs(self.profile_dir)
+        path = os.path.join(self.profile_dir, '%s-%s-%dms.prof' % (
+            time.strftime('%Y%m%d-%H%M%S'), endpoint.replace(' ', '-'), elapsed * 1000))
+        profiler.dump_stats(path)
+        logger.info('Profile of %s (%.1f ms) saved to %s', endpoint, elapsed * 1000, path)
@@ -0,0 +1,40 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.11 on 2026-10-18 02:59
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='game',
+            name='cells',
+            field=models.BinaryField(blank=True, default=b'', help_text='Packed board, one byte per field (see api.boards)'),
+        ),
+        migrations.AddField(
+            model_name='game',
+            name='columns',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='game',
+            name='rows',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AlterField(
+            model_name='game',
+            name='board',
+            field=models.TextField(blank=True, default='', help_text='Legacy board as a JSON matrix, only read if cells is empty. (0-9: adjacent mines, x: mine)'),
+        ),
+        migrations.AlterField(
+            model_name='game',
+            name='player_board',
+            field=models.TextField(blank=True, default='', help_text='Legacy board as a JSON matrix, only read if cells is empty. (v: visible, h: hidden, ?: question mark, !: exclamation mark.'),
+        ),
+    ]
@@ -0,0 +1,66 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+import json
+
+from django.db import migrations
+
+# Frozen copy of the packed format of api.boards when this migration was written, so that later changes to Board do
+# not change what it does: one byte per field, the adjacent mines in the low 4 bits, 0x10 for a mine and the mark of
+# the player in 0x60
+ADJACENT_MASK = 0x0f
+MINE = 0x10
+MARK_MASK = 0x60
+PLAYER_CODES = {'h': 0x00, 'v': 0x20, '?': 0x40, '!': 0x60}
+PLAYER_CHARS = dict((code, char) for char, code in PLAYER_CODES.items())
+
+
+def pack(board, player_board):
+    """Packs the legacy JSON columns. Returns (rows, columns, cells)"""
+    board, player_board = json.loads(board), json.loads(player_board)
+    cells = bytearray()
+    for board_row, player_row in zip(board, player_board):
+        for value, mark in zip(board_row, player_row):
+            cells.append((MINE if value == 'x' else int(value)) | PLAYER_CODES[mark])
+    return len(board), len(board[0]), bytes(cells)
+
+
+def unpack(rows, columns, cells):
+    """Encodes packed cells as the legacy JSON columns. Returns (board, player_board)"""
+    cells = bytearray(cells)
+    board, player_board = [], []
+    for y in range(rows):
+        row = cells[y * columns:(y + 1) * columns]
+        board.append(['x' if cell & MINE else str(cell & ADJACENT_MASK) for cell in row])
+        player_board.append([PLAYER_CHARS[cell & MARK_MASK] for cell in row])
+    return json.dumps(board), json.dumps(player_board)
+
+
+def pack_boards(apps, schema_editor):
+    """Moves the legacy JSON boards into the packed cells column"""
+    Game = apps.get_model('api', 'Game')
+    for game in Game.objects.exclude(board='').iterator():
+        game.rows, game.columns, game.cells = pack(game.board, game.player_board)
+        game.board = game.player_board = ''
+        game.save(update_fields=['rows', 'columns', 'cells', 'board', 'player_board'])
+
+
+def unpack_boards(apps, schema_editor):
+    """Writes the packed cells back to the legacy JSON columns"""
+    Game = apps.get_model('api', 'Game')
+    for game in Game.objects.filter(board='').iterator():
+        if not game.cells:
+            continue
+        game.board, game.player_board = unpack(game.rows, game.columns, game.cells)
+        game.cells = b''
+        game.save(update_fields=['cells', 'board', 'player_board'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0002_packed_board'),
+    ]
+
+    operations = [
+        migrations.RunPython(pack_boards, unpack_boards),
+    ]
@@ -0,0 +1,25 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.11 on 2026-10-18 03:04
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0004_game_version'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='game',
+            name='hidden_safe_cells',
+            field=models.PositiveIntegerField(default=0, help_text='Fields without a mine not revealed yet'),
+        ),
+        migrations.AddField(
+            model_name='game',
+            name='mines',
+            field=models.PositiveIntegerField(default=0),
+        ),
+    ]
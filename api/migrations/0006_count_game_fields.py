@@ -0,0 +1,57 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+import json
+
+from django.db import migrations
+
+# Frozen copy of the packed format of api.boards when this migration was written (see 0003_pack_legacy_boards)
+MINE = 0x10
+MARK_MASK = 0x60
+VISIBLE = 0x20
+
+
+def count(cells):
+    """Returns (mines, hidden_safe_cells) of packed cells"""
+    mines = hidden_safe = 0
+    for cell in bytearray(cells):
+        if cell & MINE:
+            mines += 1
+        elif cell & MARK_MASK != VISIBLE:
+            hidden_safe += 1
+    return mines, hidden_safe
+
+
+def count_json(board, player_board):
+    """Returns (mines, hidden_safe_cells) of the legacy JSON columns"""
+    mines = hidden_safe = 0
+    for board_row, player_row in zip(json.loads(board), json.loads(player_board)):
+        for value, mark in zip(board_row, player_row):
+            if value == 'x':
+                mines += 1
+            elif mark != 'v':
+                hidden_safe += 1
+    return mines, hidden_safe
+
+
+def count_fields(apps, schema_editor):
+    """Backfills mines and hidden_safe_cells from the packed boards. Games without a board keep 0"""
+    Game = apps.get_model('api', 'Game')
+    for game in Game.objects.iterator():
+        if game.cells:
+            game.mines, game.hidden_safe_cells = count(game.cells)
+        elif game.board and game.player_board:
+            game.mines, game.hidden_safe_cells = count_json(game.board, game.player_board)
+        else:
+            continue
+        game.save(update_fields=['mines', 'hidden_safe_cells'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0005_game_counters'),
+    ]
+
+    operations = [
+        migrations.RunPython(count_fields, migrations.RunPython.noop),
+    ]
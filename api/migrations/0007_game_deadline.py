@@ -0,0 +1,25 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.11 on 2026-10-18 03:06
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0006_count_game_fields'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='game',
+            name='deadline',
+            field=models.DateTimeField(blank=True, db_index=True, help_text='When the time is over, only set while the clock runs', null=True),
+        ),
+        migrations.AlterField(
+            model_name='game',
+            name='duration_seconds',
+            field=models.IntegerField(default=90, help_text='Seconds left when the clock was last stopped. Game duration: 90 seconds'),
+        ),
+    ]
@@ -0,0 +1,37 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+from datetime import timedelta
+
+from django.db import migrations
+from django.utils import timezone
+
+STATE_STARTED = 1
+
+
+def start_clocks(apps, schema_editor):
+    """Started games were timed by client ticks, their clock now runs on the server from the time left"""
+    Game = apps.get_model('api', 'Game')
+    now = timezone.now()
+    for game in Game.objects.filter(state=STATE_STARTED, deadline=None).only('id', 'duration_seconds').iterator():
+        game.deadline = now + timedelta(seconds=game.duration_seconds)
+        game.save(update_fields=['deadline'])
+
+
+def stop_clocks(apps, schema_editor):
+    Game = apps.get_model('api', 'Game')
+    now = timezone.now()
+    for game in Game.objects.exclude(deadline=None).only('id', 'deadline').iterator():
+        game.duration_seconds = max(0, int((game.deadline - now).total_seconds()))
+        game.deadline = None
+        game.save(update_fields=['duration_seconds', 'deadline'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0007_game_deadline'),
+    ]
+
+    operations = [
+        migrations.RunPython(start_clocks, stop_clocks),
+    ]
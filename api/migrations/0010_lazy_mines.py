@@ -0,0 +1,31 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.11 on 2026-10-18 03:12
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0009_game_list_index'),
+    ]
+
+    operations = [
+        # Existing games have their mines placed already
+        migrations.AddField(
+            model_name='game',
+            name='mines_placed',
+            field=models.BooleanField(default=True, help_text='Mines are placed on the first reveal'),
+        ),
+        migrations.AlterField(
+            model_name='game',
+            name='mines_placed',
+            field=models.BooleanField(default=False, help_text='Mines are placed on the first reveal'),
+        ),
+        migrations.AddField(
+            model_name='game',
+            name='seed',
+            field=models.BigIntegerField(blank=True, help_text='Places the mines (see Board.generate)', null=True),
+        ),
+    ]
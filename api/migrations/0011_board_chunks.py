@@ -0,0 +1,42 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.11 on 2026-10-18 03:17
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0010_lazy_mines'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='BoardChunk',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('index', models.PositiveIntegerField(help_text='Chunks are numbered in row major order')),
+                ('cells', models.BinaryField(help_text='Packed chunk, one byte per field (see api.boards)')),
+            ],
+            options={
+                'verbose_name': 'Board chunk',
+                'verbose_name_plural': 'Board chunks',
+            },
+        ),
+        migrations.AddField(
+            model_name='game',
+            name='storage',
+            field=models.IntegerField(choices=[(0, 'packed'), (1, 'chunked')], default=0, help_text='Chunked boards are stored in BoardChunk rows instead of cells'),
+        ),
+        migrations.AddField(
+            model_name='boardchunk',
+            name='game',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='chunks', to='api.Game'),
+        ),
+        migrations.AlterUniqueTogether(
+            name='boardchunk',
+            unique_together=set([('game', 'index')]),
+        ),
+    ]
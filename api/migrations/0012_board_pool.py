@@ -0,0 +1,41 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.11 on 2026-10-18 03:31
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0011_board_chunks'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='BoardPool',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('created', models.DateTimeField(auto_now_add=True)),
+                ('rows', models.PositiveIntegerField()),
+                ('columns', models.PositiveIntegerField()),
+                ('mines', models.PositiveIntegerField()),
+                ('seed', models.BigIntegerField(help_text='Placed the mines, without exclude (see Board.generate)')),
+                ('cells', models.BinaryField(help_text='Packed board, every field hidden (see api.boards)')),
+                ('spares', models.BinaryField(help_text='Next fields in the order of the seed (see Board.move_mines)')),
+            ],
+            options={
+                'verbose_name': 'Pooled board',
+                'verbose_name_plural': 'Pooled boards',
+            },
+        ),
+        migrations.AddField(
+            model_name='game',
+            name='spares',
+            field=models.BinaryField(blank=True, default=b'', help_text='Spare fields of a board from the pool until its mines are placed (see BoardPool)'),
+        ),
+        migrations.AddIndex(
+            model_name='boardpool',
+            index=models.Index(fields=['rows', 'columns', 'mines'], name='api_boardpo_rows_2cc29a_idx'),
+        ),
+    ]
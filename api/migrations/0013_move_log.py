@@ -0,0 +1,50 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.11 on 2026-10-18 03:33
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0012_board_pool'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Move',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('seq', models.PositiveIntegerField(help_text='1 for the first move of the game, 2 for the next one...')),
+                ('move', models.CharField(choices=[('reveal', 'reveal'), ('flag', 'flag'), ('question', 'question')], max_length=10)),
+                ('x', models.PositiveIntegerField()),
+                ('y', models.PositiveIntegerField()),
+                ('created', models.DateTimeField(auto_now_add=True)),
+            ],
+            options={
+                'verbose_name': 'Move',
+                'verbose_name_plural': 'Moves',
+            },
+        ),
+        migrations.AddField(
+            model_name='game',
+            name='move_count',
+            field=models.PositiveIntegerField(default=0, help_text='Moves in the log (see Move)'),
+        ),
+        migrations.AddField(
+            model_name='game',
+            name='snapshot_seq',
+            field=models.PositiveIntegerField(default=0, help_text='Moves already applied to the packed cells'),
+        ),
+        migrations.AddField(
+            model_name='move',
+            name='game',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='move_log', to='api.Game'),
+        ),
+        migrations.AlterUniqueTogether(
+            name='move',
+            unique_together=set([('game', 'seq')]),
+        ),
+    ]
@@ -0,0 +1,46 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.11 on 2026-10-18 03:53
+from __future__ import unicode_literals
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('api', '0013_move_log'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PlayerStats',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('rows', models.PositiveIntegerField()),
+                ('columns', models.PositiveIntegerField()),
+                ('mines', models.PositiveIntegerField()),
+                ('played', models.PositiveIntegerField(default=0, help_text='Finished games')),
+                ('won', models.PositiveIntegerField(default=0)),
+                ('lost', models.PositiveIntegerField(default=0)),
+                ('timeout', models.PositiveIntegerField(default=0)),
+                ('best_seconds', models.PositiveIntegerField(blank=True, help_text='Fastest win', null=True)),
+                ('updated', models.DateTimeField(auto_now=True)),
+                ('player', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='stats', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'verbose_name': 'Player stats',
+                'verbose_name_plural': 'Player stats',
+            },
+        ),
+        migrations.AddIndex(
+            model_name='playerstats',
+            index=models.Index(fields=['rows', 'columns', 'mines', 'best_seconds'], name='api_players_rows_3db6a1_idx'),
+        ),
+        migrations.AlterUniqueTogether(
+            name='playerstats',
+            unique_together=set([('player', 'rows', 'columns', 'mines')]),
+        ),
+    ]
@@ -0,0 +1,40 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.11 on 2026-10-18 03:57
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0014_player_stats'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='GameArchive',
+            fields=[
+                ('game', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='archive', serialize=False, to='api.Game')),
+                ('cells', models.BinaryField(help_text='Packed board, or the stored chunks of a chunked game one after the other')),
+                ('chunk_indexes', models.BinaryField(blank=True, default=b'', help_text='Indexes of the stored chunks of a chunked game (see pack_indexes)')),
+                ('moves', models.BinaryField(blank=True, default=b'', help_text='Move log as (move, x, y) triples of 32 bit numbers')),
+                ('move_times', models.BinaryField(blank=True, default=b'', help_text='When each move was played, in microseconds since 1970 (UTC)')),
+                ('created', models.DateTimeField(auto_now_add=True)),
+            ],
+            options={
+                'verbose_name': 'Game archive',
+                'verbose_name_plural': 'Game archives',
+            },
+        ),
+        migrations.AddField(
+            model_name='game',
+            name='archived',
+            field=models.BooleanField(default=False, help_text='The board and move log are in a GameArchive row'),
+        ),
+        migrations.AddIndex(
+            model_name='game',
+            index=models.Index(fields=['archived', 'state', 'updated'], name='api_game_archive_824c2a_idx'),
+        ),
+    ]
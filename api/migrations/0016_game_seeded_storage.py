@@ -0,0 +1,35 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.11 on 2026-10-18 04:06
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0015_game_archive'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='game',
+            name='first_cell',
+            field=models.PositiveIntegerField(blank=True, help_text='Index of the field the mines were placed around (the first reveal), none of them is in it or its adjacent fields', null=True),
+        ),
+        migrations.AlterField(
+            model_name='game',
+            name='cells',
+            field=models.BinaryField(blank=True, default=b'', help_text='Packed board, one byte per field (see api.boards), or the marks of a seeded board compressed with zlib (see Board.marks)'),
+        ),
+        migrations.AlterField(
+            model_name='game',
+            name='storage',
+            field=models.IntegerField(choices=[(0, 'packed'), (1, 'chunked'), (2, 'seeded')], default=0, help_text='Chunked boards are stored in BoardChunk rows instead of cells, seeded boards only store the marks: their mines are placed again by the seed'),
+        ),
+        migrations.AlterField(
+            model_name='gamearchive',
+            name='cells',
+            field=models.BinaryField(help_text='Packed board, the marks of a seeded game or the stored chunks of a chunked game one after the other'),
+        ),
+    ]
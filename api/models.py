@@ -1,8 +1,28 @@
 # -*- coding: utf-8 -*-
 from __future__ import unicode_literals
-import json
-import random
-from django.db import models
+import calendar
+import hashlib
+import math
+import zlib
+from array import array
+from datetime import datetime, timedelta
+from django.conf import settings
+from django.db import IntegrityError, connection, models, transaction
+from django.db.models import F, Value
+from django.db.models.functions import Coalesce, Least
+from django.utils import timezone
+from api.boards import (Board, FLAG, QUESTION, board_id, first_exclude, new_seed, pack_indexes,
+                        unpack_indexes)
+from api.cache import game_cache, layout_cache
+from api.chunks import ChunkedBoard
+from api import instrumentation
+
+
+EPOCH = datetime(1970, 1, 1, tzinfo=timezone.utc)
+
+
+class GameConflict(Exception):
+    """Raised when saving a game that was saved by someone else since it was loaded"""
 
 
 class Game(models.Model):
@@ -22,117 +42,775 @@ class Game(models.Model):
         (STATE_WON, 'won'),
         (STATE_LOST, 'lost'),
     )
+    FINISHED_STATES = (STATE_TIMEOUT, STATE_WON, STATE_LOST)
+
+    STORAGE_PACKED = 0
+    STORAGE_CHUNKED = 1
+    STORAGE_SEEDED = 2
+    STORAGE_CHOICES = (
+        (STORAGE_PACKED, 'packed'),
+        (STORAGE_CHUNKED, 'chunked'),
+        (STORAGE_SEEDED, 'seeded'),
+    )
+
+    MOVE_REVEAL = 'reveal'
+    MOVE_FLAG = 'flag'
+    MOVE_QUESTION = 'question'
+    MOVE_CHOICES = (
+        (MOVE_REVEAL, 'reveal'),
+        (MOVE_FLAG, 'flag'),
+        (MOVE_QUESTION, 'question'),
+    )
+
+    DURATION_SECONDS = 90
 
     created = models.DateTimeField(auto_now_add=True)
     updated = models.DateTimeField(auto_now=True)
     title = models.CharField(max_length=255, blank=True, default='Game')
 
-    board = models.TextField(blank=True, default='', help_text='Board as a JSON matrix. (0-9: adjacent mines, x: mine)')
+    rows = models.PositiveIntegerField(default=0)
+    columns = models.PositiveIntegerField(default=0)
+    mines = models.PositiveIntegerField(default=0)
+    seed = models.BigIntegerField(null=True, blank=True, help_text='Places the mines (see Board.generate)')
+    mines_placed = models.BooleanField(default=False, help_text='Mines are placed on the first reveal')
+    first_cell = models.PositiveIntegerField(null=True, blank=True,
+                                             help_text='Index of the field the mines were placed around (the first '
+                                                       'reveal), none of them is in it or its adjacent fields')
+    spares = models.BinaryField(blank=True, default=b'',
+                                help_text='Spare fields of a board from the pool until its mines are placed '
+                                          '(see BoardPool)')
+    hidden_safe_cells = models.PositiveIntegerField(default=0, help_text='Fields without a mine not revealed yet')
+    storage = models.IntegerField(choices=STORAGE_CHOICES, default=STORAGE_PACKED,
+                                  help_text='Chunked boards are stored in BoardChunk rows instead of cells, seeded '
+                                            'boards only store the marks: their mines are placed again by the seed')
+    cells = models.BinaryField(blank=True, default=b'',
+                               help_text='Packed board, one byte per field (see api.boards), or the marks of a seeded '
+                                         'board compressed with zlib (see Board.marks)')
+    board = models.TextField(blank=True, default='',
+                             help_text='Legacy board as a JSON matrix, only read if cells is empty. '
+                                       '(0-9: adjacent mines, x: mine)')
     player_board = models.TextField(blank=True, default='',
-                                    help_text='Board as a JSON matrix. (v: visible, h: hidden, ?: question mark, !: exclamation mark.')
+                                    help_text='Legacy board as a JSON matrix, only read if cells is empty. '
+                                              '(v: visible, h: hidden, ?: question mark, !: exclamation mark.')
     state = models.IntegerField(choices=STATE_CHOICES, default=STATE_NEW)
-    duration_seconds = models.IntegerField(default=90,  help_text='Game duration: 90 seconds')
+    version = models.PositiveIntegerField(default=0, help_text='Incremented on every save')
+    move_count = models.PositiveIntegerField(default=0, help_text='Moves in the log (see Move)')
+    snapshot_seq = models.PositiveIntegerField(default=0, help_text='Moves already applied to the packed cells')
+    archived = models.BooleanField(default=False, help_text='The board and move log are in a GameArchive row')
+    duration_seconds = models.IntegerField(default=DURATION_SECONDS,
+                                           help_text='Seconds left when the clock was last stopped. '
+                                                     'Game duration: 90 seconds')
+    deadline = models.DateTimeField(null=True, blank=True, db_index=True,
+                                    help_text='When the time is over, only set while the clock runs')
     player = models.ForeignKey('auth.User', related_name='games', on_delete=models.CASCADE)
 
     class Meta:
         verbose_name = 'Game'
         verbose_name_plural = 'Games'
         ordering = ('created',)
+        indexes = [
+            models.Index(fields=['player', 'state', 'created']),
+            models.Index(fields=['archived', 'state', 'updated']),
+        ]
+
+    _board = None
+    _changes = ()
+    _moves = ()
+    _snapshot_needed = False
+    _saved_state = None
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        game = super(Game, cls).from_db(db, field_names, values)
+        if 'state' in field_names:
+            game._saved_state = game.state  # to count the result once when the game finishes (see save)
+        return game
 
     def __str__(self):
         return self.title
 
+    def get_board(self):
+        """
+        Returns the decoded board, from the process cache if it holds this version of the game.
+        Games saved before the packed format are decoded from the legacy JSON columns.
+        The cells are a snapshot: the moves logged since are replayed on them.
+        Until the mines are placed the board has no mines (unless it comes from the pool), only the marks of the player.
+        Chunked games get a ChunkedBoard, which loads its chunks as they are needed.
+        Seeded games get their mines placed again by the seed (see layout_cache) and only decode their marks.
+        Archived games are read from their GameArchive row.
+        """
+        if self._board is None and self.storage == Game.STORAGE_CHUNKED:
+            self._board = ChunkedBoard(self.rows, self.columns, self.mines, self.seed, self.mines_placed,
+                                       self._load_chunks)
+        if self._board is None:
+            board = game_cache.get(self.pk, self.version) if self.pk else None
+            if board is None:
+                if self.storage == Game.STORAGE_SEEDED:
+                    board = self._seeded_board()
+                elif self.archived:
+                    board = Board(self.rows, self.columns, self.archive.board_cells())
+                elif self.cells:
+                    board = Board(self.rows, self.columns, self.cells)
+                    instrumentation.add('board_decoded_bytes', len(self.cells))
+                elif self.board:
+                    board = Board.from_json(self.board, self.player_board)
+                    instrumentation.add('board_decoded_bytes', len(self.board) + len(self.player_board))
+                else:
+                    board = Board(self.rows, self.columns)  # nothing played yet, mines not placed
+                if self.pk and self.move_count > self.snapshot_seq:
+                    self._replay_moves(board, self.logged_moves(self.snapshot_seq, self.move_count))
+                if self.pk:
+                    game_cache.put(self.pk, self.version, board)
+            self._board = board
+        return self._board
+
+    def _seeded_board(self):
+        """Returns the board of a seeded game: the layout of its mines (if they are placed) with its marks"""
+        if self.mines_placed:
+            board = layout_cache.get(self.rows, self.columns, self.mines, self.seed, self.first_cell)
+        else:
+            board = Board(self.rows, self.columns)
+        if self.archived:
+            board.add_marks(self.archive.board_cells())  # the archive compresses the marks itself
+        elif self.cells:
+            board.add_marks(zlib.decompress(bytes(self.cells)))
+            instrumentation.add('board_decoded_bytes', len(self.cells))
+        return board
+
+    def board_id(self):
+        """
+        Returns the id of the board of the game (see api.boards.board_id), which creates games with the same mines.
+        Only games placing their mines by the seed in a packed board have one
+        """
+        if self.seed is None or self.storage == Game.STORAGE_CHUNKED or (self.mines_placed and self.first_cell is None):
+            return None
+        return board_id(self.rows, self.columns, self.mines, self.seed, self.first_cell)
+
     @staticmethod
-    def _inside_board(rows, cols, point):
-        """ Returns whether the point is inside the board (specified by rows,cols) or not (overflow)"""
-        y, x = point
-        return (0 <= x < cols) and (0 <= y < rows)
+    def daily_board_id(rows, columns, mines, day):
+        """
+        Returns the id of the shared board of a day: the seed comes from the day and the SECRET_KEY, so it can not
+        be known ahead, and the first field is the one in the middle
+        """
+        key = '%s:%s:%dx%dx%d' % (settings.SECRET_KEY, day.isoformat(), rows, columns, mines)
+        seed = int(hashlib.sha256(key.encode('utf-8')).hexdigest()[:16], 16) & (2 ** 63 - 1)
+        return board_id(rows, columns, mines, seed, rows // 2 * columns + columns // 2)
+
+    def logged_moves(self, after=0, until=None):
+        """Returns the (move, x, y) of the logged moves after move after, up to move until (the last one by default)"""
+        if self.archived:
+            return self.archive.move_list()[after:until]
+        moves = Move.objects.filter(game_id=self.pk, seq__gt=after).order_by('seq')
+        if until is not None:
+            moves = moves.filter(seq__lte=until)
+        return moves.values_list('move', 'x', 'y')
 
     @staticmethod
-    def _adjacent_points(rows, cols, x, y):
-        """Given a point(x,y) in the board (specified by rows,cols) this returns all adjacent points"""
-        up = (y - 1, x)
-        down = (y + 1, x)
-        left = (y, x - 1)
-        right = (y, x + 1)
-        upper_right = (y - 1, x + 1)
-        upper_left = (y - 1, x - 1)
-        lower_right = (y + 1, x + 1)
-        lower_left = (y + 1, x - 1)
-        points = [up, down, left, right, upper_left, upper_right, lower_left, lower_right]
-        return [p for p in points if Game._inside_board(rows, cols, p)]
+    def _replay_moves(board, moves):
+        """Applies the logged moves to the board, in order"""
+        marks = {Game.MOVE_FLAG: FLAG, Game.MOVE_QUESTION: QUESTION}
+        for move, x, y in moves:
+            if move == Game.MOVE_REVEAL:
+                board.reveal(x, y)
+            else:
+                board.mark(x, y, marks[move])
+
+    def replay(self, seq=None):
+        """
+        Returns the board rebuilt from the seed and the move log, up to move seq (the last one by default).
+        Raises ValueError for games without a seed (created before it).
+        """
+        if self.seed is None:
+            raise ValueError('Games without a seed can not be replayed')
+        game = Game()
+        game.setup(self.rows, self.columns, self.mines, self.seed, self.storage, self.first_cell)
+        for move, x, y in self.logged_moves(until=seq):
+            if move == Game.MOVE_REVEAL:
+                game.reveal_at(x, y)
+            elif move == Game.MOVE_FLAG:
+                game.mark_flag_at(x, y)
+            else:
+                game.mark_question_at(x, y)
+        return game.get_board()
+
+    def _load_chunks(self, indexes):
+        if not self.pk:
+            return []
+        if self.archived:
+            chunks = self.archive.chunk_cells(self._board)
+            return [(index, chunks[index]) for index in (chunks if indexes is None else indexes) if index in chunks]
+        chunks = BoardChunk.objects.filter(game_id=self.pk)
+        if indexes is not None:
+            chunks = chunks.filter(index__in=indexes)
+        return chunks.values_list('index', 'cells')
+
+    def _save_chunks(self):
+        """Writes the chunks changed since they were loaded"""
+        board = self._board
+        created = []
+        for index in sorted(board.dirty):
+            cells = bytes(board.chunks[index].cells)
+            instrumentation.add('board_encoded_bytes', len(cells))
+            if index in board.stored:
+                BoardChunk.objects.filter(game_id=self.pk, index=index).update(cells=cells)
+            else:
+                created.append(BoardChunk(game_id=self.pk, index=index, cells=cells))
+        BoardChunk.objects.bulk_create(created)
+        board.stored.update(chunk.index for chunk in created)
+        board.dirty.clear()
+
+    def changed_points(self):
+        """Returns the points (x,y) revealed or marked through this instance, in order"""
+        return list(self._changes)
+
+    def _track_changes(self, points):
+        if not self._changes:
+            self._changes = []
+        self._changes.extend(points)
+
+    def set_board(self, board):
+        """
+        Replaces the board (mines placed), mines and hidden_safe_cells are counted again. The seed does not place its
+        mines, so a seeded game stores the whole board from now on
+        """
+        self._board = board
+        self._snapshot_needed = True
+        if self.storage == Game.STORAGE_SEEDED:
+            self.storage = Game.STORAGE_PACKED
+        self.first_cell = None
+        self.rows, self.columns = board.rows, board.cols
+        self.mines = board.mine_count()
+        self.hidden_safe_cells = board.hidden_safe_count()
+        self.mines_placed = True
+
+    def setup(self, rows, columns, mines, seed=None, storage=None, first=None):
+        """
+        Sets up a new game without building its board: the mines are placed by the seed (a random one if it is not
+        given) when the first field is revealed, so that the first reveal never hits a mine. With the index of a
+        first field they are placed around it now instead, as on a shared board (see api.boards.board_id).
+        Boards of more than GAME_CHUNKED_FIELDS fields are chunked unless the storage is given, the rest are seeded
+        (only their marks are stored, the mines are placed again by the seed when the board is loaded).
+        Without a seed, a board of the same configuration is taken from the pool if it has one: pooled boards are
+        packed, their mines placed ahead.
+        """
+        assert mines < rows * columns  # to make sure that there are fewer mines than fields
+        if storage is None:
+            storage = Game.default_storage(rows, columns)
+        if seed is None and storage != Game.STORAGE_CHUNKED:
+            pooled = BoardPool.claim(rows, columns, mines, 1)
+            if pooled:
+                self.setup_pooled(pooled[0])
+                return
+        self.rows, self.columns, self.mines = rows, columns, mines
+        self.storage = storage
+        self.seed = new_seed() if seed is None else seed
+        self.hidden_safe_cells = rows * columns - mines
+        self.mines_placed = False
+        self.first_cell = None
+        self._board = None
+        if first is not None:
+            self.place_mines(first % columns, first // columns)
 
     @staticmethod
-    def _fill_adjacent(board, rows, cols, x, y):
-        """If the point has a mine (x) this updates all adjacent points with current value + 1"""
-        if board[y][x] == 'x':
-            for p in Game._adjacent_points(rows, cols, x, y):
-                py, px = p
-                if board[py][px] != 'x':
-                    board[py][px] = str(int(board[py][px]) + 1)
+    def default_storage(rows, columns):
+        if rows * columns > getattr(settings, 'GAME_CHUNKED_FIELDS', 1024 * 1024):
+            return Game.STORAGE_CHUNKED
+        return Game.STORAGE_SEEDED
+
+    def setup_pooled(self, pooled):
+        """
+        Sets up a new game with a board generated ahead by the seed (a BoardPool). The first reveal moves the mines
+        out of its way, which gives the same board as placing them then.
+        """
+        self.rows, self.columns, self.mines, self.seed = pooled.rows, pooled.columns, pooled.mines, pooled.seed
+        self.storage = Game.STORAGE_PACKED
+        self.cells = pooled.cells
+        self.spares = pooled.spares
+        self.hidden_safe_cells = pooled.rows * pooled.columns - pooled.mines
+        self.mines_placed = False
+        self.first_cell = None
+        self._board = None
+
+    @classmethod
+    def create_games(cls, player, rows, columns, mines, count, seed=None, storage=None, title=None, first=None):
+        """
+        Creates count new games in one insert, with boards from the pool as far as it has them (unless a seed is
+        given, then every game gets the same board, see setup). Returns them.
+        """
+        title = title or 'Game for user %s' % player.username
+        if storage is None:
+            storage = cls.default_storage(rows, columns)
+        games = []
+        if seed is None and storage != Game.STORAGE_CHUNKED:
+            for pooled in BoardPool.claim(rows, columns, mines, count):
+                game = cls(player=player, title=title, version=1)
+                game.setup_pooled(pooled)
+                games.append(game)
+        while len(games) < count:
+            game = cls(player=player, title=title, version=1)
+            game.setup(rows, columns, mines, new_seed() if seed is None else seed, storage, first)
+            if game._board is not None and storage != Game.STORAGE_CHUNKED:
+                game._pack_board()  # the mines were placed around the first cell, bulk_create does not call save
+            games.append(game)
+        with transaction.atomic():
+            last = cls.objects.order_by('-pk').values_list('pk', flat=True).first() or 0
+            cls.objects.bulk_create(games)
+            if games and games[0].pk is None:
+                # Only some databases (PostgreSQL) return the ids of bulk inserts
+                for game, pk in zip(games, cls.objects.filter(player=player, pk__gt=last).order_by('pk').values_list(
+                        'pk', flat=True)):
+                    game.pk = pk
+        return games
+
+    def place_mines(self, x, y):
+        """
+        Places the mines by the seed, none of them in point (x,y) or its adjacent fields (only (x,y) is kept free if
+        there are not enough fields for that). The marks set so far are kept.
+        """
+        self.first_cell = y * self.columns + x
+        if self.storage == Game.STORAGE_CHUNKED:
+            self.get_board().place_mines(x, y)
+            self.mines_placed = True
+            return
+        marks = self.get_board()
+        if self.spares:
+            # Board from the pool, generated by the seed without exclude
+            board = marks
+            board.move_mines(first_exclude(self.rows, self.columns, self.mines, self.first_cell),
+                             unpack_indexes(self.spares))
+            self.spares = b''
+        else:
+            if self.storage == Game.STORAGE_SEEDED:
+                board = layout_cache.get(self.rows, self.columns, self.mines, self.seed, self.first_cell)
+            else:
+                board = Board.layout(self.rows, self.columns, self.mines, self.seed, self.first_cell)
+            board.add_marks(marks.marks())
+        self._board = board
+        self.mines_placed = True
+        self._snapshot_needed = True
+
+    def save(self, *args, **kwargs):
+        """
+        Appends the moves played through this instance to the log and caches the decoded board (if any) for the new
+        version. The board is only packed into cells (a snapshot, only the marks of seeded games) every
+        GAME_SNAPSHOT_MOVES moves, when the mines are placed or the board replaced: other saves leave the board
+        columns alone. Chunked games write their
+        changed chunks instead, in the same transaction, as well as the results of the game if it just finished
+        (see PlayerStats).
+        Raises GameConflict if the row is not at the version this instance was loaded with anymore.
+        """
+        chunked = self.storage == Game.STORAGE_CHUNKED
+        moves = list(self._moves)
+        move_count, snapshot_seq = self.move_count, self.snapshot_seq
+        self.move_count += len(moves)
+        if self._board is not None and not chunked and (
+                self.pk is None or self._snapshot_needed or
+                self.move_count - self.snapshot_seq >= getattr(settings, 'GAME_SNAPSHOT_MOVES', 100)):
+            self._pack_board()
+        elif chunked:
+            self.snapshot_seq = self.move_count
+        elif self.pk is not None and 'update_fields' not in kwargs:
+            kwargs['update_fields'] = [field.name for field in self._meta.concrete_fields if not field.primary_key and
+                                       field.name not in ('cells', 'board', 'player_board')]
+        self.version += 1
+        try:
+            with transaction.atomic():
+                super(Game, self).save(*args, **kwargs)
+                if self._board is not None and chunked:
+                    self._save_chunks()
+                Move.objects.bulk_create([Move(game_id=self.pk, seq=move_count + i + 1, move=move, x=x, y=y)
+                                          for i, (move, x, y) in enumerate(moves)])
+                if self.is_finished() and self._saved_state not in Game.FINISHED_STATES:
+                    PlayerStats.record([self])
+        except GameConflict:
+            self.version -= 1
+            self.move_count, self.snapshot_seq = move_count, snapshot_seq
+            raise
+        self._moves = ()
+        self._snapshot_needed = False
+        self._saved_state = self.state
+        if self._board is not None and not chunked:
+            game_cache.put(self.pk, self.version, self._board)
+
+    def _pack_board(self):
+        """Packs the board into cells (only the marks of seeded games), a snapshot of the moves logged so far"""
+        self.rows = self._board.rows
+        self.columns = self._board.cols
+        if self.storage == Game.STORAGE_SEEDED:
+            self.cells = zlib.compress(self._board.marks())
+        else:
+            self.cells = bytes(self._board.cells)
+        instrumentation.add('board_encoded_bytes', len(self.cells))
+        self.board = ''
+        self.player_board = ''
+        self.snapshot_seq = self.move_count
+
+    def _do_update(self, base_qs, using, pk_val, values, update_fields, forced_update):
+        # Compare and swap: the update only matches the row if nobody saved it since this instance was loaded
+        updated = super(Game, self)._do_update(base_qs.filter(version=self.version - 1), using, pk_val, values,
+                                               update_fields, forced_update)
+        if not updated and base_qs.filter(pk=pk_val).exists():
+            raise GameConflict()
+        return updated
 
     @staticmethod
-    def new_boards(rows, cols, mines):
-        """Creates and returns a new boards and a new player_board"""
-        assert mines < (rows * cols)  # to make sure that there are fewer mines than fields
-
-        board = [['0' for j in range(cols)] for i in range(rows)]
-        player_board = [['h' for j in range(cols)] for i in range(rows)]
-        for i in range(mines):
-            mine_set = False
-            while not mine_set:
-                x = random.randint(0, cols - 1)
-                y = random.randint(0, rows - 1)
-                if board[y][x] != 'x':
-                    board[y][x] = 'x'
-                    mine_set = True  # distributes mines randomly in the board
-        for i in range(rows):
-            for j in range(cols):
-                Game._fill_adjacent(board, rows, cols, j, i)  # for each field with a mine it updates adj fields' values
-        return json.dumps(board), json.dumps(player_board)
+    def new_boards(rows, cols, mines, seed=None):
+        """
+        Creates and returns a new Board (mines placed, every field hidden).
+        The same seed always places the mines in the same fields, a random one is used if it is not given.
+        """
+        return Board.generate(rows, cols, mines, new_seed() if seed is None else seed)
 
     def reveal_at(self, x, y):
         """
         Reveals a field in point (x,y)
-        If if is already revealed ('v') exits the function.
-        Else it marks the field as revealed. Also if the field has not adjacent fields with mines in them, it calls the
-        function recursively in order to reveal all the adj fields until a field with value > 0 is found.
-        """
-        pboard = json.loads(self.player_board)
-        if pboard[y][x] != 'v':
-            pboard[y][x] = 'v'
-            self.player_board = json.dumps(pboard)
-            board = json.loads(self.board)
-            rows, cols = len(board), len(board[0])
-            if board[y][x] == '0':
-                for p in Game._adjacent_points(rows, cols, x, y):
-                    py, px = p
-                    self.reveal_at(px, py)
+        If it is already revealed nothing changes.
+        Else it marks the field as revealed. Also if the field has not adjacent fields with mines in them, it keeps
+        revealing the adj fields (flood fill) until fields with value > 0 are found.
+        Returns the list of newly revealed points (x,y).
+        """
+        if not self.mines_placed:
+            self.place_mines(x, y)
+        board = self.get_board()
+        revealed = board.reveal(x, y)
+        self.hidden_safe_cells -= sum(1 for px, py in revealed if not board.is_mine(px, py))
+        self._track_changes(revealed)
+        return revealed
+
+    def remaining_seconds(self, now=None):
+        """Seconds left to play. While the clock runs they are counted from the deadline"""
+        if self.deadline is None:
+            return self.duration_seconds
+        now = now or timezone.now()
+        return max(0, int(math.ceil((self.deadline - now).total_seconds())))
+
+    def start_clock(self, now=None):
+        if self.deadline is None:
+            self.deadline = (now or timezone.now()) + timedelta(seconds=self.duration_seconds)
+
+    def stop_clock(self, now=None):
+        if self.deadline is not None:
+            self.duration_seconds = self.remaining_seconds(now)
+            self.deadline = None
+
+    def check_timeout(self, now=None):
+        """Finishes the game by timeout if its clock ran out. Returns whether it did"""
+        if self.state == Game.STATE_STARTED and self.deadline is not None and self.deadline <= (now or timezone.now()):
+            self.state = Game.STATE_TIMEOUT
+            self.duration_seconds = 0
+            self.deadline = None
+            return True
+        return False
+
+    def pause(self):
+        """Stops the clock of a game in play. Returns whether the game changed"""
+        if self.is_finished() or self.state == Game.STATE_PAUSED:
+            return False
+        self.stop_clock()
+        self.state = Game.STATE_PAUSED
+        return True
+
+    def resume(self):
+        """Starts the clock of a game not finished. Returns whether the game changed"""
+        if self.is_finished() or self.state == Game.STATE_STARTED:
+            return False
+        self.start_clock()
+        self.state = Game.STATE_STARTED
+        return True
+
+    def play(self, move, x, y):
+        """
+        Applies a move (MOVE_REVEAL, MOVE_FLAG or MOVE_QUESTION) in point (x,y).
+        The first move of a new game starts the clock. Revealing a mine loses the game and revealing the last field
+        without a mine wins it. Finished and paused games are not changed (the clock of a paused game is stopped).
+        Returns the list of points changed by the move. Moves that change something are logged when the game is saved.
+        """
+        if self.is_finished() or self.state == Game.STATE_PAUSED:
+            return []
+        if self.state == Game.STATE_NEW:
+            self.resume()
+        if move == Game.MOVE_FLAG:
+            changed = self.mark_flag_at(x, y)
+        elif move == Game.MOVE_QUESTION:
+            changed = self.mark_question_at(x, y)
+        else:
+            changed = self.reveal_at(x, y)
+            if self.is_mine_at(x, y):
+                self.state = Game.STATE_LOST
+                self.stop_clock()
+            elif self.is_all_revealed():
+                self.state = Game.STATE_WON
+                self.stop_clock()
+        if changed:
+            if not self._moves:
+                self._moves = []
+            self._moves.append((move, x, y))
+        return changed
+
+    def is_finished(self):
+        return self.state in Game.FINISHED_STATES
+
+    def elapsed_seconds(self):
+        """Seconds played so far"""
+        return Game.DURATION_SECONDS - self.remaining_seconds()
 
     def is_mine_at(self, x, y):
         """Returns whether the field has a mine in it or not"""
-        board = json.loads(self.board)
-        return board[y][x] == 'x'
+        return self.get_board().is_mine(x, y)
 
     def is_all_revealed(self):
         """Returns whether the board is all revealed (except for the fields with a mine in it) or not"""
-        board = json.loads(self.board)
-        pboard = json.loads(self.player_board)
-        rows, cols = len(board), len(board[0])
-        for i in range(rows):
-            for j in range(cols):
-                if board[i][j] != 'x' and pboard[i][j] != 'v':
-                    return False
-        return True
+        return self.hidden_safe_cells == 0
 
     def mark_flag_at(self, x, y):
-        """Marks a field with a flag"""
-        board = json.loads(self.player_board)
-        board[y][x] = '!'
-        self.player_board = json.dumps(board)
+        """Marks a field with a flag. Returns the points changed, none if the field is revealed or flagged already"""
+        changed = [(x, y)] if self.get_board().mark(x, y, FLAG) else []
+        self._track_changes(changed)
+        return changed
 
     def mark_question_at(self, x, y):
-        """Marks a field with a question mark"""
-        board = json.loads(self.player_board)
-        board[y][x] = '?'
-        self.player_board = json.dumps(board)
+        """
+        Marks a field with a question mark. Returns the points changed, none if the field is revealed or marked
+        already
+        """
+        changed = [(x, y)] if self.get_board().mark(x, y, QUESTION) else []
+        self._track_changes(changed)
+        return changed
+
+
+class BoardChunk(models.Model):
+    """Chunk of the board of a chunked game (see api.chunks)"""
+
+    game = models.ForeignKey(Game, related_name='chunks', on_delete=models.CASCADE)
+    index = models.PositiveIntegerField(help_text='Chunks are numbered in row major order')
+    cells = models.BinaryField(help_text='Packed chunk, one byte per field (see api.boards)')
+
+    class Meta:
+        verbose_name = 'Board chunk'
+        verbose_name_plural = 'Board chunks'
+        unique_together = ('game', 'index')
+
+    def __str__(self):
+        return '%s, chunk %d' % (self.game_id, self.index)
+
+
+class BoardPool(models.Model):
+    """Packed board generated ahead for a common configuration, taken by a new game (see fill_board_pool)"""
+
+    created = models.DateTimeField(auto_now_add=True)
+    rows = models.PositiveIntegerField()
+    columns = models.PositiveIntegerField()
+    mines = models.PositiveIntegerField()
+    seed = models.BigIntegerField(help_text='Placed the mines, without exclude (see Board.generate)')
+    cells = models.BinaryField(help_text='Packed board, every field hidden (see api.boards)')
+    spares = models.BinaryField(help_text='Next fields in the order of the seed (see Board.move_mines)')
+
+    class Meta:
+        verbose_name = 'Pooled board'
+        verbose_name_plural = 'Pooled boards'
+        indexes = [
+            models.Index(fields=['rows', 'columns', 'mines']),
+        ]
+
+    def __str__(self):
+        return '%dx%d, %d mines' % (self.rows, self.columns, self.mines)
+
+    @classmethod
+    def claim(cls, rows, columns, mines, count):
+        """Takes up to count boards of this configuration out of the pool. Returns them"""
+        boards = cls.objects.filter(rows=rows, columns=columns, mines=mines)
+        if connection.features.has_select_for_update_skip_locked:
+            with transaction.atomic():
+                claimed = list(boards.select_for_update(skip_locked=True)[:count])
+                cls.objects.filter(pk__in=[board.pk for board in claimed]).delete()
+            return claimed
+        # Elsewhere a board is only taken by the request that deletes it
+        claimed = []
+        while len(claimed) < count:
+            candidates = list(boards[:count - len(claimed)])
+            if not candidates:
+                break
+            claimed.extend(board for board in candidates if cls.objects.filter(pk=board.pk).delete()[0])
+        return claimed
+
+
+class Move(models.Model):
+    """Move played in a game, the log is append only"""
+
+    game = models.ForeignKey(Game, related_name='move_log', on_delete=models.CASCADE)
+    seq = models.PositiveIntegerField(help_text='1 for the first move of the game, 2 for the next one...')
+    move = models.CharField(max_length=10, choices=Game.MOVE_CHOICES)
+    x = models.PositiveIntegerField()
+    y = models.PositiveIntegerField()
+    created = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        verbose_name = 'Move'
+        verbose_name_plural = 'Moves'
+        unique_together = ('game', 'seq')
+
+    def __str__(self):
+        return '%s %d: %s (%d, %d)' % (self.game_id, self.seq, self.move, self.x, self.y)
+
+
+class PlayerStats(models.Model):
+    """
+    Results of the finished games of a player with one board configuration (rows, columns and mines). The counters
+    are updated as games finish (see PlayerStats.record) and can be computed again with the rebuild_stats command.
+    """
+
+    player = models.ForeignKey('auth.User', related_name='stats', on_delete=models.CASCADE)
+    rows = models.PositiveIntegerField()
+    columns = models.PositiveIntegerField()
+    mines = models.PositiveIntegerField()
+    played = models.PositiveIntegerField(default=0, help_text='Finished games')
+    won = models.PositiveIntegerField(default=0)
+    lost = models.PositiveIntegerField(default=0)
+    timeout = models.PositiveIntegerField(default=0)
+    best_seconds = models.PositiveIntegerField(null=True, blank=True, help_text='Fastest win')
+    updated = models.DateTimeField(auto_now=True)
+
+    RESULT_FIELDS = {Game.STATE_WON: 'won', Game.STATE_LOST: 'lost', Game.STATE_TIMEOUT: 'timeout'}
+
+    class Meta:
+        verbose_name = 'Player stats'
+        verbose_name_plural = 'Player stats'
+        unique_together = ('player', 'rows', 'columns', 'mines')
+        indexes = [
+            models.Index(fields=['rows', 'columns', 'mines', 'best_seconds']),
+        ]
+
+    def __str__(self):
+        return '%s, %dx%d with %d mines' % (self.player_id, self.rows, self.columns, self.mines)
+
+    @property
+    def win_rate(self):
+        return float(self.won) / self.played if self.played else 0.0
+
+    @classmethod
+    def record(cls, games):
+        """Counts the results of games that just finished, with one update per player and board configuration"""
+        groups = {}
+        for game in games:
+            counts = groups.setdefault((game.player_id, game.rows, game.columns, game.mines), {
+                'played': 0, 'won': 0, 'lost': 0, 'timeout': 0, 'best_seconds': None})
+            counts['played'] += 1
+            counts[cls.RESULT_FIELDS[game.state]] += 1
+            if game.state == Game.STATE_WON:
+                seconds = game.elapsed_seconds()
+                if counts['best_seconds'] is None or seconds < counts['best_seconds']:
+                    counts['best_seconds'] = seconds
+        for (player_id, rows, columns, mines), counts in groups.items():
+            key = {'player_id': player_id, 'rows': rows, 'columns': columns, 'mines': mines}
+            changes = dict((field, F(field) + count) for field, count in counts.items()
+                           if field != 'best_seconds' and count)
+            best = counts['best_seconds']
+            if best is not None:
+                changes['best_seconds'] = Least(Coalesce('best_seconds', Value(best)), Value(best))
+            if cls.objects.filter(**key).update(**changes):
+                continue
+            try:
+                with transaction.atomic():
+                    cls.objects.create(**dict(key, **counts))
+            except IntegrityError:
+                # created by another transaction in between
+                cls.objects.filter(**key).update(**changes)
+
+
+class GameArchive(models.Model):
+    """
+    Board and move log of a finished game, compressed with zlib (see the archive_games command). The game row keeps
+    every other field, with its board columns emptied.
+    """
+
+    game = models.OneToOneField(Game, primary_key=True, related_name='archive', on_delete=models.CASCADE)
+    cells = models.BinaryField(help_text='Packed board, the marks of a seeded game or the stored chunks of a chunked '
+                                         'game one after the other')
+    chunk_indexes = models.BinaryField(blank=True, default=b'',
+                                       help_text='Indexes of the stored chunks of a chunked game (see pack_indexes)')
+    moves = models.BinaryField(blank=True, default=b'', help_text='Move log as (move, x, y) triples of 32 bit numbers')
+    move_times = models.BinaryField(blank=True, default=b'',
+                                    help_text='When each move was played, in microseconds since 1970 (UTC)')
+    created = models.DateTimeField(auto_now_add=True)
+
+    MOVE_CODES = dict((move, code) for code, (move, name) in enumerate(Game.MOVE_CHOICES))
+
+    class Meta:
+        verbose_name = 'Game archive'
+        verbose_name_plural = 'Game archives'
+
+    def __str__(self):
+        return '%s' % self.game_id
+
+    @classmethod
+    def from_game(cls, game):
+        """Returns the archive of a game, with its board as it is now and its whole move log"""
+        board = game.get_board()
+        if game.storage == Game.STORAGE_CHUNKED:
+            board._fetch()
+            indexes = sorted(board.stored)
+            cells = b''.join(bytes(board.chunks[index].cells) for index in indexes)
+        elif game.storage == Game.STORAGE_SEEDED:
+            indexes, cells = [], board.marks()
+        else:
+            indexes, cells = [], bytes(board.cells)
+        moves, times = array(str('I')), array(str('q'))
+        for move, x, y, created in game.move_log.order_by('seq').values_list('move', 'x', 'y', 'created'):
+            moves.extend((cls.MOVE_CODES[move], x, y))
+            times.append(calendar.timegm(created.utctimetuple()) * 1000000 + created.microsecond)
+        return cls(game=game, cells=zlib.compress(cells), chunk_indexes=zlib.compress(pack_indexes(indexes)),
+                   moves=zlib.compress(moves.tobytes()), move_times=zlib.compress(times.tobytes()))
+
+    def board_cells(self):
+        cells = zlib.decompress(bytes(self.cells))
+        instrumentation.add('board_decoded_bytes', len(cells))
+        return cells
+
+    def chunk_cells(self, board):
+        """Returns {index: cells} of the stored chunks of the ChunkedBoard of the game"""
+        if not hasattr(self, '_chunks'):
+            cells, start = self.board_cells(), 0
+            self._chunks = {}
+            for index in unpack_indexes(zlib.decompress(bytes(self.chunk_indexes))):
+                x, y, rows, cols = board.chunk_bounds(index)
+                self._chunks[index] = cells[start:start + rows * cols]
+                start += rows * cols
+        return self._chunks
+
+    def move_list(self):
+        """Returns the (move, x, y) of the moves of the game, in order"""
+        if not hasattr(self, '_moves'):
+            numbers = unpack_indexes(zlib.decompress(bytes(self.moves)))
+            self._moves = [(Game.MOVE_CHOICES[numbers[i]][0], numbers[i + 1], numbers[i + 2])
+                           for i in range(0, len(numbers), 3)]
+        return self._moves
+
+    def move_log(self):
+        """Returns the moves of the game as (unsaved) Move instances, in order"""
+        times = array(str('q'))
+        times.frombytes(zlib.decompress(bytes(self.move_times)))
+        return [Move(game_id=self.game_id, seq=seq, move=move, x=x, y=y,
+                     created=EPOCH + timedelta(microseconds=created))
+                for seq, ((move, x, y), created) in enumerate(zip(self.move_list(), times), 1)]
+
+    @classmethod
+    def archive_games(cls, games):
+        """
+        Moves the boards, chunks and move logs of finished games to archive rows, in one transaction. Games changed
+        since they were loaded are left for later. Returns the number of games archived.
+        """
+        games = [game for game in games if game.is_finished() and not game.archived]
+        if not games:
+            return 0
+        archives = [cls.from_game(game) for game in games]
+        with transaction.atomic():
+            archived = set(game.pk for game in games if Game.objects.filter(
+                pk=game.pk, version=game.version, archived=False).update(
+                archived=True, cells=b'', board='', player_board='', snapshot_seq=F('move_count'),
+                version=F('version') + 1))
+            cls.objects.bulk_create([archive for archive in archives if archive.game_id in archived])
+            Move.objects.filter(game_id__in=archived).delete()
+            BoardChunk.objects.filter(game_id__in=archived).delete()
+        for game_id in archived:
+            game_cache.discard(game_id)
+        return len(archived)
@@ -0,0 +1,17 @@
+from rest_framework.pagination import CursorPagination
+
+
+class GameCursorPagination(CursorPagination):
+    """Newest games first. Cursor pages keep the same cost however deep the client pages"""
+    ordering = '-created'
+    page_size = 50
+    page_size_query_param = 'page_size'
+    max_page_size = 500
+
+
+class MoveCursorPagination(CursorPagination):
+    """Moves of a game in the order they were played"""
+    ordering = 'seq'
+    page_size = 500
+    page_size_query_param = 'page_size'
+    max_page_size = 5000
@@ -13,4 +13,4 @@ class IsOwnerOrReadOnly(permissions.BasePermission):
             return True
 
         # Write permissions are only allowed to the player of the game.
-        return obj.player == request.user
\ No newline at end of file
+        return obj.player_id == request.user.pk
\ No newline at end of file
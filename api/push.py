@@ -0,0 +1,55 @@
+# -*- coding: utf-8 -*-
+"""
+Pushes game updates to the websocket clients watching the game (see api.consumers).
+
+Each game has a group in the channel layer. A message has the format of the `?view=delta` responses plus its
+`event`: state (sent when a client connects), update (a move, pause or resume) or timeout. Updates are sent once the
+transaction that saved the game commits. Nothing is sent unless GAME_PUSH is on: the in memory channel layer does not
+reach the websockets of other processes, which need Redis (see REDIS_URL in the settings).
+"""
+from __future__ import unicode_literals
+import logging
+
+from asgiref.sync import async_to_sync
+from channels.layers import get_channel_layer
+from django.conf import settings
+from django.db import transaction
+
+from api.serializers import GameDeltaSerializer
+
+logger = logging.getLogger(__name__)
+
+EVENT_STATE = 'state'
+EVENT_UPDATE = 'update'
+EVENT_TIMEOUT = 'timeout'
+
+
+def enabled():
+    return getattr(settings, 'GAME_PUSH', False)
+
+
+def group_name(game_id):
+    return 'game-%d' % game_id
+
+
+def game_message(game, event):
+    return dict(GameDeltaSerializer(game).data, event=event)
+
+
+def send(game_id, message):
+    """Sends a message to the clients watching a game. A failing channel layer never fails the request"""
+    channel_layer = get_channel_layer()
+    if channel_layer is None:
+        return
+    try:
+        async_to_sync(channel_layer.group_send)(group_name(game_id), {'type': 'game.update', 'message': message})
+    except Exception:
+        logger.exception('Could not push the update of game %s', game_id)
+
+
+def publish(game, event=EVENT_UPDATE):
+    """Sends the state and changes of a saved game to the clients watching it when the transaction commits"""
+    if not enabled():
+        return
+    message = game_message(game, event)
+    transaction.on_commit(lambda: send(game.pk, message))
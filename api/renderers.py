@@ -0,0 +1,45 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from rest_framework.renderers import JSONRenderer
+from rest_framework.utils.encoders import JSONEncoder
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import ujson
+except ImportError:
+    ujson = None
+
+# Valid in JSON strings but not in javascript ones, JSONRenderer escapes them
+LINE_SEPARATOR = '\u2028'.encode('utf-8')
+PARAGRAPH_SEPARATOR = '\u2029'.encode('utf-8')
+
+
+class FastJSONRenderer(JSONRenderer):
+    """
+    Renders the same compact UTF-8 JSON as JSONRenderer with orjson, or else ujson, when one of them is installed.
+    Indented responses (`Accept: application/json; indent=4`) and data they can not encode are rendered by
+    JSONRenderer. U+2028 and U+2029 are escaped as JSONRenderer does, so that the output is valid javascript.
+    """
+    encoder_default = JSONEncoder().default
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if data is None:
+            return bytes()
+        if (orjson is not None or ujson is not None) and not self.get_indent(accepted_media_type,
+                                                                             renderer_context or {}):
+            try:
+                if orjson is not None:
+                    # dates go through the DRF encoder too, which writes UTC as Z
+                    ret = orjson.dumps(data, default=self.encoder_default, option=orjson.OPT_PASSTHROUGH_DATETIME)
+                else:
+                    ret = ujson.dumps(data, ensure_ascii=False, escape_forward_slashes=False).encode('utf-8')
+            except (TypeError, OverflowError):
+                pass
+            else:
+                return ret.replace(LINE_SEPARATOR, b'\\u2028').replace(PARAGRAPH_SEPARATOR, b'\\u2029')
+        return super(FastJSONRenderer, self).render(data, accepted_media_type, renderer_context)
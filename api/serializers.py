@@ -1,52 +1,255 @@
 from rest_framework import serializers
-from api.models import Game
+from api.boards import parse_board_id
+from api.models import Game, Move, PlayerStats
+from django.conf import settings
 from django.contrib.auth.models import User
-import json
+from django.utils.http import urlencode
+from rest_framework.reverse import reverse
 
 
 class GameSerializer(serializers.ModelSerializer):
     board_view = serializers.SerializerMethodField()
     state = serializers.SerializerMethodField()
     player = serializers.ReadOnlyField(source='player.username')
+    duration_seconds = serializers.SerializerMethodField()
+    board_id = serializers.SerializerMethodField()
 
     class Meta:
         model = Game
-        fields = ('id', 'title', 'state', 'board_view',
-                  'duration_seconds', 'player')
+        fields = ('id', 'title', 'state', 'version', 'board_view',
+                  'duration_seconds', 'player', 'board_id')
 
     def get_state(self, obj):
         return obj.get_state_display()
 
+    def get_board_id(self, obj):
+        # It tells where the mines are, so it is only shown once the game is over
+        return obj.board_id() if obj.is_finished() else None
+
+    def get_duration_seconds(self, obj):
+        return obj.remaining_seconds()
+
     def get_board_view(self, obj):
-        view = []
-        board = json.loads(obj.board)
-        player_board = json.loads(obj.player_board)
-        for i in range(len(board)):
-            view_row = []
-            for j in range(len(board[i])):
-                if player_board[i][j] == 'v':
-                    view_row.append(board[i][j])
-                elif player_board[i][j] == 'h':
-                    view_row.append(' ')
-                else:
-                    view_row.append(player_board[i][j])
-            view.append(view_row)
-        return view
+        board = obj.get_board()
+        region = self.context.get('region')
+        if self.context.get('board_format') == 'rows':
+            return board.view_rows(*(region or (0, 0, board.cols, board.rows)))
+        if region:
+            return board.view_region(*region)
+        return board.view()
+
+
+class GameSummarySerializer(serializers.ModelSerializer):
+    """Game without its board, for listings"""
+    state = serializers.SerializerMethodField()
+    player = serializers.ReadOnlyField(source='player.username')
+
+    class Meta:
+        model = Game
+        fields = ('id', 'title', 'state', 'rows', 'columns', 'mines', 'player', 'created', 'updated')
+
+    def get_state(self, obj):
+        return obj.get_state_display()
+
+
+class GameListFilterSerializer(serializers.Serializer):
+    state = serializers.ChoiceField(choices=[name for value, name in Game.STATE_CHOICES], required=False)
+    player = serializers.CharField(required=False, help_text='Username')
+    created_after = serializers.DateTimeField(required=False)
+    created_before = serializers.DateTimeField(required=False)
+
+    def validate_state(self, name):
+        return dict((state_name, value) for value, state_name in Game.STATE_CHOICES)[name]
+
+
+class GameDeltaSerializer(serializers.ModelSerializer):
+    """Game state with only the cells changed by the request instead of the whole board_view"""
+    state = serializers.SerializerMethodField()
+    changes = serializers.SerializerMethodField()
+    duration_seconds = serializers.SerializerMethodField()
+
+    class Meta:
+        model = Game
+        fields = ('id', 'state', 'version', 'changes', 'duration_seconds')
+
+    def get_state(self, obj):
+        return obj.get_state_display()
+
+    def get_duration_seconds(self, obj):
+        return obj.remaining_seconds()
+
+    def get_changes(self, obj):
+        points = obj.changed_points()
+        region = self.context.get('region')
+        if region:
+            x, y, width, height = region
+            points = [(px, py) for px, py in points if x <= px < x + width and y <= py < y + height]
+        if not points:
+            return []
+        board = obj.get_board()
+        return [{'x': x, 'y': y, 'value': board.view_at(x, y)} for x, y in points]
+
+
+class GameViewOptionsSerializer(serializers.Serializer):
+    """How to return the board: the part of it, as X,Y,WIDTH,HEIGHT, and its format"""
+    BOARD_FORMATS = ('cells', 'rows')
+
+    region = serializers.RegexField(r'^\d+,\d+,\d+,\d+$', required=False,
+                                    error_messages={'invalid': 'Expected X,Y,WIDTH,HEIGHT'})
+    board_format = serializers.ChoiceField(choices=BOARD_FORMATS, required=False)
+
+    def validate_region(self, value):
+        x, y, width, height = [int(number) for number in value.split(',')]
+        if not width or not height:
+            raise serializers.ValidationError('The width and height should be at least 1')
+        return x, y, width, height
 
 
 class GameNewSerializer(serializers.Serializer):
-    rows = serializers.IntegerField(min_value=3)
-    columns = serializers.IntegerField(min_value=3)
-    mines = serializers.IntegerField(min_value=1)
+    """Size, mines and optionally seed of a new game, or the id of a shared board (see api.boards.board_id)"""
+    MAX_CELLS = 2 ** 31 - 1
+
+    rows = serializers.IntegerField(min_value=3, required=False)
+    columns = serializers.IntegerField(min_value=3, required=False)
+    mines = serializers.IntegerField(min_value=1, required=False)
+    seed = serializers.IntegerField(min_value=0, max_value=2 ** 63 - 1, required=False)
+    board = serializers.CharField(required=False, help_text='ROWSxCOLUMNSxMINES-SEED or ROWSxCOLUMNSxMINES-SEED-FIRST')
+    storage = serializers.ChoiceField(choices=[name for value, name in Game.STORAGE_CHOICES], required=False)
+
+    def validate_storage(self, name):
+        return dict((storage_name, value) for value, storage_name in Game.STORAGE_CHOICES)[name]
+
+    def validate_board(self, value):
+        try:
+            return parse_board_id(value)
+        except ValueError as error:
+            raise serializers.ValidationError(str(error))
+
+    def validate(self, data):
+        shared = 'board' in data
+        if shared:
+            data['rows'], data['columns'], data['mines'], data['seed'], data['first'] = data.pop('board')
+        elif not all(name in data for name in ('rows', 'columns', 'mines')):
+            raise serializers.ValidationError('Expected rows, columns and mines, or a board')
+        if data['rows'] < 3 or data['columns'] < 3 or data['mines'] < 1:
+            raise serializers.ValidationError('The board should have at least 3 rows, 3 columns and 1 mine')
+        if data.get('storage') == Game.STORAGE_SEEDED and 'seed' not in data:
+            raise serializers.ValidationError('Seeded boards need a seed')
+        if shared and data.get('storage') == Game.STORAGE_CHUNKED:
+            raise serializers.ValidationError('Shared boards can not be chunked')
+        if shared or data.get('storage') == Game.STORAGE_SEEDED:
+            # Their whole layout is generated whenever it is not cached
+            max_cells = getattr(settings, 'GAME_CHUNKED_FIELDS', 1024 * 1024)
+            if data['rows'] * data['columns'] > max_cells:
+                raise serializers.ValidationError('Seeded and shared boards should have at most %d cells' % max_cells)
+        if data['rows'] * data['columns'] > self.MAX_CELLS:
+            raise serializers.ValidationError('There should be at most %d cells' % self.MAX_CELLS)
+        if data['mines'] >= data['rows'] * data['columns']:
+            raise serializers.ValidationError('There should be fewer mines than cells')
+        return data
+
+
+class GameBulkNewSerializer(GameNewSerializer):
+    """Same arguments as GameNewSerializer and the number of games to create. With a seed or a board every game gets
+    the same board"""
+    MAX_GAMES = 1000
+
+    count = serializers.IntegerField(min_value=1, max_value=MAX_GAMES)
+
+
+class DailyBoardSerializer(serializers.Serializer):
+    """Board configuration of the daily challenge (expert by default)"""
+    rows = serializers.IntegerField(min_value=3, default=16)
+    columns = serializers.IntegerField(min_value=3, default=30)
+    mines = serializers.IntegerField(min_value=1, default=99)
+
+    def validate(self, data):
+        if data['rows'] * data['columns'] > getattr(settings, 'GAME_CHUNKED_FIELDS', 1024 * 1024):
+            raise serializers.ValidationError('Shared boards should have at most %d cells' % getattr(
+                settings, 'GAME_CHUNKED_FIELDS', 1024 * 1024))
+        if data['mines'] >= data['rows'] * data['columns']:
+            raise serializers.ValidationError('There should be fewer mines than cells')
+        return data
 
 
 class GameFieldSerializer(serializers.Serializer):
+    """Cell of a move. The cell is checked to be on the board of the game in the context, if any"""
     x = serializers.IntegerField(min_value=0)
     y = serializers.IntegerField(min_value=0)
 
+    def validate(self, data):
+        game = self.context.get('game')
+        if game is not None and (data['x'] >= game.columns or data['y'] >= game.rows):
+            raise serializers.ValidationError('Cell (%d, %d) is outside of the board' % (data['x'], data['y']))
+        return data
+
+
+class GameMoveSerializer(GameFieldSerializer):
+    move = serializers.ChoiceField(choices=Game.MOVE_CHOICES)
+
+
+class GameMovesSerializer(serializers.Serializer):
+    """Ordered list of moves. The game to play them on is expected in the context to check the cells"""
+    MAX_MOVES = 10000
+
+    moves = GameMoveSerializer(many=True)
+
+    def validate_moves(self, moves):
+        if not moves:
+            raise serializers.ValidationError('At least one move is required')
+        if len(moves) > self.MAX_MOVES:
+            raise serializers.ValidationError('At most %d moves are allowed' % self.MAX_MOVES)
+        game = self.context['game']
+        for move in moves:
+            if move['x'] >= game.columns or move['y'] >= game.rows:
+                raise serializers.ValidationError('Cell (%d, %d) is outside of the board' % (move['x'], move['y']))
+        return moves
+
+
+class MoveSerializer(serializers.ModelSerializer):
+
+    class Meta:
+        model = Move
+        fields = ('seq', 'move', 'x', 'y', 'created')
+
+
+class PlayerStatsSerializer(serializers.ModelSerializer):
+    win_rate = serializers.SerializerMethodField()
+
+    class Meta:
+        model = PlayerStats
+        fields = ('rows', 'columns', 'mines', 'played', 'won', 'lost', 'timeout', 'win_rate', 'best_seconds')
+
+    def get_win_rate(self, obj):
+        return round(obj.win_rate, 4)
+
+
+class LeaderboardSerializer(PlayerStatsSerializer):
+    player = serializers.ReadOnlyField(source='player.username')
+
+    class Meta(PlayerStatsSerializer.Meta):
+        fields = ('player',) + PlayerStatsSerializer.Meta.fields
+
+
+class LeaderboardFilterSerializer(serializers.Serializer):
+    ORDERS = ('best_time', 'win_rate', 'won')
+
+    rows = serializers.IntegerField(min_value=1)
+    columns = serializers.IntegerField(min_value=1)
+    mines = serializers.IntegerField(min_value=1)
+    order = serializers.ChoiceField(choices=ORDERS, required=False)
+    min_played = serializers.IntegerField(min_value=1, required=False)
+    limit = serializers.IntegerField(min_value=1, max_value=500, required=False)
+
 
 class UserSerializer(serializers.ModelSerializer):
+    """The games of the user are not listed, games_url is the game list filtered by the user (paginated)"""
+    games_url = serializers.SerializerMethodField()
 
     class Meta:
         model = User
-        fields = ('id', 'username', 'games')
\ No newline at end of file
+        fields = ('id', 'username', 'games_url')
+
+    def get_games_url(self, user):
+        return '%s?%s' % (reverse('api_games-list', request=self.context.get('request')),
+                          urlencode({'player': user.username}))
\ No newline at end of file
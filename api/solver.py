@@ -0,0 +1,462 @@
+# -*- coding: utf-8 -*-
+"""
+Solver that only looks at what the player sees (the board view), for hints and to play boards offline.
+
+Every revealed number is a constraint: its unknown hidden neighbours hold its number of mines, minus the mines
+already known around it. The constraints of the frontier (the revealed fields next to hidden ones) are propagated:
+
+- single constraints: no mines left means every field is safe, as many mines as fields means every field is a mine
+- pairs of constraints sharing fields: if the mines one has more than the other need every field it does not share,
+  those fields are mines and the fields only the other one has are safe (which covers a constraint being a subset
+  of another one)
+
+When nothing is certain, Solver.probabilities counts the mine layouts of each group of linked frontier fields (up to
+EXACT_NODES search steps, otherwise the group is estimated) and weighs them with the mines left for the rest of the
+board.
+
+Solver.update takes the view after some moves and only looks at the rows that changed and the constraints around
+the fields revealed, so a client asking for a hint after every move does not pay for the whole board. The solvers of
+the games are kept between requests in solver_cache.
+"""
+from __future__ import unicode_literals
+import math
+import re
+import threading
+from collections import OrderedDict
+
+from django.conf import settings
+
+from api.boards import Board
+
+EXACT_NODES = 100000  # search steps to count the layouts of a group of frontier fields
+EXACT_FIELDS = 400  # larger groups are always estimated (and the search is recursive)
+REVEALED = re.compile(r'[0-8x]')
+HIDDEN = ' '
+
+
+class TooManyLayouts(Exception):
+    pass
+
+
+class Solver(object):
+    """
+    Solves the window of width x height fields from point (x,y) of a board of rows x cols fields with mines mines
+    (the whole board by default). The fields around the window are taken as hidden, and the mines of the board are
+    only counted when the window is the whole board. Points are (x, y) on the board.
+    """
+
+    def __init__(self, rows, cols, mines, x=0, y=0, width=None, height=None):
+        self.rows, self.cols, self.mines = rows, cols, mines
+        self.window = (x, y, cols - x if width is None else width, rows - y if height is None else height)
+        x, y, width, height = self.window
+        # The view is kept with a border of one field (inside the board) around the window
+        self.left, self.top = max(x - 1, 0), max(y - 1, 0)
+        self.view_cols = min(x + width + 1, cols) - self.left
+        self.view_height = min(y + height + 1, rows) - self.top
+        self.whole = self.window == (0, 0, cols, rows)
+        self.view = [HIDDEN * self.view_cols] * self.view_height
+        self.hidden = self.view_cols * self.view_height
+        self.exploded = 0
+        self.safe = set()  # view indexes of the hidden fields known to be safe
+        self.mined = set()  # view indexes of the hidden fields known to be mines
+        self.constraints = {}  # view index of a number -> (frozenset of unknown fields around it, mines among them)
+        self.by_field = {}  # view index of an unknown field -> view indexes of the numbers around it
+
+    def view_region(self):
+        """Returns (x, y, width, height) of the part of the board update takes: the window and its border"""
+        return self.left, self.top, self.view_cols, self.view_height
+
+    def _mask(self, rows):
+        """Marks are hidden fields and the numbers in the border are unknown fields"""
+        x, y, width, height = self.window
+        rows = [row.replace('?', HIDDEN).replace('!', HIDDEN) if '?' in row or '!' in row else row for row in rows]
+        if self.top < y:
+            rows[0] = HIDDEN * self.view_cols
+        if self.top + self.view_height > y + height:
+            rows[-1] = HIDDEN * self.view_cols
+        left, right = self.left < x, self.left + self.view_cols > x + width
+        if left or right:
+            rows = [(HIDDEN if left else row[0]) + row[1:-1] + (HIDDEN if right else row[-1]) for row in rows]
+        return rows
+
+    def update(self, rows):
+        """
+        Takes the view after some moves: the rows of view_rows(*view_region()). Returns False if it does not follow
+        from the view taken before (a revealed field is hidden again), then the solver should be created again.
+        """
+        rows = self._mask(rows)
+        dirty = set()
+        blank = HIDDEN * self.view_cols
+        for r, (old, new) in enumerate(zip(self.view, rows)):
+            if old == new:
+                continue
+            if old == blank:
+                columns = [match.start() for match in REVEALED.finditer(new)]
+            else:
+                columns = differences(old, new, 0, len(new))
+                if any(old[c] != HIDDEN for c in columns):
+                    return False
+            for c in columns:
+                i = r * self.view_cols + c
+                self.hidden -= 1
+                self.safe.discard(i)
+                self.mined.discard(i)
+                dirty.update(self.by_field.pop(i, ()))
+                if new[c] == 'x':
+                    self.exploded += 1
+                    dirty.update(j for j in self._neighbours(i) if j in self.constraints)
+                else:
+                    dirty.add(i)
+            self.view[r] = new
+        self._propagate(dirty)
+        return True
+
+    def _neighbours(self, i):
+        r, c = divmod(i, self.view_cols)
+        return [nr * self.view_cols + nc
+                for nr in range(max(r - 1, 0), min(r + 2, self.view_height))
+                for nc in range(max(c - 1, 0), min(c + 2, self.view_cols))
+                if nr != r or nc != c]
+
+    def _constrain(self, i):
+        """Computes the constraint of the number at view index i again. Returns it, or None if it has no fields"""
+        old = self.constraints.pop(i, None)
+        if old is not None:
+            for field in old[0]:
+                numbers = self.by_field.get(field)
+                if numbers is not None:
+                    numbers.discard(i)
+        r, c = divmod(i, self.view_cols)
+        char = self.view[r][c]
+        top, bottom = max(r - 1, 0), min(r + 2, self.view_height)
+        left, right = max(c - 1, 0), min(c + 2, self.view_cols)
+        if char == HIDDEN or char == 'x' or not any(HIDDEN in self.view[nr][left:right] for nr in range(top, bottom)):
+            return None
+        fields, mines = [], int(char)
+        for nr in range(top, bottom):
+            row = self.view[nr]
+            for nc in range(left, right):
+                if row[nc] == HIDDEN:
+                    j = nr * self.view_cols + nc
+                    if j in self.mined:
+                        mines -= 1
+                    elif j not in self.safe:
+                        fields.append(j)
+                elif row[nc] == 'x':
+                    mines -= 1
+        if not fields:
+            return None
+        constraint = self.constraints[i] = (frozenset(fields), mines)
+        for field in fields:
+            self.by_field.setdefault(field, set()).add(i)
+        return constraint
+
+    def _settle(self, fields, mine, dirty):
+        """Records the fields as mines or safe, the numbers around them are computed again"""
+        known = self.mined if mine else self.safe
+        for field in fields:
+            if field not in self.mined and field not in self.safe:
+                known.add(field)
+                dirty.update(self.by_field.pop(field, ()))
+
+    def _propagate(self, dirty):
+        pending = set()
+        while dirty or pending:
+            while dirty:
+                i = dirty.pop()
+                constraint = self._constrain(i)
+                if constraint is None:
+                    continue
+                fields, mines = constraint
+                if mines <= 0:
+                    self._settle(fields, False, dirty)
+                elif mines >= len(fields):
+                    self._settle(fields, True, dirty)
+                else:
+                    pending.add(i)
+            while pending and not dirty:
+                i = pending.pop()
+                if i not in self.constraints:
+                    continue
+                fields, mines = self.constraints[i]
+                others = set()
+                for field in fields:
+                    others.update(self.by_field.get(field, ()))
+                others.discard(i)
+                for j in others:
+                    other, other_mines = self.constraints[j]
+                    for a, a_mines, b, b_mines in ((fields, mines, other, other_mines),
+                                                   (other, other_mines, fields, mines)):
+                        only_b = b - a
+                        if b_mines - a_mines == len(only_b) and (only_b or a - b):
+                            self._settle(only_b, True, dirty)
+                            self._settle(a - b, False, dirty)
+                    if dirty:
+                        break
+
+    def _point(self, i):
+        r, c = divmod(i, self.view_cols)
+        return c + self.left, r + self.top
+
+    def _inside(self, point):
+        x, y, width, height = self.window
+        return x <= point[0] < x + width and y <= point[1] < y + height
+
+    def safe_points(self):
+        """Returns the hidden points of the window that are certainly safe"""
+        return sorted(point for point in map(self._point, self.safe) if self._inside(point))
+
+    def mine_points(self):
+        """Returns the hidden points of the window that certainly have a mine"""
+        return sorted(point for point in map(self._point, self.mined) if self._inside(point))
+
+    def _groups(self):
+        """Returns the lists of unknown frontier fields linked by constraints, each one in breadth first order"""
+        groups, seen = [], set()
+        for start in self.by_field:
+            if start in seen or not self.by_field[start]:
+                continue
+            seen.add(start)
+            group = [start]
+            for field in group:
+                for number in self.by_field[field]:
+                    for other in self.constraints[number][0]:
+                        if other not in seen:
+                            seen.add(other)
+                            group.append(other)
+            groups.append(group)
+        return groups
+
+    def _count_layouts(self, group):
+        """
+        Returns {mines: [layouts, [layouts with a mine in each field of the group]]} of the layouts of mines in the
+        group that meet its constraints. Raises TooManyLayouts after EXACT_NODES search steps.
+        The fields around the same numbers are interchangeable, so the search places a number of mines in each set
+        of them and counts the ways to do it.
+        """
+        if len(group) > EXACT_FIELDS:
+            raise TooManyLayouts()
+        sets = OrderedDict()
+        for field in group:
+            sets.setdefault(frozenset(self.by_field[field]), []).append(field)
+        numbers = sorted(set(number for field in group for number in self.by_field[field]))
+        position = dict((number, n) for n, number in enumerate(numbers))
+        remaining = [self.constraints[number][1] for number in numbers]
+        unassigned = [len(self.constraints[number][0]) for number in numbers]
+        set_numbers = [[position[number] for number in key] for key in sets]
+        sizes = [len(fields) for fields in sets.values()]
+        layout = [0] * len(sizes)
+        counts = {}
+        steps = [0]
+
+        def search(k, mines, ways):
+            steps[0] += 1
+            if steps[0] > EXACT_NODES:
+                raise TooManyLayouts()
+            if k == len(sizes):
+                count = counts.setdefault(mines, [0, [0] * len(sizes)])
+                count[0] += ways
+                for n, placed in enumerate(layout):
+                    count[1][n] += ways * placed
+                return
+            size = sizes[k]
+            low = max([remaining[n] - unassigned[n] + size for n in set_numbers[k]] + [0])
+            high = min([remaining[n] for n in set_numbers[k]] + [size])
+            for placed in range(low, high + 1):
+                for n in set_numbers[k]:
+                    remaining[n] -= placed
+                    unassigned[n] -= size
+                layout[k] = placed
+                search(k + 1, mines + placed, ways * combinations(size, placed))
+                for n in set_numbers[k]:
+                    remaining[n] += placed
+                    unassigned[n] += size
+            layout[k] = 0
+
+        search(0, 0, 1)
+        # Mines per field, spread evenly over the fields of each set
+        set_of = dict((field, n) for n, fields in enumerate(sets.values()) for field in fields)
+        return dict((mines, [layouts, [float(placed[set_of[field]]) / sizes[set_of[field]] for field in group]])
+                    for mines, (layouts, placed) in counts.items())
+
+    def probabilities(self):
+        """
+        Returns ({view index: probability of a mine} of the unknown frontier fields, probability of a mine of the
+        other unknown hidden fields, or None if there are none)
+        """
+        groups = self._groups()
+        interior = self.hidden - len(self.safe) - len(self.mined) - sum(len(group) for group in groups)
+        mines_left = self.mines - len(self.mined) - self.exploded
+        density = min(max(float(self.mines) / (self.rows * self.cols), 1e-9), 1 - 1e-9)
+        probabilities, counted = {}, []
+        for group in groups:
+            try:
+                counted.append((group, self._count_layouts(group)))
+            except TooManyLayouts:
+                # Estimated by the constraint with the highest ratio of mines around each field
+                for field in group:
+                    probabilities[field] = max(float(self.constraints[number][1]) / len(self.constraints[number][0])
+                                               for number in self.by_field[field])
+        if self.whole and len(counted) == len(groups):
+            # Layouts weighed by the ways to place the mines left in the other hidden fields
+            def weight(frontier_mines):
+                rest = mines_left - frontier_mines
+                if rest < 0 or rest > interior:
+                    return 0.0
+                return math.exp(log_combinations(interior, rest) - reference)
+
+            distributions = [dict((mines, count[0]) for mines, count in counts.items()) for group, counts in counted]
+            prefix = [{0: 1}]
+            for distribution in distributions:
+                prefix.append(convolve(prefix[-1], distribution))
+            # Weights relative to the largest one, the numbers of ways are too large for floats
+            reference = max([log_combinations(interior, mines_left - mines) for mines in prefix[-1]
+                             if 0 <= mines_left - mines <= interior] or [0])
+            suffix = [{0: 1}]
+            for distribution in reversed(distributions):
+                suffix.append(convolve(suffix[-1], distribution))
+            suffix.reverse()
+            total = sum(layouts * weight(mines) for mines, layouts in prefix[-1].items())
+            if total <= 0:
+                return self._independent(counted, probabilities, interior, density)
+            for n, (group, counts) in enumerate(counted):
+                others = convolve(prefix[n], suffix[n + 1])
+                field_weights = [0.0] * len(group)
+                for mines, (layouts, mined) in counts.items():
+                    factor = sum(other * weight(mines + other_mines) for other_mines, other in others.items())
+                    for k, count in enumerate(mined):
+                        field_weights[k] += count * factor
+                for field, field_weight in zip(group, field_weights):
+                    probabilities[field] = field_weight / total
+            if not interior:
+                return probabilities, None
+            expected = sum(layouts * weight(mines) * (mines_left - mines)
+                           for mines, layouts in prefix[-1].items()) / total
+            return probabilities, expected / interior
+        return self._independent(counted, probabilities, interior, density)
+
+    def _independent(self, counted, probabilities, interior, density):
+        """Probabilities of each group on its own, with the layouts weighed by the mine density of the board"""
+        odds = density / (1 - density)
+        for group, counts in counted:
+            total = sum(layouts * odds ** mines for mines, (layouts, mined) in counts.items())
+            for k, field in enumerate(group):
+                probabilities[field] = sum(mined[k] * odds ** mines
+                                           for mines, (layouts, mined) in counts.items()) / total
+        return probabilities, density if interior else None
+
+    def _interior_field(self):
+        """Returns the view index of an unknown hidden field that no number constrains, a corner if possible"""
+        x, y, width, height = self.window
+        top, bottom = y - self.top, y + height - 1 - self.top
+        left, right = x - self.left, x + width - 1 - self.left
+        for r, c in ((top, left), (top, right), (bottom, left), (bottom, right)):
+            i = r * self.view_cols + c
+            if self.view[r][c] == HIDDEN and i not in self.by_field and i not in self.safe and i not in self.mined:
+                return i
+        for r in range(y - self.top, y + height - self.top):
+            row = self.view[r]
+            c = row.find(HIDDEN, x - self.left, x + width - self.left)
+            while c != -1:
+                i = r * self.view_cols + c
+                if i not in self.by_field and i not in self.safe and i not in self.mined:
+                    return i
+                c = row.find(HIDDEN, c + 1, x + width - self.left)
+        return None
+
+    def guess(self):
+        """Returns (point, probability of a mine) of the unknown hidden point of the window least likely to have a
+        mine, or None if there is none"""
+        probabilities, interior = self.probabilities()
+        best = min(((probability, self._point(field)) for field, probability in probabilities.items()
+                    if self._inside(self._point(field))), default=None)
+        if interior is not None and (best is None or interior < best[0]):
+            field = self._interior_field()
+            if field is not None:
+                best = (interior, self._point(field))
+        return None if best is None else (best[1], best[0])
+
+
+def differences(old, new, start, end):
+    """Returns the positions where the strings differ between start and end, comparing halves of the range"""
+    if old[start:end] == new[start:end]:
+        return []
+    if end - start <= 32:
+        return [c for c in range(start, end) if old[c] != new[c]]
+    middle = (start + end) // 2
+    return differences(old, new, start, middle) + differences(old, new, middle, end)
+
+
+def combinations(n, k):
+    result = 1
+    for i in range(k):
+        result = result * (n - i) // (i + 1)
+    return result
+
+
+def log_combinations(n, k):
+    return math.lgamma(n + 1) - math.lgamma(k + 1) - math.lgamma(n - k + 1)
+
+
+def convolve(a, b):
+    """Distribution of the sum of the mines of two independent distributions {mines: weight}"""
+    result = {}
+    for mines_a, weight_a in a.items():
+        for mines_b, weight_b in b.items():
+            result[mines_a + mines_b] = result.get(mines_a + mines_b, 0) + weight_a * weight_b
+    return result
+
+
+def play(board, x, y, mines=None):
+    """
+    Plays a board (see api.boards.Board, with its mines placed) from the reveal of point (x,y), revealing every
+    field the solver finds safe and guessing when none is, until the board is won or a guess hits a mine.
+    Returns (won, reveals).
+    """
+    solver = Solver(board.rows, board.cols, board.mine_count() if mines is None else mines)
+    reveals = 1
+    board.reveal(x, y)
+    while not board.is_mine(x, y) and board.hidden_safe_count():
+        solver.update(board.view_rows(0, 0, board.cols, board.rows))
+        points = solver.safe_points()
+        if not points:
+            (x, y), probability = solver.guess()
+            points = [(x, y)]
+        for x, y in points:
+            board.reveal(x, y)
+            reveals += 1
+            if board.is_mine(x, y):
+                break
+    return not board.is_mine(x, y), reveals
+
+
+def play_seed(rows, cols, mines, seed):
+    """Plays the board the game with this seed gets when its first reveal is in the middle. Returns (won, reveals)"""
+    x, y = cols // 2, rows // 2
+    return play(Board.layout(rows, cols, mines, seed, y * cols + x), x, y, mines)
+
+
+class SolverCache(object):
+    """LRU of solvers by key. A solver is taken out while it is used, so that requests never share one"""
+
+    def __init__(self, max_solvers):
+        self.max_solvers = max_solvers
+        self._solvers = OrderedDict()
+        self._lock = threading.Lock()
+
+    def take(self, key):
+        with self._lock:
+            return self._solvers.pop(key, None)
+
+    def put(self, key, solver):
+        with self._lock:
+            self._solvers[key] = solver
+            while len(self._solvers) > self.max_solvers:
+                self._solvers.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._solvers.clear()
+
+
+solver_cache = SolverCache(getattr(settings, 'GAME_SOLVER_CACHE', 64))
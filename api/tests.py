@@ -1,6 +1,744 @@
 # -*- coding: utf-8 -*-
 from __future__ import unicode_literals
+import asyncio
+import os
+import random
+import shutil
+import tempfile
+import unittest
+from datetime import datetime, timedelta
+from unittest import mock
+from io import StringIO
 
-from django.test import TestCase
+from asgiref.sync import sync_to_async
+from channels.layers import get_channel_layer
+from channels.testing import WebsocketCommunicator
+from django.contrib.auth.models import User
+from django.core.management import call_command
+from django.db import connection
+from django.db.models import F
+from django.db.migrations.executor import MigrationExecutor
+from django.test.utils import CaptureQueriesContext
+from django.test import SimpleTestCase, TransactionTestCase, override_settings
+from django.utils import timezone
+from rest_framework.renderers import JSONRenderer
+from rest_framework.test import APIClient, APIRequestFactory, APITestCase, force_authenticate
 
-# Create your tests here.
+from minesweeper.routing import application
+
+from . import instrumentation, push, renderers
+from .boards import ADJACENT_MASK, MINE, Board, _generate_numpy, _generate_python, numpy, parse_board_id
+from .cache import GameCache, game_cache, layout_cache
+from .management.commands.fill_board_pool import generate
+from .models import BoardPool, Game, GameArchive, GameConflict, Move, PlayerStats
+from .solver import Solver, play_seed
+from .views import GameViewSet
+
+
+class GameAPITestCase(APITestCase):
+    """Plays games through the API as a logged in player"""
+
+    def setUp(self):
+        # The ids of the games of a test come back in the next one, the boards cached for them must not
+        game_cache.clear()
+        layout_cache.clear()
+        self.player = User.objects.create_user('player', password='secret')
+        self.client.force_authenticate(self.player)
+
+    def new_game(self, rows=9, columns=9, mines=10, query='', **extra):
+        response = self.client.post('/games/new/%s' % query, dict(rows=rows, columns=columns, mines=mines, **extra),
+                                    format='json')
+        self.assertEqual(response.status_code, 200, response.data)
+        return response
+
+    def move(self, game_id, action, x, y, query='?view=delta'):
+        return self.client.post('/games/%d/%s/%s' % (game_id, action, query), {'x': x, 'y': y}, format='json')
+
+
+@override_settings(GAME_CHUNKED_FIELDS=100)
+class LargeBoardTests(GameAPITestCase):
+    """Boards larger than GAME_CHUNKED_FIELDS are never returned whole"""
+
+    def test_move_endpoints_return_the_delta_view(self):
+        response = self.new_game(20, 20, 40)
+        self.assertNotIn('board_view', response.data)
+        self.assertIn('changes', response.data)
+        response = self.move(response.data['id'], 'reveal', 10, 10, query='')
+        self.assertEqual(response.status_code, 200)
+        self.assertNotIn('board_view', response.data)
+
+    def test_state_needs_a_region(self):
+        game_id = self.new_game(20, 20, 40).data['id']
+        self.assertEqual(self.client.get('/games/%d/state/' % game_id).status_code, 400)
+        response = self.client.get('/games/%d/state/?region=5,5,8,4' % game_id)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([len(row) for row in response.data['board_view']], [8] * 4)
+
+    def test_region_is_clipped_to_the_board(self):
+        game_id = self.new_game(20, 20, 40).data['id']
+        response = self.client.get('/games/%d/state/?region=15,18,10,10' % game_id)
+        self.assertEqual([len(row) for row in response.data['board_view']], [5, 5])
+        self.assertEqual(response.data['region'], {'x': 15, 'y': 18, 'width': 5, 'height': 2})
+
+
+class RegionTests(GameAPITestCase):
+
+    def test_new_returns_the_region(self):
+        response = self.new_game(query='?region=2,7,4,4')
+        self.assertEqual(response.data['board_view'], [[' '] * 4] * 2)
+        self.assertEqual(response.data['region'], {'x': 2, 'y': 7, 'width': 4, 'height': 2})
+        response = self.new_game(query='?region=0,0,3,2&board_format=rows')
+        self.assertEqual(response.data['board_view'], ['   '] * 2)
+
+    def test_moves_return_the_region(self):
+        game_id = self.new_game(seed=1).data['id']
+        response = self.move(game_id, 'mark_as_flag', 8, 8, query='?region=6,7,5,5')
+        self.assertEqual(response.data['board_view'], [[' ', ' ', ' '], [' ', ' ', '!']])
+        self.assertEqual(response.data['region'], {'x': 6, 'y': 7, 'width': 3, 'height': 2})
+
+    def test_delta_changes_are_limited_to_the_region(self):
+        full = self.move(self.new_game(seed=1).data['id'], 'reveal', 4, 4).data['changes']
+        region = self.move(self.new_game(seed=1).data['id'], 'reveal', 4, 4, query='?view=delta&region=0,0,5,5')
+        self.assertEqual(region.data['changes'], [change for change in full if change['x'] < 5 and change['y'] < 5])
+        self.assertLess(0, len(region.data['changes']))
+        self.assertLess(len(region.data['changes']), len(full))
+        game_id = self.new_game(seed=1).data['id']
+        self.assertEqual(self.move(game_id, 'mark_as_flag', 8, 8, query='?view=delta&region=0,0,5,5').data['changes'],
+                         [])
+
+    def test_bad_regions_are_rejected_before_the_move(self):
+        game_id = self.new_game().data['id']
+        for region in ('0,0,0,3', '0,0,3', '-1,0,3,3'):
+            self.assertEqual(self.move(game_id, 'reveal', 4, 4, query='?region=%s' % region).status_code, 400, region)
+        self.assertEqual(self.client.get('/games/%d/state/' % game_id).data['state'], 'new')
+
+
+class MoveTests(GameAPITestCase):
+
+    def test_cells_outside_of_the_board_are_rejected(self):
+        game_id = self.new_game(9, 9, 10).data['id']
+        for action in ('reveal', 'mark_as_flag', 'mark_as_question'):
+            for x, y in ((9, 0), (0, 9), (100, 100)):
+                self.assertEqual(self.move(game_id, action, x, y).status_code, 400, (action, x, y))
+        response = self.client.get('/games/%d/state/' % game_id)
+        self.assertEqual(response.data['state'], 'new')
+        self.assertEqual(response.data['board_view'], [[' '] * 9] * 9)
+
+
+class SharedBoardTests(GameAPITestCase):
+
+    def test_bulk_created_games_store_the_board_of_the_first_cell(self):
+        rows, columns, mines, seed, first = parse_board_id('9x9x10-abc-28')
+        layout = Board.layout(rows, columns, mines, seed, first)
+        for storage in ('packed', 'seeded'):
+            response = self.client.post('/games/bulk_new/', {'board': '9x9x10-abc-28', 'count': 3, 'storage': storage},
+                                        format='json')
+            self.assertEqual(response.status_code, 200, response.data)
+            for summary in response.data['results']:
+                game = Game.objects.get(pk=summary['id'])
+                self.assertTrue(game.cells, storage)
+                self.assertEqual(sum(1 for cell in game.get_board().cells if cell & MINE), mines)
+                self.assertEqual(game.hidden_safe_cells, rows * columns - mines)
+                self.assertEqual(self.move(game.pk, 'reveal', first % columns, first // columns).status_code, 200)
+                game = Game.objects.get(pk=game.pk)
+                self.assertLess(game.hidden_safe_cells, rows * columns - mines)
+                content = MINE | ADJACENT_MASK
+                self.assertEqual([cell & content for cell in game.get_board().cells],
+                                 [cell & content for cell in layout.cells])
+
+    def test_new_boards_are_seeded_unless_pooled(self):
+        game = Game.objects.get(pk=self.new_game(16, 16, 40).data['id'])
+        self.assertEqual(game.storage, Game.STORAGE_SEEDED)
+        self.move(game.pk, 'reveal', 8, 8)
+        game = Game.objects.get(pk=game.pk)
+        layout = Board.layout(16, 16, 40, game.seed, 8 * 16 + 8)
+        game_cache.clear()
+        self.assertEqual([cell & MINE for cell in game.get_board().cells], [cell & MINE for cell in layout.cells])
+        BoardPool.objects.create(**generate((16, 16, 40)))
+        self.assertEqual(Game.objects.get(pk=self.new_game(16, 16, 40).data['id']).storage, Game.STORAGE_PACKED)
+
+
+class DeltaViewTests(GameAPITestCase):
+
+    def test_marks_that_change_nothing_report_no_changes(self):
+        game_id = self.new_game(9, 9, 10, seed=1).data['id']
+        self.move(game_id, 'reveal', 4, 4)
+        response = self.move(game_id, 'mark_as_flag', 4, 4)
+        self.assertEqual(response.data['changes'], [])
+        hidden = next((x, y) for y, row in enumerate(self.client.get('/games/%d/state/' % game_id).data['board_view'])
+                      for x, value in enumerate(row) if value == ' ')
+        self.assertEqual(self.move(game_id, 'mark_as_flag', *hidden).data['changes'],
+                         [{'x': hidden[0], 'y': hidden[1], 'value': '!'}])
+        self.assertEqual(self.move(game_id, 'mark_as_flag', *hidden).data['changes'], [])
+        self.assertEqual(self.move(game_id, 'mark_as_question', *hidden).data['changes'],
+                         [{'x': hidden[0], 'y': hidden[1], 'value': '?'}])
+        self.assertEqual(list(Move.objects.filter(game_id=game_id).values_list('move', flat=True)),
+                         [Game.MOVE_REVEAL, Game.MOVE_FLAG, Game.MOVE_QUESTION])
+
+
+    def test_changes_are_the_cells_that_changed(self):
+        game_id = self.new_game(16, 16, 40, seed=7).data['id']
+        before = self.client.get('/games/%d/state/' % game_id).data['board_view']
+        response = self.move(game_id, 'reveal', 8, 8)
+        self.assertEqual(set(response.data), {'id', 'state', 'version', 'changes', 'duration_seconds'})
+        after = self.client.get('/games/%d/state/' % game_id).data['board_view']
+        changed = [{'x': x, 'y': y, 'value': after[y][x]} for y in range(16) for x in range(16)
+                   if after[y][x] != before[y][x]]
+        self.assertTrue(changed)
+        self.assertEqual(sorted(response.data['changes'], key=lambda cell: (cell['y'], cell['x'])), changed)
+        response = self.move(game_id, 'reveal', 8, 8, query='')
+        self.assertEqual(response.data['board_view'], after)
+
+
+class BatchMoveTests(GameAPITestCase):
+
+    def post_moves(self, game_id, moves):
+        return self.client.post('/games/%d/moves/?view=delta' % game_id, {'moves': [
+            {'move': move, 'x': x, 'y': y} for move, x, y in moves]}, format='json')
+
+    def test_moves_stop_at_the_first_losing_move(self):
+        game_id = self.new_game(9, 9, 10, seed=3).data['id']
+        self.move(game_id, 'reveal', 4, 4)
+        board = Game.objects.get(pk=game_id).get_board()
+        mine = next((x, y) for y in range(9) for x in range(9) if board.is_mine(x, y))
+        hidden = next((x, y) for y in range(9) for x in range(9)
+                      if not board.is_mine(x, y) and board.view_at(x, y) == ' ')
+        response = self.post_moves(game_id, [('flag', hidden[0], hidden[1]), ('reveal', mine[0], mine[1]),
+                                              ('reveal', hidden[0], hidden[1])])
+        self.assertEqual(response.status_code, 200, response.data)
+        self.assertEqual(response.data['moves'], [
+            {'move': 'flag', 'x': hidden[0], 'y': hidden[1], 'changed': 1, 'state': 'started'},
+            {'move': 'reveal', 'x': mine[0], 'y': mine[1], 'changed': 1, 'state': 'lost'},
+        ])
+        self.assertEqual(response.data['state'], 'lost')
+        self.assertEqual(len(response.data['changes']), 2)
+        game = Game.objects.get(pk=game_id)
+        self.assertEqual((game.state, game.move_count, game.version), (Game.STATE_LOST, 3, 3))
+
+    def test_moves_are_validated_before_any_is_played(self):
+        game_id = self.new_game().data['id']
+        self.assertEqual(self.post_moves(game_id, []).status_code, 400)
+        self.assertEqual(self.post_moves(game_id, [('reveal', 0, 0), ('jump', 1, 1)]).status_code, 400)
+        self.assertEqual(self.post_moves(game_id, [('reveal', 0, 0), ('flag', 9, 1)]).status_code, 400)
+        self.assertEqual(Game.objects.get(pk=game_id).move_count, 0)
+
+
+class PermissionTests(GameAPITestCase):
+
+    def test_only_the_player_plays_a_game(self):
+        game_id = self.new_game().data['id']
+        self.client.force_authenticate(User.objects.create_user('other'))
+        for action in ('reveal', 'mark_as_flag', 'mark_as_question'):
+            self.assertEqual(self.move(game_id, action, 0, 0).status_code, 403)
+        response = self.client.post('/games/%d/moves/' % game_id, {'moves': [{'move': 'reveal', 'x': 0, 'y': 0}]},
+                                    format='json')
+        self.assertEqual(response.status_code, 403)
+        for action in ('pause', 'resume'):
+            self.assertEqual(self.client.post('/games/%d/%s/' % (game_id, action)).status_code, 403)
+        self.assertEqual(self.client.get('/games/%d/state/' % game_id).status_code, 200)
+        self.assertEqual(Game.objects.get(pk=game_id).state, Game.STATE_NEW)
+        self.client.force_authenticate(None)
+        self.assertIn(self.move(game_id, 'reveal', 0, 0).status_code, (401, 403))
+
+
+    def test_board_as_rows(self):
+        game_id = self.new_game(9, 9, 10).data['id']
+        rows = [' ' * 9] * 9
+        self.assertEqual(self.client.get('/games/%d/state/?board_format=rows' % game_id).data['board_view'], rows)
+        response = self.client.get('/games/%d/state/' % game_id, HTTP_ACCEPT='application/json; board_format=rows')
+        self.assertEqual(response.data['board_view'], rows)
+        self.assertEqual(self.client.get('/games/%d/state/?board_format=lines' % game_id).status_code, 400)
+
+    def test_board_format_does_not_clash_with_shared_boards(self):
+        response = self.client.post('/games/new/?board_format=rows', {'board': '9x9x10-abc-28'}, format='json')
+        self.assertEqual(response.status_code, 200, response.data)
+        self.assertEqual(response.data['board_view'], [' ' * 9] * 9)
+
+
+class GameListTests(GameAPITestCase):
+
+    def setUp(self):
+        super(GameListTests, self).setUp()
+        other = User.objects.create_user('other')
+        self.games = Game.create_games(self.player, 9, 9, 10, 7) + Game.create_games(other, 9, 9, 10, 2)
+        start = datetime(2020, 1, 1, tzinfo=timezone.utc)
+        for i, game in enumerate(self.games):
+            Game.objects.filter(pk=game.pk).update(created=start + timedelta(days=i))
+        Game.objects.filter(pk=self.games[0].pk).update(state=Game.STATE_WON)
+
+    def ids(self, query):
+        response = self.client.get('/games/%s' % query)
+        self.assertEqual(response.status_code, 200, response.data)
+        return [game['id'] for game in response.data['results']]
+
+    def test_pages_newest_first_without_boards(self):
+        response = self.client.get('/games/?page_size=4')
+        self.assertEqual(set(response.data['results'][0]), {'id', 'title', 'state', 'rows', 'columns', 'mines',
+                                                            'player', 'created', 'updated'})
+        ids = [game['id'] for game in response.data['results']]
+        while response.data['next']:
+            response = self.client.get(response.data['next'])
+            ids.extend(game['id'] for game in response.data['results'])
+        self.assertEqual(ids, [game.pk for game in reversed(self.games)])
+
+    def test_filters(self):
+        self.assertEqual(self.ids('?player=other'), [self.games[8].pk, self.games[7].pk])
+        self.assertEqual(self.ids('?state=won'), [self.games[0].pk])
+        self.assertEqual(self.ids('?player=player&state=new&created_after=2020-01-03T00:00:00Z'
+                                  '&created_before=2020-01-05T00:00:00Z'), [self.games[3].pk, self.games[2].pk])
+        self.assertEqual(self.client.get('/games/?state=finished').status_code, 400)
+        self.assertEqual(self.client.get('/games/?created_after=yesterday').status_code, 400)
+
+
+class UserTests(GameAPITestCase):
+
+    def test_users_link_to_their_games(self):
+        self.new_game()
+        response = self.client.get('/users/')
+        self.assertEqual(response.data, [{'id': self.player.id, 'username': 'player',
+                                          'games_url': 'http://testserver/games/?player=player'}])
+        games = self.client.get(response.data[0]['games_url']).data['results']
+        self.assertEqual([game['player'] for game in games], ['player'])
+
+
+class ClockTests(GameAPITestCase):
+
+    def test_paused_games_can_not_be_played(self):
+        game_id = self.new_game().data['id']
+        self.move(game_id, 'mark_as_flag', 0, 0)
+        self.client.post('/games/%d/pause/' % game_id)
+        for action in ('reveal', 'mark_as_flag', 'mark_as_question'):
+            self.assertEqual(self.move(game_id, action, 4, 4).status_code, 400)
+        response = self.client.post('/games/%d/moves/' % game_id, {'moves': [{'move': 'reveal', 'x': 4, 'y': 4}]},
+                                    format='json')
+        self.assertEqual(response.status_code, 400)
+        game = Game.objects.get(pk=game_id)
+        self.assertEqual((game.state, game.move_count), (Game.STATE_PAUSED, 1))
+        self.client.post('/games/%d/resume/' % game_id)
+        self.assertEqual(self.move(game_id, 'reveal', 4, 4).status_code, 200)
+
+    def test_clock_runs_on_the_server_and_tick_only_reads(self):
+        game_id = self.new_game().data['id']
+        self.assertEqual(self.client.get('/games/%d/state/' % game_id).data['duration_seconds'],
+                         Game.DURATION_SECONDS)
+        self.move(game_id, 'mark_as_flag', 0, 0)
+        game = Game.objects.get(pk=game_id)
+        self.assertEqual(game.state, Game.STATE_STARTED)
+        self.assertIsNotNone(game.deadline)
+        Game.objects.filter(pk=game_id).update(deadline=timezone.now() + timedelta(seconds=30))
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.post('/games/%d/tick/' % game_id)
+        self.assertEqual(response.data['duration_seconds'], 30)
+        self.assertFalse([query for query in queries.captured_queries
+                          if query['sql'].startswith(('UPDATE', 'INSERT', 'DELETE'))])
+        self.assertEqual(Game.objects.get(pk=game_id).version, game.version)
+        self.client.post('/games/%d/pause/' % game_id)
+        game = Game.objects.get(pk=game_id)
+        self.assertEqual((game.deadline, game.duration_seconds), (None, 30))
+
+    def test_timeout_is_found_by_state_and_expire_games(self):
+        read_id, swept_id, running_id = [self.new_game().data['id'] for i in range(3)]
+        for game_id in (read_id, swept_id, running_id):
+            self.move(game_id, 'mark_as_flag', 0, 0)
+        Game.objects.filter(pk__in=[read_id, swept_id]).update(deadline=timezone.now() - timedelta(seconds=1))
+        response = self.client.get('/games/%d/state/' % read_id)
+        self.assertEqual((response.data['state'], response.data['duration_seconds']), ('timeout', 0))
+        self.assertEqual(Game.objects.get(pk=read_id).state, Game.STATE_TIMEOUT)
+        self.assertEqual(Game.objects.get(pk=swept_id).state, Game.STATE_STARTED)
+        output = StringIO()
+        call_command('expire_games', stdout=output)
+        self.assertIn('1 games finished by timeout', output.getvalue())
+        self.assertEqual(Game.objects.get(pk=swept_id).state, Game.STATE_TIMEOUT)
+        self.assertEqual(Game.objects.get(pk=running_id).state, Game.STATE_STARTED)
+        self.assertEqual(self.move(swept_id, 'reveal', 4, 4).data['state'], 'timeout')
+
+
+@override_settings(API_TIMING=True, API_PROFILE_SAMPLE_RATE=0)
+class TimingTests(GameAPITestCase):
+
+    def setUp(self):
+        super(TimingTests, self).setUp()
+        instrumentation.endpoint_stats.reset()
+        self.profile_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.profile_dir)
+
+    def test_server_timing_header_and_stats(self):
+        game_id = self.new_game().data['id']
+        response = self.move(game_id, 'reveal', 0, 0)
+        timings = dict(metric.split(';', 1) for metric in response['Server-Timing'].split(', '))
+        self.assertEqual(set(timings), {'total', 'db', 'serialize', 'board-decode', 'board-encode'})
+        self.assertRegex(timings['db'], r'^dur=[0-9.]+;desc="[1-9][0-9]* queries"$')
+        self.player.is_staff = True
+        self.player.save()
+        stats = self.client.get('/games/timing_stats/').data
+        self.assertEqual(stats['POST api_games-reveal']['requests'], 1)
+        self.assertGreater(stats['POST api_games-reveal']['mean_db_queries'], 0)
+
+    def test_sampled_profiles_are_written(self):
+        game_id = self.new_game().data['id']
+        with self.settings(API_PROFILE_DIR=self.profile_dir, API_PROFILE_SAMPLE_RATE=1):
+            # The middleware reads its settings when the client loads it, on its first request
+            self.client.handler.load_middleware()
+            self.move(game_id, 'reveal', 0, 0)
+        profiles = os.listdir(self.profile_dir)
+        self.assertEqual(len(profiles), 1)
+        self.assertRegex(profiles[0], r'-POST-api_games-reveal-[0-9]+ms\.prof$')
+
+    def test_no_profiles_unless_sampled(self):
+        with self.settings(API_PROFILE_DIR=self.profile_dir):
+            self.new_game()
+        self.assertEqual(os.listdir(self.profile_dir), [])
+
+
+class RendererTests(SimpleTestCase):
+
+    def test_line_separators_are_escaped_as_json_renderer_does(self):
+        data = {'title': 'one\u2028two\u2029three \xe9', 'created': timezone.now()}
+        expected = JSONRenderer().render(data)
+        self.assertIn(b'\\u2028', expected)
+        for encoder in ('orjson', 'ujson'):
+            if getattr(renderers, encoder) is None:
+                continue
+            with mock.patch.object(renderers, 'orjson', renderers.orjson if encoder == 'orjson' else None):
+                self.assertEqual(renderers.FastJSONRenderer().render(data), expected, encoder)
+
+
+class HintTests(GameAPITestCase):
+
+    def test_region_outside_of_the_board_has_no_hint(self):
+        game_id = self.new_game(9, 9, 10).data['id']
+        for i in range(2):  # before and after the mines are placed
+            response = self.client.get('/games/%d/hint/?region=20,20,5,5' % game_id)
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual((response.data['safe'], response.data['mines'], response.data['guess']), ([], [], None))
+            self.move(game_id, 'reveal', 4, 4)
+
+
+class BoardGenerationTests(SimpleTestCase):
+
+    @unittest.skipIf(numpy is None, 'numpy is not installed')
+    def test_numpy_places_the_same_mines_as_python(self):
+        generator = random.Random(1)
+        for i in range(200):
+            rows, cols = generator.randint(1, 20), generator.randint(2, 20)
+            exclude = frozenset(generator.sample(range(rows * cols), generator.randint(0, min(9, rows * cols - 1))))
+            mines = generator.randint(1, rows * cols - len(exclude))
+            if mines == rows * cols:
+                continue
+            seed = generator.getrandbits(64)
+            self.assertEqual(_generate_numpy(rows, cols, mines, seed, exclude).cells,
+                             _generate_python(rows, cols, mines, seed, exclude).cells, (rows, cols, mines, seed))
+
+    def test_mines_and_adjacent_counts(self):
+        board = Board.generate(16, 30, 99, 42, exclude=range(10))
+        mines = [i for i, cell in enumerate(board.cells) if cell & MINE]
+        self.assertEqual(len(mines), 99)
+        self.assertFalse(set(mines) & set(range(10)))
+        for i, cell in enumerate(board.cells):
+            if not cell & MINE:
+                self.assertEqual(cell & ADJACENT_MASK, sum(1 for j in board.adjacent(i) if board.cells[j] & MINE))
+
+
+class ConflictTests(GameAPITestCase):
+
+    def test_stale_game_is_not_saved(self):
+        game_id = self.new_game().data['id']
+        stale, fresh = Game.objects.get(pk=game_id), Game.objects.get(pk=game_id)
+        fresh.play(Game.MOVE_FLAG, 1, 1)
+        fresh.save()
+        stale.play(Game.MOVE_FLAG, 2, 2)
+        with self.assertRaises(GameConflict):
+            stale.save()
+        game = Game.objects.get(pk=game_id)
+        self.assertEqual((game.version, game.move_count), (fresh.version, 1))
+
+    def test_update_is_retried_on_the_saved_game(self):
+        game_id = self.new_game().data['id']
+        stale = Game.objects.get(pk=game_id)
+        self.move(game_id, 'mark_as_flag', 1, 1)
+        game_cache.clear()
+        request = APIRequestFactory().post('/games/%d/mark_as_flag/' % game_id)
+        force_authenticate(request, self.player)
+        view = GameViewSet(action_map={'post': 'mark_as_flag'})
+        view.request = view.initialize_request(request)
+        game = view.update_game(game_id, lambda game: game.play(Game.MOVE_FLAG, 2, 2), stale)
+        self.assertEqual(game.move_count, 2)
+        self.assertEqual(list(Move.objects.filter(game_id=game_id).values_list('seq', 'x', 'y')),
+                         [(1, 1, 1), (2, 2, 2)])
+
+    def test_requests_that_change_nothing_do_not_save(self):
+        game_id = self.new_game(9, 9, 10, seed=1).data['id']
+        self.move(game_id, 'reveal', 4, 4)
+        self.client.post('/games/%d/resume/' % game_id)
+        self.move(game_id, 'reveal', 4, 4)
+        game = Game.objects.get(pk=game_id)
+        self.assertEqual((game.version, game.move_count), (2, 1))
+        Game.objects.filter(pk=game_id).update(state=Game.STATE_LOST)
+        for action in ('pause', 'resume'):
+            self.assertEqual(self.client.post('/games/%d/%s/' % (game_id, action)).data['version'], 2)
+        self.assertEqual(self.move(game_id, 'reveal', 0, 0).data['version'], 2)
+        self.assertEqual(Game.objects.get(pk=game_id).version, 2)
+
+
+@override_settings(GAME_SNAPSHOT_MOVES=5)
+class ReplayTests(GameAPITestCase):
+
+    def test_board_is_the_snapshot_with_the_moves_logged_since(self):
+        generator = random.Random(2)
+        actions = ('reveal', 'mark_as_flag', 'mark_as_flag', 'mark_as_question')
+        for storage in ('packed', 'chunked', 'packed', 'chunked'):
+            rows, columns = generator.randint(5, 40), generator.randint(5, 40)
+            game_id = self.new_game(rows, columns, rows * columns // 8, storage=storage).data['id']
+            for i in range(30):
+                self.move(game_id, generator.choice(actions), generator.randrange(columns), generator.randrange(rows))
+            game = Game.objects.get(pk=game_id)
+            self.assertEqual(game.move_count, Move.objects.filter(game=game).count())
+            game_cache.clear()
+            self.assertEqual(game.get_board().view(), game.replay().view(), storage)
+
+
+class BoardPoolTests(GameAPITestCase):
+
+    def test_pooled_board_is_the_board_of_its_seed(self):
+        pooled = BoardPool.objects.create(**generate((9, 9, 10)))
+        game_id = self.new_game(9, 9, 10).data['id']
+        self.assertFalse(BoardPool.objects.exists())
+        game = Game.objects.get(pk=game_id)
+        self.assertEqual(game.seed, pooled.seed)
+        self.move(game_id, 'reveal', 4, 4)
+        layout = Board.layout(9, 9, 10, pooled.seed, 4 * 9 + 4)
+        game = Game.objects.get(pk=game_id)
+        self.assertEqual([cell & MINE for cell in game.get_board().cells], [cell & MINE for cell in layout.cells])
+
+
+class ArchiveTests(GameAPITestCase):
+
+    def test_archived_games_read_the_same(self):
+        generator = random.Random(3)
+        game_ids = []
+        for storage in ('packed', 'chunked', 'packed', 'chunked'):
+            rows, columns = generator.randint(5, 60), generator.randint(5, 60)
+            game_id = self.new_game(rows, columns, rows * columns // 8, storage=storage).data['id']
+            for i in range(20):
+                self.move(game_id, generator.choice(('reveal', 'mark_as_flag')), generator.randrange(columns),
+                          generator.randrange(rows))
+            game_ids.append(game_id)
+        Game.objects.filter(pk__in=game_ids).update(deadline=timezone.now() - timedelta(seconds=1))
+        before = [(self.client.get('/games/%d/state/' % game_id).data,
+                   self.client.get('/games/%d/history/' % game_id).data['results']) for game_id in game_ids]
+        Game.objects.update(updated=datetime(2000, 1, 1, tzinfo=timezone.utc))
+        call_command('archive_games', '--batch-size', '3', stdout=StringIO())
+        self.assertEqual(GameArchive.objects.count(), len(game_ids))
+        self.assertFalse(Move.objects.filter(game_id__in=game_ids).exists())
+        game_cache.clear()
+        for game_id, (state, history) in zip(game_ids, before):
+            self.assertEqual(self.client.get('/games/%d/state/' % game_id).data['board_view'], state['board_view'])
+            self.assertEqual(self.client.get('/games/%d/history/' % game_id).data['results'], history)
+            game = Game.objects.get(pk=game_id)
+            self.assertTrue(game.archived)
+            self.assertEqual(game.replay().view(), game.get_board().view())
+
+
+class StatsTests(GameAPITestCase):
+
+    def test_recorded_stats_match_rebuild_stats(self):
+        for i in range(12):
+            game_id = self.new_game(8, 8, 10).data['id']
+            if i % 4 == 3:
+                self.move(game_id, 'reveal', 0, 0)
+                Game.objects.filter(pk=game_id).update(deadline=timezone.now() - timedelta(seconds=1))
+                continue
+            while True:
+                hint = self.client.get('/games/%d/hint/' % game_id).data
+                if hint['state'] in ('won', 'lost'):
+                    break
+                point = (hint['safe'] or [hint['guess']])[0]
+                self.move(game_id, 'reveal', point['x'], point['y'])
+        call_command('expire_games', stdout=StringIO())
+
+        def stats():
+            return sorted(PlayerStats.objects.values_list('player_id', 'rows', 'columns', 'mines', 'played', 'won',
+                                                          'lost', 'timeout', 'best_seconds'))
+        recorded = stats()
+        self.assertEqual(recorded[0][4:8], (12, Game.objects.filter(state=Game.STATE_WON).count(),
+                                            Game.objects.filter(state=Game.STATE_LOST).count(), 3))
+        call_command('rebuild_stats', stdout=StringIO())
+        self.assertEqual(stats(), recorded)
+
+    def test_win_in_no_time_is_the_best(self):
+        games = [Game(player=self.player, rows=9, columns=9, mines=10, state=Game.STATE_WON, duration_seconds=seconds)
+                 for seconds in (Game.DURATION_SECONDS, Game.DURATION_SECONDS - 5)]
+        PlayerStats.record(games)
+        self.assertEqual(PlayerStats.objects.get(player=self.player).best_seconds, 0)
+
+
+class SolverTests(SimpleTestCase):
+
+    def test_certain_cells_are_right(self):
+        board = Board.layout(16, 16, 40, 5, 8 * 16 + 8)
+        board.reveal(8, 8)
+        solver = Solver(16, 16, 40)
+        solver.update(board.view_rows(0, 0, 16, 16))
+        self.assertTrue(solver.safe_points() or solver.mine_points())
+        for x, y in solver.safe_points():
+            self.assertFalse(board.is_mine(x, y))
+        for x, y in solver.mine_points():
+            self.assertTrue(board.is_mine(x, y))
+
+    def test_wins_most_beginner_boards(self):
+        self.assertGreater(sum(play_seed(9, 9, 10, seed)[0] for seed in range(20)), 15)
+
+
+@override_settings(GAME_PUSH=True, CHANNEL_LAYERS={'default': {'BACKEND': 'channels.layers.InMemoryChannelLayer'}})
+class WebsocketTests(TransactionTestCase):
+    """Updates are pushed once their transaction commits, so these tests commit"""
+
+    def setUp(self):
+        game_cache.clear()
+        self.client = APIClient()
+        self.client.force_authenticate(User.objects.create_user('watcher'))
+
+    def post(self, path, data=None):
+        return sync_to_async(lambda: self.client.post(path, data, format='json'))()
+
+    def test_moves_are_pushed_to_the_watchers(self):
+        game_id = self.client.post('/games/new/?view=delta', {'rows': 10, 'columns': 10, 'mines': 10},
+                                   format='json').data['id']
+
+        async def watch():
+            communicator = WebsocketCommunicator(application, '/ws/games/%d/' % game_id)
+            connected, subprotocol = await communicator.connect()
+            self.assertTrue(connected)
+            message = await communicator.receive_json_from()
+            self.assertEqual((message['event'], message['state']), ('state', 'new'))
+            await self.post('/games/%d/mark_as_flag/' % game_id, {'x': 1, 'y': 1})
+            message = await communicator.receive_json_from()
+            self.assertEqual((message['event'], message['version']), ('update', 2))
+            self.assertEqual(len(message['changes']), 1)
+            await self.post('/games/%d/moves/' % game_id, {'moves': [{'move': 'flag', 'x': 2, 'y': 2},
+                                                                     {'move': 'flag', 'x': 3, 'y': 3}]})
+            message = await communicator.receive_json_from()
+            self.assertEqual(len(message['changes']), 2)
+            self.assertTrue(await communicator.receive_nothing())  # one message for the whole batch
+            await communicator.disconnect()
+
+        asyncio.get_event_loop().run_until_complete(watch())
+
+    def test_missing_game_is_closed(self):
+        async def watch():
+            communicator = WebsocketCommunicator(application, '/ws/games/999/')
+            await communicator.connect()
+            self.assertEqual((await communicator.receive_output())['type'], 'websocket.close')
+
+        asyncio.get_event_loop().run_until_complete(watch())
+
+    @override_settings(GAME_PUSH=False)
+    def test_nothing_is_pushed_without_push(self):
+        game_id = self.client.post('/games/new/', {'rows': 10, 'columns': 10, 'mines': 10}, format='json').data['id']
+
+        async def watch():
+            communicator = WebsocketCommunicator(application, '/ws/games/%d/' % game_id)
+            connected, code = await communicator.connect()
+            self.assertFalse(connected)
+            layer = get_channel_layer()
+            await layer.group_add(push.group_name(game_id), 'listener')
+            await self.post('/games/%d/mark_as_flag/' % game_id, {'x': 1, 'y': 1})
+            with self.assertRaises(asyncio.TimeoutError):
+                await asyncio.wait_for(layer.receive('listener'), 0.1)
+
+        asyncio.get_event_loop().run_until_complete(watch())
+
+
+class MigrationTests(TransactionTestCase):
+    """Data migrations on the rows of the first schema"""
+
+    def migrate(self, name):
+        """Migrates the api app to migration name. Returns the models of that state"""
+        executor = MigrationExecutor(connection)
+        executor.migrate([('api', name)])
+        return executor.loader.project_state([('api', name)]).apps
+
+    def tearDown(self):
+        call_command('migrate', verbosity=0)
+
+    def test_legacy_boards_are_packed_and_counted(self):
+        apps = self.migrate('0001_initial')
+        player = apps.get_model('auth', 'User').objects.create(username='legacy')
+        Game = apps.get_model('api', 'Game')
+        played = Game.objects.create(player=player, board='[["x", "1"], ["1", "1"]]',
+                                     player_board='[["h", "v"], ["!", "h"]]')
+        empty = Game.objects.create(player=player)  # as Game() or the admin create them
+        apps = self.migrate('0006_count_game_fields')
+        Game = apps.get_model('api', 'Game')
+        played, empty = Game.objects.get(pk=played.pk), Game.objects.get(pk=empty.pk)
+        self.assertEqual((played.rows, played.columns, bytes(played.cells)), (2, 2, b'\x10\x21\x61\x01'))
+        self.assertEqual((played.board, played.mines, played.hidden_safe_cells), ('', 1, 2))
+        self.assertEqual((bytes(empty.cells), empty.board, empty.mines, empty.hidden_safe_cells), (b'', '', 0, 0))
+        apps = self.migrate('0002_packed_board')
+        played = apps.get_model('api', 'Game').objects.get(pk=played.pk)
+        self.assertEqual((played.board, played.player_board),
+                         ('[["x", "1"], ["1", "1"]]', '[["h", "v"], ["!", "h"]]'))
+
+
+class FloodFillTests(SimpleTestCase):
+
+    def test_open_board_is_revealed_without_recursion(self):
+        game = Game()
+        game.set_board(Board(400, 400))
+        self.assertEqual(len(game.reveal_at(0, 0)), 400 * 400)
+        self.assertTrue(game.is_all_revealed())
+
+    def test_fill_stops_at_fields_with_adjacent_mines(self):
+        board = Board(5, 5)
+        board.cells[24] = MINE
+        for i in board.adjacent(24):
+            board.cells[i] = 1
+        self.assertEqual(board.reveal(4, 3), [(4, 3)])
+        self.assertEqual(len(board.reveal(0, 0)), 23)
+        self.assertEqual(board.hidden_safe_count(), 0)
+        self.assertEqual(board.view()[4], ['0', '0', '0', '1', ' '])
+
+
+class GameCacheTests(SimpleTestCase):
+
+    def test_boards_are_cached_per_version_and_copied(self):
+        cache = GameCache(max_games=2, max_fields=1000, ttl=60)
+        board = Board(3, 3)
+        cache.put(1, 5, board)
+        board.reveal(0, 0)
+        cached = cache.get(1, 5)
+        self.assertEqual(cached.cells, Board(3, 3).cells)
+        cached.reveal(0, 0)
+        self.assertEqual(cache.get(1, 5).cells, Board(3, 3).cells)
+        self.assertIsNone(cache.get(1, 6))
+        self.assertIsNone(cache.get(1, 5))  # the other version dropped it
+        self.assertEqual(cache.stats(), {'games': 0, 'fields': 0, 'hits': 2, 'misses': 2, 'evictions': 0})
+
+    def test_limits(self):
+        cache = GameCache(max_games=2, max_fields=20, ttl=60)
+        for game_id in (1, 2, 3):
+            cache.put(game_id, 1, Board(3, 3))
+        self.assertIsNone(cache.get(1, 1))
+        self.assertIsNotNone(cache.get(2, 1))
+        cache.put(4, 1, Board(5, 5))  # larger than max_fields
+        self.assertIsNone(cache.get(4, 1))
+        self.assertEqual(cache.stats()['evictions'], 1)
+        expired = GameCache(max_games=2, max_fields=20, ttl=0)
+        expired.put(1, 1, Board(3, 3))
+        self.assertIsNone(expired.get(1, 1))
+
+
+class GameCacheUseTests(GameAPITestCase):
+
+    def test_saved_board_is_served_until_the_game_changes(self):
+        game_id = self.new_game(9, 9, 10, storage='packed').data['id']
+        self.move(game_id, 'reveal', 4, 4)
+        hits = game_cache.hits
+        view = Game.objects.get(pk=game_id).get_board().view()
+        self.assertEqual(game_cache.hits, hits + 1)
+        # Saved by another worker: the cached board is stale
+        Game.objects.filter(pk=game_id).update(version=F('version') + 1, cells=bytes(Board(9, 9).cells),
+                                               snapshot_seq=F('move_count'))
+        misses = game_cache.misses
+        self.assertNotEqual(Game.objects.get(pk=game_id).get_board().view(), view)
+        self.assertEqual(game_cache.misses, misses + 1)
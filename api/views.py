@@ -1,24 +1,68 @@
 from rest_framework.decorators import detail_route, list_route
-from api.models import Game
+from rest_framework.exceptions import APIException, ValidationError
+from api.models import Game, GameConflict, PlayerStats
 from django.contrib.auth.models import User
 from rest_framework import viewsets
 from api.serializers import *
 from rest_framework.response import Response
 from rest_framework import permissions
 from api.permissions import IsOwnerOrReadOnly
+from api.cache import game_cache, layout_cache
+from api.solver import Solver, solver_cache
+from api import instrumentation, push
+from django.conf import settings
 from django.shortcuts import get_object_or_404
+from django.db import transaction
+from django.db.models import ExpressionWrapper, F, FloatField
+from django.http.multipartparser import parse_header
+from django.utils import timezone
+from django.utils.encoding import force_text
+from api.pagination import GameCursorPagination, MoveCursorPagination
+
+class Conflict(APIException):
+    status_code = 409
+    default_detail = 'The game was changed by other requests, try again.'
+    default_code = 'conflict'
+
 
 class GameViewSet(viewsets.ViewSet):
     """
     JSON API endpoint to process game requests through the following actions.
 
+    - `/`: **Returns** the games without their board, newest first and paginated with a `cursor` (see `next` and
+    `previous`). Optional arguments:
+        - state (new, started, paused, timeout, won or lost)
+        - player (username)
+        - created_after, created_before (date and time)
+        - page_size (up to 500)
     - `ID/state/`: **Returns** the game object.
     - `new/`: Creates a new game. **Returns** the game state. Arguments:
         - rows (number of rows)
         - columns (number of columns)
         - mines (number of mines, should be less than the board size)
-    - `ID/pause/`: Pauses a given game (stops time tracking). **Returns** the game state.
+        - seed (optional, the same seed, size and first revealed cell always place the mines in the same cells)
+        - board (optional, instead of rows, columns, mines and seed: the id of a shared board,
+        `ROWSxCOLUMNSxMINES-SEED` or `ROWSxCOLUMNSxMINES-SEED-FIRST` with the seed and the index of the first cell
+        in base 36)
+        - storage (optional, packed, chunked or seeded; boards larger than `GAME_CHUNKED_FIELDS` are chunked and
+        the rest seeded by default, unless they come from the pool, which are packed)
+
+    The mines are placed when the first cell is revealed, never in that cell or its adjacent cells. A board id with
+    a first cell places them around it when the game is created, so every game of the board has the same mines.
+    Boards without a seed are taken from the pool of boards generated ahead when it has one of the same size and
+    mines. Seeded boards only store what the player sees: the mines are placed again by the seed when the game is
+    not cached. Finished games return their `board_id`.
+    - `daily/`: **Returns** the `board` id of the shared board of the day (`date`, UTC). Optional arguments:
+        - rows, columns, mines (16, 30 and 99 by default)
+    - `bulk_new/`: Creates many games for the user at once. **Returns** the `count` of games created and the games
+    (without their board) in `results`. Same arguments as `new/` and:
+        - count (number of games, up to 1000; with a seed every game gets the same board)
+    Chunked boards are stored in chunks of 64x64 cells, which are only loaded or generated when a move reaches them,
+    so very large boards can be played.
+    - `ID/pause/`: Pauses a given game (stops time tracking, moves get a **400** until it is resumed). **Returns** the
+    game state.
     - `ID/resume/`: Resumes a given game (starts time tracking). **Returns** the game state.
+    - `ID/tick/`: Only kept for compatibility, the clock runs on the server. **Returns** the game state.
     - `ID/mark_as_flag/`: Set a flag mark in a given cell. **Returns** the game state. Arguments:
         - x (cell index)
         - y (cell index)
@@ -28,6 +72,45 @@ class GameViewSet(viewsets.ViewSet):
     - `ID/reveal/`: Reveals a given cell. **Returns** the game state. Arguments:
         - x (cell index)
         - y (cell index)
+    - `ID/hint/`: **Returns** the hidden cells that are certainly `safe` and those that certainly have a mine
+    (`mines`), deduced only from what the player sees, as lists of `x` and `y`. When no cell is certainly safe,
+    `guess` has the cell least likely to have a mine and that `probability`. Accepts `?region=` (required for boards
+    larger than `GAME_CHUNKED_FIELDS`) to only look at that part of the board (nothing is found outside of the board).
+    - `ID/history/`: **Returns** the moves played in the game (`seq`, `move`, `x`, `y` and `created`), in order and
+    paginated with a `cursor` (see `next`). Optional arguments:
+        - page_size (up to 5000)
+    The moves of archived games come in one page.
+    - `ID/moves/`: Plays a list of moves in order, stopping when the game is won or lost. **Returns** the game
+    state and, in `moves`, for each played move the number of `changed` cells and the game `state` after it.
+    Arguments:
+        - moves (list of objects with `move`: reveal, flag or question, `x` and `y`)
+    - `cache_stats/`: (admin only) **Returns** the board cache counters of the worker that serves the request, and
+    those of its cache of seeded mine layouts in `layouts`.
+    - `timing_stats/`: (admin only) **Returns** the request metrics per endpoint of the worker that serves the
+    request, if `API_TIMING` is enabled.
+
+    The move endpoints (`new`, `pause`, `resume`, `tick`, `mark_as_flag`, `mark_as_question`, `reveal` and
+    `moves`) accept `?view=delta` to **return** only the `changes` (cells revealed or marked by the request, with
+    their new `value`) and the game `version` instead of the whole `board_view`. `ID/state/` always returns the
+    board. Boards (or regions) larger than `GAME_CHUNKED_FIELDS` cells are never returned whole: the move endpoints
+    return the `?view=delta` format for them and `ID/state/` needs a `?region=` (**400** otherwise).
+
+    `ID/state/` and the move endpoints also accept `?region=X,Y,WIDTH,HEIGHT` to **return** only that part of the
+    board: `board_view` has `HEIGHT` rows of `WIDTH` cells from cell (`X`, `Y`), and `changes` only the cells in it.
+    The `region` returned is clipped to the board.
+
+    With `?board_format=rows` (or `Accept: application/json; board_format=rows`) `board_view` is returned as one
+    string per row instead of a matrix of one character strings, which is smaller and much faster to encode.
+
+    Moves on the same game can be sent concurrently: each one is applied on the latest saved game. A **409**
+    status is returned if a move could not be applied because of too many concurrent changes.
+
+    The clock starts with the first move (or `resume`) and `duration_seconds` is the time left to play.
+    A game finishes by timeout as soon as it is accessed after its time is over.
+
+    `ws/games/ID/` is a websocket that pushes the game `state` when it connects and then every update of the game,
+    with the format of the `?view=delta` responses and an `event`: state, update or timeout. The game finishes by
+    timeout while it is watched, no need to call `tick` or poll `state`. Only served with `GAME_PUSH` on.
 
     The current `state` can be:
 
@@ -49,6 +132,7 @@ class GameViewSet(viewsets.ViewSet):
     """
     permission_classes = (permissions.IsAuthenticatedOrReadOnly,
                           IsOwnerOrReadOnly,)
+    update_attempts = 5
 
     def get(self, request, pk, format=None):
         queryset = Game.objects.all()
@@ -57,18 +141,110 @@ class GameViewSet(viewsets.ViewSet):
         return Response(serializer.data)
 
     def list(self, request):
-        queryset = Game.objects.all()
-        serializer = GameSerializer(queryset, many=True)
-        return Response(serializer.data)
+        filters = GameListFilterSerializer(data=request.query_params)
+        filters.is_valid(raise_exception=True)
+        queryset = Game.objects.select_related('player').defer('cells', 'board', 'player_board')
+        if 'state' in filters.validated_data:
+            queryset = queryset.filter(state=filters.validated_data['state'])
+        if 'player' in filters.validated_data:
+            queryset = queryset.filter(player__username=filters.validated_data['player'])
+        if 'created_after' in filters.validated_data:
+            queryset = queryset.filter(created__gte=filters.validated_data['created_after'])
+        if 'created_before' in filters.validated_data:
+            queryset = queryset.filter(created__lt=filters.validated_data['created_before'])
+        paginator = GameCursorPagination()
+        page = paginator.paginate_queryset(queryset, request, view=self)
+        with instrumentation.timer('serialize_seconds'):
+            data = GameSummarySerializer(page, many=True).data
+        return paginator.get_paginated_response(data)
+
+    def initial(self, request, *args, **kwargs):
+        super(GameViewSet, self).initial(request, *args, **kwargs)
+        # Checked before any move is applied. The board format can also be asked for as a media type parameter
+        options = dict(request.query_params.items())
+        media_type_params = parse_header(request.accepted_media_type.encode('ascii'))[1]
+        if 'board_format' not in options and 'board_format' in media_type_params:
+            options['board_format'] = force_text(media_type_params['board_format'])
+        serializer = GameViewOptionsSerializer(data=options)
+        serializer.is_valid(raise_exception=True)
+        self.region = serializer.validated_data.get('region')
+        self.board_format = serializer.validated_data.get('board_format', 'cells')
+
+    def serializer_context(self, request, game, extra):
+        """Returns the serializer context, with the `?region=` requested clipped to the board (also added to extra)"""
+        context = {'request': request, 'board_format': self.board_format}
+        if self.region:
+            x, y, width, height = self.region
+            context['region'] = (x, y, max(0, min(width, game.columns - x)), max(0, min(height, game.rows - y)))
+            extra['region'] = dict(zip(('x', 'y', 'width', 'height'), context['region']))
+        return context
+
+    def board_window(self, game, context):
+        """
+        Returns the part of the board (x, y, width, height) the response covers, the `?region=` or the whole board,
+        and whether it is larger than GAME_CHUNKED_FIELDS cells, too large to return
+        """
+        x, y, width, height = context.get('region') or (0, 0, game.columns, game.rows)
+        return (x, y, width, height), width * height > getattr(settings, 'GAME_CHUNKED_FIELDS', 1024 * 1024)
+
+    def game_response(self, request, game, **extra):
+        """
+        Returns the game state, with only the changed cells if the request asks for `?view=delta` or the board (or
+        region) is too large to return
+        """
+        context = self.serializer_context(request, game, extra)
+        if request.query_params.get('view') == 'delta' or self.board_window(game, context)[1]:
+            serializer = GameDeltaSerializer(game, context=context)
+        else:
+            serializer = GameSerializer(game, context=context)
+        with instrumentation.timer('serialize_seconds'):
+            data = dict(serializer.data, **extra)
+        return Response(data)
 
     def get_object(self, pk):
-        return get_object_or_404(Game, pk=pk)
+        # The board columns are only loaded if the board is not in the process cache (see Game.get_board)
+        game = get_object_or_404(Game.objects.defer('cells', 'board', 'player_board'), pk=pk)
+        self.check_object_permissions(self.request, game)
+        if game.check_timeout():
+            try:
+                game.save()
+            except GameConflict:
+                return self.get_object(pk)
+            push.publish(game, push.EVENT_TIMEOUT)
+        return game
+
+    def update_game(self, pk, change, game=None):
+        """
+        Applies change(game) to the game and saves it. change returns whether it changed the game (such as the points
+        changed by a move): a game that did not change is not saved. If another request saved the game in between,
+        the game is loaded again and the change retried, up to update_attempts times. The update is pushed to the
+        websockets watching the game. Returns the game.
+        """
+        for attempt in range(self.update_attempts):
+            if game is None:
+                game = self.get_object(pk)
+            if not change(game):
+                return game
+            try:
+                game.save()
+                push.publish(game)
+                return game
+            except GameConflict:
+                game = None
+        raise Conflict()
 
     @detail_route(methods=['get'])
     def state(self, request, pk=None):
         game = self.get_object(pk)
-        serializer = GameSerializer(game, context={'request': request})
-        return Response(serializer.data)
+        extra = {}
+        context = self.serializer_context(request, game, extra)
+        if self.board_window(game, context)[1]:
+            raise ValidationError({'region': ['Ask for a region of at most %d cells' % getattr(
+                settings, 'GAME_CHUNKED_FIELDS', 1024 * 1024)]})
+        serializer = GameSerializer(game, context=context)
+        with instrumentation.timer('serialize_seconds'):
+            data = dict(serializer.data, **extra)
+        return Response(data)
 
     @list_route(methods=['get','post'])
     def new(self, request, *args, **kwargs):
@@ -81,88 +257,201 @@ class GameViewSet(viewsets.ViewSet):
             mines = serializer.validated_data['mines']
             game = Game()
             game.title = 'Game for user %s' % player.username
-            board, player_board = Game.new_boards(rows, columns, mines)
-            game.board = board
-            game.player_board = player_board
+            game.setup(rows, columns, mines, serializer.validated_data.get('seed'),
+                       serializer.validated_data.get('storage'), serializer.validated_data.get('first'))
             game.state = Game.STATE_NEW
             game.player = player
             game.save()
-        serializer = GameSerializer(game, context={'request': request})
-        return Response(serializer.data)
+        return self.game_response(request, game)
+
+    @detail_route(methods=['get'])
+    def hint(self, request, pk=None):
+        """Returns the certain cells and the best guess of the solver (see api.solver), which is kept for the next
+        hint"""
+        game = self.get_object(pk)
+        extra = {}
+        (x, y, width, height), too_large = self.board_window(game, self.serializer_context(request, game, extra))
+        if too_large:
+            raise ValidationError({'region': ['Ask for a region of at most %d cells' % getattr(
+                settings, 'GAME_CHUNKED_FIELDS', 1024 * 1024)]})
+        data = dict(id=game.id, state=game.get_state_display(), version=game.version, safe=[], mines=[], guess=None,
+                    **extra)
+        if game.is_finished() or not width or not height:
+            return Response(data)  # nothing to solve, or a region outside of the board
+        if not game.mines_placed:
+            # The first reveal never has a mine
+            data['guess'] = {'x': x + width // 2, 'y': y + height // 2, 'probability': 0.0}
+            return Response(data)
+        key = (game.id, x, y, width, height)
+        board = game.get_board()
+        solver = solver_cache.take(key) or Solver(game.rows, game.columns, game.mines, x, y, width, height)
+        if not solver.update(board.view_rows(*solver.view_region())):
+            solver = Solver(game.rows, game.columns, game.mines, x, y, width, height)
+            solver.update(board.view_rows(*solver.view_region()))
+        data['safe'] = [{'x': x, 'y': y} for x, y in solver.safe_points()]
+        data['mines'] = [{'x': x, 'y': y} for x, y in solver.mine_points()]
+        if not data['safe']:
+            guess = solver.guess()
+            if guess is not None:
+                data['guess'] = {'x': guess[0][0], 'y': guess[0][1], 'probability': round(guess[1], 6)}
+        solver_cache.put(key, solver)
+        return Response(data)
+
+    @detail_route(methods=['get'])
+    def history(self, request, pk=None):
+        """Returns the moves played in the game, in order and paginated"""
+        game = get_object_or_404(Game.objects.only('id', 'archived'), pk=pk)
+        if game.archived:
+            # The whole log of an archived game is decoded at once, so it comes in one page
+            return Response({'next': None, 'previous': None,
+                             'results': MoveSerializer(game.archive.move_log(), many=True).data})
+        paginator = MoveCursorPagination()
+        page = paginator.paginate_queryset(game.move_log.all(), request, view=self)
+        return paginator.get_paginated_response(MoveSerializer(page, many=True).data)
+
+    @list_route(methods=['post'])
+    def bulk_new(self, request):
+        """Creates many games with one insert, boards taken from the pool as far as it has them"""
+        serializer = GameBulkNewSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        data = serializer.validated_data
+        games = Game.create_games(request.user, data['rows'], data['columns'], data['mines'], data['count'],
+                                  data.get('seed'), data.get('storage'), first=data.get('first'))
+        return Response({'count': len(games), 'results': GameSummarySerializer(games, many=True).data})
+
+    @list_route(methods=['get'])
+    def daily(self, request):
+        """Returns the id of today's shared board (UTC), the same for every player"""
+        serializer = DailyBoardSerializer(data=request.query_params)
+        serializer.is_valid(raise_exception=True)
+        day = timezone.now().date()
+        data = serializer.validated_data
+        return Response({'date': day.isoformat(),
+                         'board': Game.daily_board_id(data['rows'], data['columns'], data['mines'], day)})
+
+    @list_route(methods=['get'], permission_classes=[permissions.IsAdminUser])
+    def cache_stats(self, request):
+        """Returns the counters of the board and layout caches of the worker process that serves the request"""
+        return Response(dict(game_cache.stats(), layouts=layout_cache.stats()))
+
+    @list_route(methods=['get'], permission_classes=[permissions.IsAdminUser])
+    def timing_stats(self, request):
+        """Returns the request metrics per endpoint of the worker process that serves the request (see
+        api.middleware.TimingMiddleware)"""
+        return Response(instrumentation.endpoint_stats.snapshot())
 
     @detail_route(methods=['post'])
     def tick(self, request, pk=None):
-        """Gets a clock tick from the client. Each tick represents a second passed by during the game.
-        If duration_seconds gets to 0 then the game is over"""
+        """Kept for old clients: the clock runs on the server, so this only returns the game state
+        (finished by timeout if the time is over)"""
         game = self.get_object(pk)
-        game.duration_seconds -= 1
-        if game.duration_seconds == 0:
-            game.state = Game.STATE_TIMEOUT
-        game.save()
-        serializer = GameSerializer(game, context={'request': request})
-        return Response(serializer.data)
+        return self.game_response(request, game)
 
     @detail_route(methods=['post'])
     def pause(self, request, pk=None):
-        game = self.get_object(pk)
-        game.state = Game.STATE_PAUSED
-        game.save()
-        serializer = GameSerializer(game, context={'request': request})
-        return Response(serializer.data)
+        game = self.update_game(pk, lambda game: game.pause())
+        return self.game_response(request, game)
 
     @detail_route(methods=['post'])
     def resume(self, request, pk=None):
+        game = self.update_game(pk, lambda game: game.resume())
+        return self.game_response(request, game)
+
+    def playable_game(self, pk):
+        """Returns the game to play a move on, which can not be paused: its clock is stopped"""
         game = self.get_object(pk)
-        game.duration_seconds -= 1
-        game.state = Game.STATE_STARTED
-        game.save()
-        serializer = GameSerializer(game, context={'request': request})
-        return Response(serializer.data)
+        if game.state == Game.STATE_PAUSED:
+            raise ValidationError({'state': ['The game is paused, resume it to play']})
+        return game
+
+    def play_field(self, request, pk, move):
+        """Plays a move in the cell of the request, which should be on the board"""
+        game = self.playable_game(pk)
+        serializer = GameFieldSerializer(data=request.data, context={'game': game})
+        serializer.is_valid(raise_exception=True)
+        x = serializer.validated_data['x']
+        y = serializer.validated_data['y']
+        game = self.update_game(pk, lambda game: game.play(move, x, y), game)
+        return self.game_response(request, game)
 
     @detail_route(methods=['post'])
     def mark_as_flag(self, request, pk=None):
-        serializer = GameFieldSerializer(data=request.data)
-        game = self.get_object(pk)
-        if serializer.is_valid(raise_exception=True):
-            x = serializer.validated_data['x']
-            y = serializer.validated_data['y']
-            game.mark_flag_at(x, y)
-            game.save()
-        serializer = GameSerializer(game, context={'request': request})
-        return Response(serializer.data)
+        return self.play_field(request, pk, Game.MOVE_FLAG)
 
     @detail_route(methods=['post'])
     def mark_as_question(self, request, pk=None):
-        serializer = GameFieldSerializer(data=request.data)
-        game = self.get_object(pk)
-        if serializer.is_valid(raise_exception=True):
-            x = serializer.validated_data['x']
-            y = serializer.validated_data['y']
-            game.mark_question_at(x, y)
-            game.save()
-        serializer = GameSerializer(game, context={'request': request})
-        return Response(serializer.data)
+        return self.play_field(request, pk, Game.MOVE_QUESTION)
 
     @detail_route(methods=['post'])
     def reveal(self, request, pk=None):
-        serializer = GameFieldSerializer(data=request.data)
-        game = self.get_object(pk)
-        if serializer.is_valid(raise_exception=True):
-            x = serializer.validated_data['x']
-            y = serializer.validated_data['y']
-            game.reveal_at(x, y)
-            if game.is_mine_at(x, y):
-                game.state = Game.STATE_LOST
-            elif game.is_all_revealed():
-                game.state = Game.STATE_WON
-            game.save()
-        serializer = GameSerializer(game, context={'request': request})
-        return Response(serializer.data)
+        return self.play_field(request, pk, Game.MOVE_REVEAL)
+
+    @detail_route(methods=['post'])
+    def moves(self, request, pk=None):
+        """Plays a list of moves in order and saves the game once. Stops when the game is won or lost"""
+        game = self.playable_game(pk)
+        serializer = GameMovesSerializer(data=request.data, context={'game': game})
+        serializer.is_valid(raise_exception=True)
+        results = []
+
+        def play_moves(game):
+            del results[:]
+            for move in serializer.validated_data['moves']:
+                if game.is_finished():
+                    break
+                changed = game.play(move['move'], move['x'], move['y'])
+                results.append({'move': move['move'], 'x': move['x'], 'y': move['y'],
+                                'changed': len(changed), 'state': game.get_state_display()})
+            return any(result['changed'] for result in results)
+
+        with transaction.atomic():
+            game = self.update_game(pk, play_moves, game)
+        return self.game_response(request, game, moves=results)
 
 
 class UserViewSet(viewsets.ReadOnlyModelViewSet):
     """
-    This viewset automatically provides `list` and `detail` actions.
+    This viewset automatically provides `list` and `detail` actions (with `games_url`, the game list filtered by the
+    user: `/games/?player=USERNAME`), and:
+
+    - `ID/stats/`: **Returns** the results of the finished games of the user: `played`, `won`, `lost`, `timeout`
+    and `win_rate`, in total and per board configuration (`rows`, `columns` and `mines`, with the fastest win in
+    `best_seconds`) in `configurations`.
+    - `leaderboard/`: **Returns** the players with the best results in a board configuration. Arguments:
+        - rows, columns and mines
+        - order (optional, best_time (default), win_rate or won)
+        - min_played (optional, finished games needed to be listed)
+        - limit (optional, up to 500 players, 50 by default)
+
+    The results are counted as games finish, so they are read without going through the games.
     """
-    queryset = User.objects.all()
+    queryset = User.objects.order_by('id').only('id', 'username')
     serializer_class = UserSerializer
+
+    @detail_route(methods=['get'])
+    def stats(self, request, pk=None):
+        user = get_object_or_404(User.objects.only('id', 'username'), pk=pk)
+        configurations = list(user.stats.order_by('rows', 'columns', 'mines'))
+        totals = dict((field, sum(getattr(stats, field) for stats in configurations))
+                      for field in ('played', 'won', 'lost', 'timeout'))
+        totals['win_rate'] = round(float(totals['won']) / totals['played'], 4) if totals['played'] else 0.0
+        return Response(dict(totals, id=user.id, username=user.username,
+                             configurations=PlayerStatsSerializer(configurations, many=True).data))
+
+    @list_route(methods=['get'])
+    def leaderboard(self, request):
+        filters = LeaderboardFilterSerializer(data=request.query_params)
+        filters.is_valid(raise_exception=True)
+        data = filters.validated_data
+        queryset = PlayerStats.objects.select_related('player').filter(
+            rows=data['rows'], columns=data['columns'], mines=data['mines'], played__gte=data.get('min_played', 1))
+        order = data.get('order', 'best_time')
+        if order == 'best_time':
+            queryset = queryset.filter(best_seconds__isnull=False).order_by('best_seconds', 'updated')
+        elif order == 'win_rate':
+            queryset = queryset.order_by(ExpressionWrapper(F('won') * 1.0 / F('played'),
+                                                           output_field=FloatField()).desc(), '-played')
+        else:
+            queryset = queryset.order_by('-won', 'played')
+        return Response({'order': order, 'results': LeaderboardSerializer(
+            queryset[:data.get('limit', 50)], many=True).data})
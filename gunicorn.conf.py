@@ -0,0 +1,29 @@
+"""
+Gunicorn settings (gunicorn minesweeper.wsgi -c gunicorn.conf.py), from the environment:
+
+- PORT: port to listen on (8000)
+- WEB_CONCURRENCY: worker processes (one per CPU plus one)
+- GUNICORN_THREADS: threads per worker (4). With more than one the workers are gthread workers: a worker keeps
+  serving requests while others wait on the database, and its threads share its board cache and keep their database
+  connections (DB_CONN_MAX_AGE)
+- GUNICORN_TIMEOUT, GUNICORN_KEEPALIVE: seconds (30 and 5)
+- GUNICORN_MAX_REQUESTS: requests a worker serves before it is replaced (0 never replaces it)
+- GUNICORN_PRELOAD: 1 (the default) imports the app once in the master before forking the workers, so a new worker
+  serves requests right away and shares the imported code with the others. Set it to 0 to reload the code on HUP
+- API_SLIM: 1 (the default here) starts the workers with the slim profile of the settings, without the channels app
+  (websockets are served by daphne) and with the admin loaded on its first request. Set it to 0 for the full app
+"""
+import multiprocessing
+import os
+
+os.environ.setdefault('API_SLIM', '1')
+
+bind = '0.0.0.0:%s' % os.getenv('PORT', '8000')
+workers = int(os.getenv('WEB_CONCURRENCY', multiprocessing.cpu_count() + 1))
+threads = int(os.getenv('GUNICORN_THREADS', 4))
+worker_class = 'gthread' if threads > 1 else 'sync'
+timeout = int(os.getenv('GUNICORN_TIMEOUT', 30))
+keepalive = int(os.getenv('GUNICORN_KEEPALIVE', 5))
+max_requests = int(os.getenv('GUNICORN_MAX_REQUESTS', 0))
+max_requests_jitter = max_requests // 10
+preload_app = os.getenv('GUNICORN_PRELOAD', '1') == '1'
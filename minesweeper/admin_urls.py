@@ -0,0 +1,7 @@
+"""Admin site, loaded on its first request (see minesweeper/urls.py)"""
+from django.contrib import admin
+
+# Imports the admin modules of the apps, which the slim profile does not do when the worker starts (see API_SLIM)
+admin.autodiscover()
+
+urlpatterns = admin.site.get_urls()
@@ -0,0 +1,16 @@
+"""
+ASGI config for minesweeper project.
+
+It exposes the ASGI callable as a module-level variable named ``application``, which serves the HTTP API and the
+game websockets (see minesweeper/routing.py). Run it with ``daphne minesweeper.asgi:application``.
+"""
+
+import os
+
+import django
+from channels.routing import get_default_application
+
+os.environ.setdefault("DJANGO_SETTINGS_MODULE", "minesweeper.settings")
+django.setup()
+
+application = get_default_application()
@@ -0,0 +1,14 @@
+"""API schema and documentation, loaded on their first request (see minesweeper/urls.py)"""
+from django.conf.urls import url
+from rest_framework.documentation import include_docs_urls
+from rest_framework.schemas import get_schema_view
+
+API_TITLE = 'Minesweeper API'
+API_DESCRIPTION = 'A Web API for minesweeper game.'
+schema_view = get_schema_view(title=API_TITLE)
+
+
+urlpatterns = [
+    url(r'^schema/$', schema_view),
+    url(r'^docs/', include_docs_urls(title=API_TITLE, description=API_DESCRIPTION))
+]
@@ -0,0 +1,14 @@
+"""
+Channels routing of the ASGI application (see minesweeper/asgi.py). HTTP requests go to the Django views.
+"""
+from channels.routing import ProtocolTypeRouter, URLRouter
+from channels.security.websocket import AllowedHostsOriginValidator
+from django.conf.urls import url
+
+from api.consumers import GameConsumer
+
+application = ProtocolTypeRouter({
+    'websocket': AllowedHostsOriginValidator(URLRouter([
+        url(r'^ws/games/(?P<pk>[0-9]+)/$', GameConsumer),
+    ])),
+})
@@ -30,10 +30,18 @@ DEBUG = True
 ALLOWED_HOSTS = ['*']
 
 
+# Slim profile of the production workers (on with ENVIRONMENT=production and in gunicorn, see gunicorn.conf.py): the
+# channels app, which only adds websockets to runserver and imports daphne and twisted, is left out and the admin
+# modules are only imported on the first request to the admin. The admin and the API docs (schema/ and docs/) are
+# served if API_ADMIN and API_DOCS are on, and loaded on their first request (see minesweeper/urls.py and the
+# startup_benchmark command)
+API_SLIM = os.getenv('API_SLIM', '1' if ENVIRONMENT == 'production' else '0') == '1'
+API_ADMIN = os.getenv('API_ADMIN', '1') == '1'
+API_DOCS = os.getenv('API_DOCS', '1') == '1'
+
 # Application definition
 
 INSTALLED_APPS = [
-    'django.contrib.admin',
     'django.contrib.auth',
     'django.contrib.contenttypes',
     'django.contrib.sessions',
@@ -42,6 +50,10 @@ INSTALLED_APPS = [
     'rest_framework',
     'api.apps.ApiConfig',
 ]
+if API_ADMIN:
+    INSTALLED_APPS.insert(0, 'django.contrib.admin.apps.SimpleAdminConfig' if API_SLIM else 'django.contrib.admin')
+if not API_SLIM:
+    INSTALLED_APPS.insert(-1, 'channels')
 
 MIDDLEWARE = [
     'django.middleware.security.SecurityMiddleware',
@@ -51,6 +63,7 @@ MIDDLEWARE = [
     'django.contrib.auth.middleware.AuthenticationMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
+    'api.middleware.TimingMiddleware',
 ]
 
 ROOT_URLCONF = 'minesweeper.urls'
@@ -72,17 +85,78 @@ TEMPLATES = [
 ]
 
 WSGI_APPLICATION = 'minesweeper.wsgi.application'
+ASGI_APPLICATION = 'minesweeper.routing.application'
+
+# Game updates pushed to the websockets (see api.push), on with GAME_PUSH=1 or a REDIS_URL. The in memory layer only
+# reaches the websockets served by the same process (a single daphne process): when the API runs in several processes,
+# such as gunicorn workers, set REDIS_URL (and install channels_redis). Without push the websockets are refused.
+GAME_PUSH = os.getenv('GAME_PUSH', '1' if os.getenv('REDIS_URL') else '0') == '1'
+if os.getenv('REDIS_URL'):
+    CHANNEL_LAYERS = {
+        'default': {
+            'BACKEND': 'channels_redis.core.RedisChannelLayer',
+            'CONFIG': {'hosts': [os.getenv('REDIS_URL')]},
+        },
+    }
+else:
+    CHANNEL_LAYERS = {
+        'default': {
+            'BACKEND': 'channels.layers.InMemoryChannelLayer',
+        },
+    }
 
 
 # Database
 # https://docs.djangoproject.com/en/1.10/ref/settings/#databases
 
+# Connections are kept for DB_CONN_MAX_AGE seconds (0 closes them after every request) and checked before a request
+# at most every DB_HEALTH_CHECK_SECONDS (see api.db)
 DATABASES = {
     'default':
     dj_database_url.config(
-        default='sqlite:///{}'.format(os.path.join(BASE_DIR, 'db.sqlite3'))
+        default='sqlite:///{}'.format(os.path.join(BASE_DIR, 'db.sqlite3')),
+        conn_max_age=int(os.getenv('DB_CONN_MAX_AGE', 600))
     )
 }
+DB_HEALTH_CHECK_SECONDS = int(os.getenv('DB_HEALTH_CHECK_SECONDS', 30))
+
+REST_FRAMEWORK = {
+    # orjson or ujson encode the responses when one of them is installed (see api.renderers)
+    'DEFAULT_RENDERER_CLASSES': (
+        'api.renderers.FastJSONRenderer',
+        'rest_framework.renderers.BrowsableAPIRenderer',
+    ),
+}
+
+# Per process cache of decoded boards (see api.cache)
+GAME_CACHE_GAMES = int(os.getenv('GAME_CACHE_GAMES', 256))
+GAME_CACHE_FIELDS = int(os.getenv('GAME_CACHE_FIELDS', 64 * 1024 * 1024))
+GAME_CACHE_TTL = int(os.getenv('GAME_CACHE_TTL', 300))
+# and of the mine layouts of seeded games, which are generated again instead of stored
+GAME_LAYOUT_CACHE_FIELDS = int(os.getenv('GAME_LAYOUT_CACHE_FIELDS', 16 * 1024 * 1024))
+
+# New boards with more fields than this are stored in chunks (see api.chunks)
+GAME_CHUNKED_FIELDS = int(os.getenv('GAME_CHUNKED_FIELDS', 1024 * 1024))
+
+# Moves between snapshots of a packed board, in between only the moves are written (see Game.save)
+GAME_SNAPSHOT_MOVES = int(os.getenv('GAME_SNAPSHOT_MOVES', 100))
+
+# Finished games are moved to the compressed archive this many days after their last change (see the
+# archive_games command)
+GAME_ARCHIVE_DAYS = int(os.getenv('GAME_ARCHIVE_DAYS', 30))
+
+# Solvers kept between hint requests, each one holds the view of its board (see api.solver)
+GAME_SOLVER_CACHE = int(os.getenv('GAME_SOLVER_CACHE', 64))
+
+# Boards generated ahead for new games without a seed: (rows, columns, mines) and boards kept of each one
+# (see the fill_board_pool command)
+GAME_POOL_CONFIGS = [(9, 9, 10), (16, 16, 40), (16, 30, 99)]
+GAME_POOL_SIZE = int(os.getenv('GAME_POOL_SIZE', 1000))
+
+# Request timing and sampled profiling (see api.middleware.TimingMiddleware)
+API_TIMING = os.getenv('API_TIMING', '0') == '1'
+API_PROFILE_SAMPLE_RATE = float(os.getenv('API_PROFILE_SAMPLE_RATE', 0))
+API_PROFILE_DIR = os.getenv('API_PROFILE_DIR', os.path.join(BASE_DIR, 'profiles'))
 
 
 # Password validation
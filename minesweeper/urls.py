@@ -13,20 +13,18 @@ Including another URLconf
     1. Import the include() function: from django.conf.urls import url, include
     2. Add a URL to urlpatterns:  url(r'^blog/', include('blog.urls'))
 """
-from django.contrib import admin
+from django.conf import settings
 from django.conf.urls import include, url
-from rest_framework.schemas import get_schema_view
-from rest_framework.documentation import include_docs_urls
-
-API_TITLE = 'Minesweeper API'
-API_DESCRIPTION = 'A Web API for minesweeper game.'
-schema_view = get_schema_view(title=API_TITLE)
+from django.urls.resolvers import RegexURLResolver
 
 
 urlpatterns = [
-    url(r'^admin/', admin.site.urls),
-    url(r'^schema/$', schema_view),
     url(r'^', include('api.urls')),
     url(r'^api-auth/', include('rest_framework.urls')),
-    url(r'^docs/', include_docs_urls(title=API_TITLE, description=API_DESCRIPTION))
-]
\ No newline at end of file
+]
+# The admin, schema and docs URLconfs are given by name so that they are only imported when a URL is resolved past
+# the API ones or reversed, not when a worker starts (see API_SLIM)
+if settings.API_ADMIN:
+    urlpatterns.append(RegexURLResolver(r'^admin/', 'minesweeper.admin_urls', app_name='admin', namespace='admin'))
+if settings.API_DOCS:
+    urlpatterns.append(RegexURLResolver(r'^', 'minesweeper.docs_urls'))
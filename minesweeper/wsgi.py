@@ -8,9 +8,15 @@ https://docs.djangoproject.com/en/1.10/howto/deployment/wsgi/
 """
 
 import os
+from importlib import import_module
 
+from django.conf import settings
 from django.core.wsgi import get_wsgi_application
 
 os.environ.setdefault("DJANGO_SETTINGS_MODULE", "minesweeper.settings")
 
 application = get_wsgi_application()
+
+# The URLconf, and with it the API views, is imported now instead of on the first request: once in the gunicorn
+# master when the app is preloaded, before the workers are forked
+import_module(settings.ROOT_URLCONF)